@@ -1,43 +1,62 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 import os
 import uuid
+import hashlib
+import re
+import mimetypes
+import socket
 import random
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import sentry_sdk
-from sentry_sdk.integrations.flask import FlaskIntegration
-from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import boto3
-from botocore.exceptions import ClientError
-from PIL import Image
+import threading
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 import io
+import shutil
+import json
+import base64
+from search import ItemSearchIndex
+from migrations import upgrade, create_missing_schema, create_tables, create_indexes, create_retired_index, add_columns, drop_indexes, run_all
+from scheduler import Scheduler
+from mailer import create_mailer
+from pubsub import create_broker
+from cache import create_cache
+from response_cache import ResponseCache
+from serializers import Projection, FastJSONProvider
+from query_stats import QueryInspector
+from metrics import Metrics, cache_lookup
+from db_routing import RoutingSession, ReplicaRouter, pool_options
+from passwords import PasswordHasher, PasswordHasherBusy
+from images import ImagePipeline, render_renditions, rendition_filename, rendition_filenames
 
 load_dotenv()
 
-# Initialize Sentry for error tracking
-sentry_sdk.init(
-    dsn=os.getenv('SENTRY_DSN', ''),  # Add your Sentry DSN to .env
-    integrations=[
-        FlaskIntegration(),
-        SqlalchemyIntegration(),
-    ],
-    traces_sample_rate=0.1,
-    environment=os.getenv('ENVIRONMENT', 'development')
-)
+# Initialize Sentry for error tracking (only imported when a DSN is configured; it is slow to load)
+if os.getenv('SENTRY_DSN'):  # Add your Sentry DSN to .env
+    import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
+    from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+    sentry_sdk.init(
+        dsn=os.getenv('SENTRY_DSN'),
+        integrations=[
+            FlaskIntegration(),
+            SqlalchemyIntegration(),
+        ],
+        traces_sample_rate=0.1,
+        environment=os.getenv('ENVIRONMENT', 'development')
+    )
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson when installed
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_PER_PAGE'] = 100  # larger per_page requests are capped
 
 # AWS S3 Configuration
 app.config['AWS_ACCESS_KEY_ID'] = os.getenv('AWS_ACCESS_KEY_ID')
@@ -45,17 +64,154 @@ app.config['AWS_SECRET_ACCESS_KEY'] = os.getenv('AWS_SECRET_ACCESS_KEY')
 app.config['AWS_REGION'] = os.getenv('AWS_REGION', 'us-east-1')
 app.config['S3_BUCKET_NAME'] = os.getenv('S3_BUCKET_NAME')
 
-# Initialize S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-    aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-    region_name=app.config['AWS_REGION']
-) if app.config['AWS_ACCESS_KEY_ID'] else None
+# Local upload serving; set UPLOADS_ACCEL_PREFIX (e.g. /protected-uploads/) behind nginx to hand files off via X-Accel-Redirect
+app.config['UPLOADS_ACCEL_PREFIX'] = os.getenv('UPLOADS_ACCEL_PREFIX')
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'  # Apache/lighttpd
+app.config['UPLOADS_MAX_AGE'] = 31536000  # content-hashed names never change
+app.config['LEGACY_UPLOADS_MAX_AGE'] = 86400
+
+# Image processing runs off the request thread (IMAGE_WORKERS=0 processes inline)
+app.config['IMAGE_WORKERS'] = int(os.getenv('IMAGE_WORKERS', 2))
+app.config['IMAGE_WEBP'] = os.getenv('IMAGE_WEBP', 'false').lower() == 'true'
+app.config['IMAGE_INLINE_CONCURRENCY'] = int(os.getenv('IMAGE_INLINE_CONCURRENCY', 4))  # per request when inline
+app.config['IMAGE_MAX_PENDING'] = int(os.getenv('IMAGE_MAX_PENDING', 16))  # queued per process; beyond it requests process inline
+# Jobs no worker finished (restart, crash) are retried by `flask requeue-images`, then marked failed
+app.config['IMAGE_JOB_STALE_MINUTES'] = int(os.getenv('IMAGE_JOB_STALE_MINUTES', 10))
+app.config['IMAGE_JOB_MAX_ATTEMPTS'] = int(os.getenv('IMAGE_JOB_MAX_ATTEMPTS', 3))
+image_pipeline = ImagePipeline(
+    app.config['IMAGE_WORKERS'], app.config['IMAGE_INLINE_CONCURRENCY'], app.config['IMAGE_MAX_PENDING']
+)
 
-db = SQLAlchemy(app)
+# Prometheus metrics at /metrics
+metrics = Metrics(app)
+
+# AWS clients are created on first use: importing boto3 and building a client
+# takes hundreds of milliseconds that cold starts should not pay up front
+_aws_lock = threading.Lock()
+_aws_session = None
+_s3_client = None
+
+def aws_session():
+    """The boto3 session AWS clients are created from; it times their calls for /metrics"""
+    global _aws_session
+    with _aws_lock:
+        if _aws_session is None:
+            import boto3
+            boto3.setup_default_session()
+            metrics.instrument_boto3(boto3.DEFAULT_SESSION)
+            _aws_session = boto3.DEFAULT_SESSION
+        return _aws_session
+
+def s3_enabled():
+    return bool(app.config['AWS_ACCESS_KEY_ID'] and app.config['S3_BUCKET_NAME'])
+
+def s3_client():
+    """Shared S3 client, created on the first upload or delete"""
+    global _s3_client
+    if _s3_client is None:
+        session = aws_session()
+        with _aws_lock:
+            if _s3_client is None:
+                _s3_client = session.client(
+                    's3',
+                    aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
+                    region_name=app.config['AWS_REGION']
+                )
+    return _s3_client
+
+# Pub/sub for pushed events (in-process unless REDIS_URL is set)
+app.config['REDIS_URL'] = os.getenv('REDIS_URL')
+# /api/events is off without REDIS_URL (events published by one worker would never reach streams held
+# by another) unless enabled for a single process; clients then poll. Each open stream holds a thread.
+app.config['EVENT_STREAM_ENABLED'] = os.getenv(
+    'EVENT_STREAM_ENABLED', 'true' if app.config['REDIS_URL'] else 'false'
+).lower() == 'true'
+app.config['EVENT_STREAM_MAX_CONNECTIONS'] = int(os.getenv('EVENT_STREAM_MAX_CONNECTIONS', 4))  # per process
+app.config['EVENT_STREAM_HEARTBEAT'] = 15  # seconds between SSE keep-alives
+broker = create_broker(app.config['REDIS_URL'])
+event_stream_slots = threading.BoundedSemaphore(app.config['EVENT_STREAM_MAX_CONNECTIONS'])
+
+# Badge counter cache, dropped after each write. Off without REDIS_URL: an in-process cache
+# is only cleared in the worker that committed, the others would serve stale badges
+app.config['COUNTER_CACHE_ENABLED'] = os.getenv(
+    'COUNTER_CACHE_ENABLED', 'true' if app.config['REDIS_URL'] else 'false'
+).lower() == 'true'
+app.config['COUNTER_CACHE_TTL'] = int(os.getenv('COUNTER_CACHE_TTL', 60))  # seconds; bounds a rebuild racing a write
+app.config['COUNTER_CACHE_MAX_ENTRIES'] = int(os.getenv('COUNTER_CACHE_MAX_ENTRIES', 50000))
+counter_cache = create_cache(app.config['REDIS_URL'], app.config['COUNTER_CACHE_MAX_ENTRIES'], prefix='counter:')
+
+# Public GET response cache, invalidated by tag after writes commit. Off without REDIS_URL: tag
+# versions bumped in one worker's memory would leave the other workers serving old pages
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv(
+    'RESPONSE_CACHE_ENABLED', 'true' if app.config['REDIS_URL'] else 'false'
+).lower() == 'true'
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 30))  # seconds; bounds staleness from missed tags
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+response_cache = ResponseCache(
+    create_cache(app.config['REDIS_URL'], app.config['RESPONSE_CACHE_MAX_ENTRIES'], prefix='response:'),
+    default_ttl=app.config['RESPONSE_CACHE_TTL'],
+    enabled=app.config['RESPONSE_CACHE_ENABLED'],
+    on_lookup=lambda hit: cache_lookup('response', hit)
+)
+
+# Per-request SQL stats (X-Query-Count / Server-Timing); N_PLUS_ONE_STRICT fails requests repeating a SELECT
+app.config['QUERY_STATS_ENABLED'] = os.getenv('QUERY_STATS_ENABLED', 'true').lower() == 'true'
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+app.config['N_PLUS_ONE_STRICT'] = os.getenv('N_PLUS_ONE_STRICT', 'false').lower() == 'true'
+
+# Connection pooling (per worker process); DATABASE_REPLICA_URLS (comma-separated) adds read replica binds
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv('DB_POOL_SIZE', 8)),  # one per gunicorn thread
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 4)),
+    pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),  # seconds; below server/proxy idle timeouts
+    timeout=int(os.getenv('DB_POOL_TIMEOUT', 30))
+)
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{i}': url.strip() for i, url in enumerate(os.getenv('DATABASE_REPLICA_URLS', '').split(',')) if url.strip()
+}
+app.config['REPLICA_LAG_SECONDS'] = int(os.getenv('REPLICA_LAG_SECONDS', 5))  # read-your-writes window
+if app.config['SQLALCHEMY_BINDS'] and not app.config['REDIS_URL']:
+    # Recent-write markers in one worker's memory would send the user's next request on another
+    # worker or pod to a lagging replica
+    raise RuntimeError('DATABASE_REPLICA_URLS needs REDIS_URL to share read-your-writes markers across workers')
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 jwt = JWTManager(app)
 CORS(app)
+query_inspector = QueryInspector(app)
+with app.app_context():
+    for engine in db.engines.values():
+        metrics.instrument_engine(engine)
+
+# Password hashing on a per-worker process pool (PASSWORD_HASH_WORKERS=0 hashes inline); logins re-hash
+# passwords stored with another PASSWORD_HASH_METHOD, e.g. after raising the pbkdf2 iterations
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 4))  # per worker, queued or running
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 1))  # seconds, then 503
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))  # seconds per hash, then 503
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+    result_timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
+
+@app.errorhandler(StaleDataError)
+def stale_data(error):
+    # A versioned Item/TransactionRequest row changed since this request read it
+    db.session.rollback()
+    return jsonify({'message': 'This was changed by someone else, please reload and try again'}), 409
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    db.session.rollback()
+    return jsonify({'message': 'Too many sign-in attempts right now, please try again shortly'}), 503, {'Retry-After': '5'}
 
 # JWT Error handlers
 @jwt.expired_token_loader
@@ -70,6 +226,29 @@ def invalid_token_callback(error):
 def missing_token_callback(error):
     return jsonify({'message': 'Authorization token is required'}), 401
 
+# Appointment reminders (REMINDER_SCHEDULER=true runs the scheduler thread in each worker; one holds the lease)
+app.config['REMINDER_SCHEDULER'] = os.getenv('REMINDER_SCHEDULER', 'false').lower() == 'true'
+app.config['REMINDER_LEAD_MINUTES'] = int(os.getenv('REMINDER_LEAD_MINUTES', 30))
+app.config['REMINDER_BATCH_SIZE'] = 50
+
+# Email outbox: routes enqueue, a leased worker delivers (with EMAIL_WORKER=false, cron runs `flask deliver-emails`)
+app.config['EMAIL_WORKER'] = os.getenv('EMAIL_WORKER', 'false').lower() == 'true'
+app.config['EMAIL_BACKEND'] = os.getenv('EMAIL_BACKEND', 'ses' if app.config['AWS_ACCESS_KEY_ID'] else 'stub')
+app.config['EMAIL_BATCH_SIZE'] = 50
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+app.config['EMAIL_RETRY_BASE'] = 30  # seconds, doubled per failed attempt
+app.config['EMAIL_RETRY_MAX'] = 3600
+app.config['EMAIL_CLAIM_TIMEOUT'] = 300  # a claimed email not settled by then is retried
+mailer = create_mailer(
+    app.config['EMAIL_BACKEND'],
+    source=os.getenv('FROM_EMAIL', 'noreply@yourdomain.com'),
+    region=os.getenv('AWS_SES_REGION', 'us-east-1'),
+    access_key_id=app.config['AWS_ACCESS_KEY_ID'],
+    secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
+    endpoint_url=os.getenv('SES_ENDPOINT_URL'),
+    session=aws_session
+)
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -83,17 +262,28 @@ class User(db.Model):
     address = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Rating statistics
+    # Rating statistics, maintained by create_rating (repair with `flask repair-rating-stats`)
+    rating_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
+    rating_1_count = db.Column(db.Integer, default=0)
+    rating_2_count = db.Column(db.Integer, default=0)
+    rating_3_count = db.Column(db.Integer, default=0)
+    rating_4_count = db.Column(db.Integer, default=0)
+    rating_5_count = db.Column(db.Integer, default=0)
+    
     @property
     def average_rating(self):
-        ratings = Rating.query.filter_by(rated_user_id=self.id).all()
-        if not ratings:
+        if not self.rating_count:
             return 0
-        return round(sum(r.rating for r in ratings) / len(ratings), 1)
+        return round(self.rating_sum / self.rating_count, 1)
     
     @property
     def total_ratings(self):
-        return Rating.query.filter_by(rated_user_id=self.id).count()
+        return self.rating_count or 0
+    
+    @property
+    def rating_histogram(self):
+        return {str(stars): getattr(self, f'rating_{stars}_count') or 0 for stars in range(1, 6)}
 
 class VerificationCode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -102,6 +292,10 @@ class VerificationCode(db.Model):
     type = db.Column(db.String(10), nullable=False)  # 'phone' or 'email'
     expires_at = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_verification_code_user_type', 'user_id', 'type'),
+    )
 
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -111,9 +305,25 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Inbox summary, maintained by add_message (repair with `flask repair-conversation-summaries`)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id', use_alter=True, name='fk_conversation_last_message'))
+    user1_unread_count = db.Column(db.Integer, default=0)
+    user2_unread_count = db.Column(db.Integer, default=0)
+    
+    # Read cursors: each participant has read every message up to this id
+    user1_last_read_message_id = db.Column(db.Integer)
+    user2_last_read_message_id = db.Column(db.Integer)
+    
     user1 = db.relationship('User', foreign_keys=[user1_id])
     user2 = db.relationship('User', foreign_keys=[user2_id])
     item = db.relationship('Item', foreign_keys=[item_id])
+    last_message = db.relationship('Message', foreign_keys=[last_message_id], post_update=True)
+    
+    # Inbox listing, newest activity first, from either side
+    __table_args__ = (
+        db.Index('ix_conversation_user1_updated', 'user1_id', 'updated_at'),
+        db.Index('ix_conversation_user2_updated', 'user2_id', 'updated_at'),
+    )
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -128,13 +338,19 @@ class Message(db.Model):
     reply_to_id = db.Column(db.Integer, db.ForeignKey('message.id'))  # For replies
     is_edited = db.Column(db.Boolean, default=False)
     is_deleted = db.Column(db.Boolean, default=False)
-    is_read = db.Column(db.Boolean, default=False)
+    is_read = db.Column(db.Boolean, default=False)  # Legacy; read state lives in the conversation's read cursors
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     edited_at = db.Column(db.DateTime)
     
-    conversation = db.relationship('Conversation', backref='messages')
+    conversation = db.relationship('Conversation', backref='messages', foreign_keys=[conversation_id])
     sender = db.relationship('User')
     reply_to = db.relationship('Message', remote_side=[id])
+    
+    __table_args__ = (
+        db.Index('ix_message_conversation_created', 'conversation_id', 'created_at', 'id'),
+        # Unread counts are id ranges above a read cursor
+        db.Index('ix_message_conversation_id', 'conversation_id', 'id'),
+    )
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -153,6 +369,12 @@ class Appointment(db.Model):
     item = db.relationship('Item')
     requester = db.relationship('User', foreign_keys=[requester_id])
     owner = db.relationship('User', foreign_keys=[owner_id])
+    
+    __table_args__ = (
+        db.Index('ix_appointment_reminder', 'status', 'reminder_sent', 'appointment_time'),
+        db.Index('ix_appointment_requester_time', 'requester_id', 'appointment_time'),
+        db.Index('ix_appointment_owner_time', 'owner_id', 'appointment_time'),
+    )
 
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -166,6 +388,11 @@ class Rating(db.Model):
     rater = db.relationship('User', foreign_keys=[rater_id])
     rated_user = db.relationship('User', foreign_keys=[rated_user_id])
     item = db.relationship('Item')
+    
+    __table_args__ = (
+        db.Index('ix_rating_rated_user_created', 'rated_user_id', 'created_at'),
+        db.Index('ix_rating_rater_item', 'rater_id', 'item_id'),
+    )
 
 class Item(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -179,18 +406,86 @@ class Item(db.Model):
     status = db.Column(db.String(20), default='available')  # 'available', 'unavailable', 'completed'
     image_filename = db.Column(db.String(255))  # Main image (local fallback)
     image_url = db.Column(db.String(500))  # S3 URL
+    image_status = db.Column(db.String(20))  # 'pending', 'ready', 'failed' for pipeline uploads
+    image_renditions = db.Column(db.JSON)  # {'full': url, 'card': url, 'thumb': url, ...}
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)  # optimistic lock, see reserve_quantity
     
     user = db.relationship('User', backref=db.backref('items', lazy=True))
+    
+    # Listings filter on transaction_type first (see available_items_filter)
+    __table_args__ = (
+        db.Index('ix_item_type_status_created', 'transaction_type', 'status', 'created_at'),
+        db.Index('ix_item_user_created', 'user_id', 'created_at'),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
 class ItemImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
+    url = db.Column(db.String(500))  # Set for pipeline uploads (S3 or local)
+    status = db.Column(db.String(20))  # 'pending', 'ready', 'failed' for pipeline uploads
+    renditions = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     item = db.relationship('Item', backref=db.backref('additional_images', lazy=True))
+    
+    __table_args__ = (
+        db.Index('ix_item_image_item', 'item_id'),
+    )
+
+class ImageJob(db.Model):
+    """An uploaded image whose renditions are not recorded yet.
+
+    Written in the upload's transaction and deleted once the renditions (or the
+    failure) are recorded, so uploads lost to a restart can be retried.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    model = db.Column(db.String(20), nullable=False)  # table of the row to update, 'item' or 'item_image'
+    row_id = db.Column(db.Integer, nullable=False)
+    base = db.Column(db.String(64), nullable=False)  # content hash the renditions are named after
+    pending_url = db.Column(db.String(500), nullable=False)
+    source_url = db.Column(db.String(500))  # the stored upload for queued jobs; None when processed in the request
+    replaced_urls = db.Column(db.JSON)
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    queued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_image_job_queued', 'queued_at'),
+    )
+
+class SchedulerLease(db.Model):
+    """Which process currently runs a background scheduler, until expires_at"""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class EmailOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+class StoredBlob(db.Model):
+    """A content-addressed stored file, shared by every upload with the same bytes"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)  # <sha256>.<ext>, renditions <sha256>_<rendition>.<ext>
+    url = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class TransactionRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -203,108 +498,1070 @@ class TransactionRequest(db.Model):
     exchange_item_id = db.Column(db.Integer, db.ForeignKey('item.id'))  # For exchange requests
     message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)  # optimistic lock: one response wins
     
     item = db.relationship('Item', foreign_keys=[item_id], backref='requests')
     requester = db.relationship('User', foreign_keys=[requester_id])
     owner = db.relationship('User', foreign_keys=[owner_id])
     exchange_item = db.relationship('Item', foreign_keys=[exchange_item_id])
+    
+    __table_args__ = (
+        db.Index('ix_transaction_request_owner_status', 'owner_id', 'status', 'created_at'),
+        db.Index('ix_transaction_request_requester_status', 'requester_id', 'status', 'created_at'),
+        db.Index('ix_transaction_request_item_status', 'item_id', 'status'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+search_index = ItemSearchIndex(db, Item, User)
+
+# Append new migrations with the next version; never edit one that has shipped
+MIGRATIONS = [
+    (1, 'Create missing tables and columns', create_missing_schema),
+    (2, 'Indexes for hot queries', run_all(
+        create_indexes(
+            'ix_verification_code_user_type',
+            'ix_conversation_user1_updated', 'ix_conversation_user2_updated',
+            'ix_message_conversation_created',
+            'ix_appointment_reminder', 'ix_appointment_requester_time', 'ix_appointment_owner_time',
+            'ix_rating_rated_user_created', 'ix_rating_rater_item',
+            'ix_item_type_status_created', 'ix_item_user_created', 'ix_item_image_item',
+            'ix_transaction_request_owner_status', 'ix_transaction_request_requester_status',
+            'ix_transaction_request_item_status',
+        ),
+        # As shipped; replaced by ix_message_conversation_id in migration 5
+        create_retired_index(
+            'ix_message_unread', 'message', 'conversation_id', 'sender_id',
+            postgresql_where=db.text('is_read = false AND is_deleted = false'),
+            sqlite_where=db.text('is_read = 0 AND is_deleted = 0')
+        ),
+    )),
+    (3, 'Scheduler leases', create_tables('scheduler_lease')),
+    (4, 'Email outbox', create_tables('email_outbox')),
+    (5, 'Per-participant read cursors', run_all(
+        add_columns('conversation', 'user1_last_read_message_id', 'user2_last_read_message_id'),
+        lambda connection, metadata: backfill_read_cursors(connection),
+        drop_indexes('ix_message_unread'),
+        create_indexes('ix_message_conversation_id'),
+    )),
+    (6, 'Optimistic version columns', run_all(
+        add_columns('item', 'version'),
+        add_columns('transaction_request', 'version'),
+        lambda connection, metadata: backfill_versions(connection),
+    )),
+    (7, 'Backfill search index, rating stats and conversation summaries', run_all(
+        lambda connection, metadata: search_index.rebuild(connection),
+        lambda connection, metadata: recompute_rating_stats(connection),
+        lambda connection, metadata: recompute_conversation_summaries(connection),
+    )),
+    (8, 'Image jobs', run_all(
+        create_tables('image_job'),
+        lambda connection, metadata: fail_untracked_image_uploads(connection),
+    )),
+]
+
+def fail_untracked_image_uploads(connection):
+    """Mark failed the uploads still pending from before image jobs were recorded; their bytes are gone"""
+    for model in (Item, ItemImage):
+        _, _, _, status_column = image_columns(model)
+        connection.execute(db.update(model).where(status_column == 'pending').values({status_column: 'failed'}))
+
+def backfill_read_cursors(connection):
+    """Start each participant's read cursor at the newest message they had marked read"""
+    message = Message.__table__
+    conversation = Conversation.__table__
+    
+    def newest_read_by(participant_column):
+        return db.select(db.func.max(message.c.id)).where(
+            message.c.conversation_id == conversation.c.id,
+            message.c.sender_id != participant_column,
+            message.c.is_read == True
+        ).scalar_subquery()
+    
+    connection.execute(db.update(conversation).values(
+        user1_last_read_message_id=newest_read_by(conversation.c.user1_id),
+        user2_last_read_message_id=newest_read_by(conversation.c.user2_id)
+    ))
+
+def backfill_versions(connection):
+    """Start existing items and requests at version 1 (the added columns are NULL)"""
+    for table in (Item.__table__, TransactionRequest.__table__):
+        connection.execute(db.update(table).where(table.c.version.is_(None)).values(version=1))
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply pending schema migrations"""
+    applied = upgrade(db.engine, db.metadata, MIGRATIONS)
+    for version, name in applied:
+        print(f"Applied migration {version}: {name}")
+    print(f"Database is at version {MIGRATIONS[-1][0]}" if applied else "Database is up to date")
+
+def recompute_conversation_summaries(connection):
+    """Set every conversation's last message and unread counters (from the read cursors), returns the row count"""
+    def unread_for(participant_column, cursor_column):
+        return db.select(db.func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id,
+            Message.id > db.func.coalesce(cursor_column, 0),
+            Message.sender_id != participant_column,
+            Message.is_deleted == False
+        ).scalar_subquery()
+    
+    return connection.execute(db.update(Conversation).values({
+        Conversation.last_message_id: db.select(db.func.max(Message.id)).where(
+            Message.conversation_id == Conversation.id
+        ).scalar_subquery(),
+        Conversation.user1_unread_count: unread_for(Conversation.user1_id, Conversation.user1_last_read_message_id),
+        Conversation.user2_unread_count: unread_for(Conversation.user2_id, Conversation.user2_last_read_message_id),
+        Conversation.updated_at: Conversation.updated_at
+    })).rowcount
+
+def recompute_rating_stats(connection):
+    """Set every user's rating aggregates from the rating table, returns how many users have ratings"""
+    def aggregate(expression):
+        return db.select(db.func.coalesce(expression, 0)).where(Rating.rated_user_id == User.id).scalar_subquery()
+    
+    connection.execute(db.update(User).values({
+        User.rating_count: aggregate(db.func.count(Rating.id)),
+        User.rating_sum: aggregate(db.func.sum(Rating.rating)),
+        **{getattr(User, f'rating_{stars}_count'): aggregate(db.func.sum(db.case((Rating.rating == stars, 1), else_=0)))
+           for stars in range(1, 6)}
+    }))
+    return connection.execute(db.select(db.func.count(db.distinct(Rating.rated_user_id)))).scalar()
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Repopulate the item full-text search index"""
+    search_index.rebuild()
+    db.session.commit()
+    print("Item search index rebuilt")
+
+@app.cli.command('repair-conversation-summaries')
+def repair_conversation_summaries():
+    """Recompute last message and unread counters (from the read cursors) for every conversation"""
+    updated = recompute_conversation_summaries(db.session.connection())
+    db.session.commit()
+    print(f"Conversation summaries repaired for {updated} conversations")
+
+@app.cli.command('repair-rating-stats')
+def repair_rating_stats():
+    """Recompute every user's rating aggregates from the rating table"""
+    rated = recompute_rating_stats(db.session.connection())
+    db.session.commit()
+    print(f"Rating stats repaired for {rated} users")
+
+# Pushed events are queued on the session and only published once the write commits
+def publish_event(user_ids, event_type, payload):
+    """Queue an event for each user's stream, sent after the current transaction commits"""
+    pending = db.session.info.setdefault('pending_events', [])
+    for user_id in set(user_ids):
+        pending.append((f'user:{user_id}', {'type': event_type, **payload}))
+
+def invalidate_cached(*tags):
+    """Queue response cache tags to invalidate once the current transaction commits"""
+    db.session.info.setdefault('pending_invalidations', set()).update(tags)
+
+# Read replicas: public read views use one unless the caller or the data they render changed recently
+def current_user_id():
+    """The authenticated caller's id, or None (anonymous, invalid token, or no request)"""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        return None
+    return int(identity) if identity else None
+
+def replica_sticky_keys():
+    keys = [f'tag:{tag}' for tag in g.get('response_cache_tags', ())]
+    user_id = current_user_id()
+    if user_id is not None:
+        keys.append(f'user:{user_id}')
+    return keys
+
+replica_router = ReplicaRouter(
+    [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica_')],
+    create_cache(app.config['REDIS_URL'], 10000, prefix='recent-change:'),
+    sticky_keys=replica_sticky_keys,
+    lag_seconds=app.config['REPLICA_LAG_SECONDS']
+)
+
+@db.event.listens_for(db.session, 'after_flush')
+def note_flush_write(session, flush_context):
+    session.info['wrote'] = True
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def note_statement_write(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info['wrote'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def publish_pending_events(session):
+    counters = session.info.pop('pending_counters', None)
+    if counters:
+        try:
+            counter_cache.delete(*{f'{name}:{user_id}' for user_id, name in counters})
+        except Exception as e:
+            print(f"Counter cache invalidation failed: {e}")
+    
+    for channel, event in session.info.pop('pending_events', []):
+        try:
+            broker.publish(channel, event)
+        except Exception as e:
+            print(f"Event publish failed: {e}")
+    
+    for url in session.info.pop('pending_removals', []):
+        remove_object(url)
+    
+    tags = session.info.pop('pending_invalidations', None)
+    if tags:
+        try:
+            response_cache.invalidate(*tags)
+        except Exception as e:
+            print(f"Response cache invalidation failed: {e}")
+    
+    if session.info.pop('wrote', False):
+        user_id = current_user_id()
+        replica_router.record(*[f'tag:{tag}' for tag in tags or ()], *([f'user:{user_id}'] if user_id else []))
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def discard_pending_events(session, previous_transaction):
+    session.info.pop('pending_counters', None)
+    session.info.pop('pending_events', None)
+    session.info.pop('pending_removals', None)
+    session.info.pop('pending_invalidations', None)
+    session.info.pop('wrote', None)
+
+def count_unread_messages(user_id):
+    """Unread messages sent to user_id across all conversations: id ranges above each read cursor"""
+    def unread_as(participant_column, cursor_column):
+        return db.select(db.func.count(Message.id)).join(
+            Conversation, Message.conversation_id == Conversation.id
+        ).where(
+            participant_column == user_id,
+            Message.id > db.func.coalesce(cursor_column, 0),
+            Message.sender_id != user_id,  # Not sent by current user
+            Message.is_deleted == False
+        ).scalar_subquery()
+    
+    return db.session.query(
+        unread_as(Conversation.user1_id, Conversation.user1_last_read_message_id) +
+        unread_as(Conversation.user2_id, Conversation.user2_last_read_message_id)
+    ).scalar()
+
+def participant_columns(conversation, user_id):
+    """(read cursor, unread counter) columns for user_id's side of a conversation"""
+    if conversation.user1_id == user_id:
+        return Conversation.user1_last_read_message_id, Conversation.user1_unread_count
+    return Conversation.user2_last_read_message_id, Conversation.user2_unread_count
+
+def recipient_id(conversation, sender_id):
+    return conversation.user2_id if sender_id == conversation.user1_id else conversation.user1_id
+
+def count_pending_requests(user_id):
+    """Pending requests for items user_id owns"""
+    return TransactionRequest.query.filter_by(owner_id=user_id, status='pending').count()
+
+BADGE_COUNTERS = {
+    'unread_messages': count_unread_messages,
+    'pending_requests': count_pending_requests
+}
+
+def badge_count(user_id, name):
+    """Cached badge counter, rebuilt from the database on a miss"""
+    if not app.config['COUNTER_CACHE_ENABLED']:
+        return BADGE_COUNTERS[name](user_id)
+    
+    key = f'{name}:{user_id}'
+    try:
+        value = counter_cache.get(key)
+    except Exception as e:
+        print(f"Counter cache read failed: {e}")
+        return BADGE_COUNTERS[name](user_id)
+    
+    cache_lookup('counter', value is not None)
+    if value is None:
+        value = BADGE_COUNTERS[name](user_id)
+        try:
+            counter_cache.set(key, value, ttl=app.config['COUNTER_CACHE_TTL'])
+        except Exception as e:
+            print(f"Counter cache write failed: {e}")
+    return value
+
+def invalidate_badge_count(user_id, name):
+    """Drop a cached counter once the current transaction commits; the next read rebuilds it"""
+    db.session.info.setdefault('pending_counters', []).append((user_id, name))
+
+def reserve_quantity(item_id, quantity):
+    """Take quantity units of a lend item in one conditional UPDATE; False when not enough are left.
+
+    The check and the decrement happen in the database, so concurrent acceptances
+    never oversell and only wait for each other on the item row for the length of
+    one statement. Bumps the version so ORM writes based on an older read fail.
+    """
+    return Item.query.filter(
+        Item.id == item_id,
+        Item.available_quantity >= quantity
+    ).update({
+        Item.available_quantity: Item.available_quantity - quantity,
+        Item.version: Item.version + 1
+    }, synchronize_session=False) == 1
 
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
-def upload_to_s3(file, filename):
-    """Upload file to S3 and return URL"""
-    if not s3_client or not app.config['S3_BUCKET_NAME']:
+def available_items_filter():
+    """Items that can still be requested: lend items with stock, other items not yet completed"""
+    return db.or_(
+        db.and_(Item.transaction_type == 'lend', Item.available_quantity > 0),
+        db.and_(Item.transaction_type.in_(['give_away', 'exchange']), Item.status == 'available')
+    )
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor for a (created_at, id) position"""
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raises ValueError on anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def keyset_page(query, model, cursor, per_page, sort_column=None):
+    """Page newest-first on (sort_column, id) without COUNT or OFFSET.
+
+    sort_column defaults to model.created_at. Returns the rows and the cursor
+    for the next page (None on the last page). An empty cursor starts from the
+    newest row. Rows may be tuples whose first element is the model instance.
+    """
+    sort_column = sort_column if sort_column is not None else model.created_at
+    if cursor:
+        position, row_id = decode_cursor(cursor)
+        query = query.filter(db.tuple_(sort_column, model.id) < (position, row_id))
+    
+    rows = query.order_by(sort_column.desc(), model.id.desc()).limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    last = rows[-1] if isinstance(rows[-1], model) else rows[-1][0]
+    return rows, encode_cursor(getattr(last, sort_column.key), last.id)
+
+def positive_int_arg(name, default, maximum=None):
+    """Positive integer query parameter, capped at maximum; raises ValueError otherwise"""
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ValueError(f'{name} must be a positive integer')
+    if value < 1:
+        raise ValueError(f'{name} must be a positive integer')
+    return min(value, maximum) if maximum else value
+
+def per_page_arg(default):
+    """?per_page= as a positive integer capped at MAX_PER_PAGE, raises ValueError otherwise"""
+    return positive_int_arg('per_page', default, maximum=app.config['MAX_PER_PAGE'])
+
+def listing_response(query, model, schema):
+    """{'items', 'pagination'} page of query, newest first.
+
+    Cursor mode (opt-in with ?cursor=) pages with keyset_page and skips the
+    COUNT; otherwise ?page= pages with OFFSET and reports totals. Malformed
+    cursor, page or per_page arguments are answered with a 400.
+    """
+    try:
+        per_page = per_page_arg(30)
+        if 'cursor' in request.args:
+            rows, next_cursor = keyset_page(query, model, request.args['cursor'], per_page)
+            pagination = {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
+        else:
+            page = positive_int_arg('page', 1)
+            paginated = query.order_by(model.created_at.desc()).paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            rows = paginated.items
+            pagination = {
+                'page': paginated.page,
+                'pages': paginated.pages,
+                'per_page': paginated.per_page,
+                'total': paginated.total,
+                'has_next': paginated.has_next,
+                'has_prev': paginated.has_prev
+            }
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return jsonify({
+        'items': schema.many(rows),
+        'pagination': pagination
+    })
+
+def add_message(conversation, message):
+    """Add a message and bump the conversation's last message, unread counter and timestamp"""
+    db.session.add(message)
+    db.session.flush()
+    
+    recipient = recipient_id(conversation, message.sender_id)
+    _, unread_column = participant_columns(conversation, recipient)
+    invalidate_badge_count(recipient, 'unread_messages')
+    Conversation.query.filter_by(id=conversation.id).update({
+        Conversation.last_message_id: message.id,
+        unread_column: db.func.coalesce(unread_column, 0) + 1,
+        Conversation.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    
+    publish_event([conversation.user1_id, conversation.user2_id], 'message', {
+        'conversation_id': conversation.id,
+        'message_id': message.id,
+        'sender_id': message.sender_id
+    })
+
+def publish_message_change(message, action):
+    """Tell both participants' streams that a message was edited or deleted"""
+    conversation = message.conversation
+    publish_event([conversation.user1_id, conversation.user2_id], 'message', {
+        'conversation_id': conversation.id,
+        'message_id': message.id,
+        'sender_id': message.sender_id,
+        'action': action
+    })
+
+def storage_url(filename):
+    """Public URL a stored file will have"""
+    if s3_enabled():
+        return f"https://{app.config['S3_BUCKET_NAME']}.s3.{app.config['AWS_REGION']}.amazonaws.com/{filename}"
+    return f'/api/uploads/{filename}'
+
+def save_local(file, filename):
+    """Write a file object into the upload folder"""
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    # Identical content may be written by two requests at once; never expose a partial file
+    temp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as out:
+        shutil.copyfileobj(file, out)
+    os.replace(temp_path, file_path)
+    return f'/api/uploads/{filename}'
+
+def put_object(file, key, content_type='image/jpeg'):
+    """Store a file object under key in S3 (or the upload folder) and return its URL.
+
+    Only touches storage, never the database, so it is safe on worker threads.
+    """
+    if not s3_enabled():
         # Fallback to local storage
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        return f'/api/uploads/{filename}'
+        return save_local(file, key)
     
     try:
-        # Optimize image before upload
-        image = Image.open(file)
-        
-        # Resize if too large (max 1200px width)
-        if image.width > 1200:
-            ratio = 1200 / image.width
-            new_height = int(image.height * ratio)
-            image = image.resize((1200, new_height), Image.Resampling.LANCZOS)
-        
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        
-        # Save optimized image to bytes
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='JPEG', quality=85, optimize=True)
-        img_buffer.seek(0)
-        
-        # Upload to S3
-        s3_client.upload_fileobj(
-            img_buffer,
+        s3_client().upload_fileobj(
+            file,
             app.config['S3_BUCKET_NAME'],
-            filename,
+            key,
             ExtraArgs={
-                'ContentType': 'image/jpeg',
+                'ContentType': content_type,
                 'CacheControl': 'max-age=31536000'  # 1 year cache
             }
         )
-        
-        # Return S3 URL
-        return f"https://{app.config['S3_BUCKET_NAME']}.s3.{app.config['AWS_REGION']}.amazonaws.com/{filename}"
+        return storage_url(key)
         
     except Exception as e:
         print(f"S3 upload failed: {e}")
         # Fallback to local storage
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         file.seek(0)  # Reset file pointer
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        return f'/api/uploads/{filename}'
+        return save_local(file, key)
 
-def delete_from_s3(filename):
-    """Delete file from S3"""
-    if not s3_client or not app.config['S3_BUCKET_NAME']:
-        # Delete from local storage
+def remove_object(url):
+    """Delete a stored file by its public URL, wherever it ended up"""
+    filename = local_filename(url)
+    if filename:
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if os.path.exists(file_path):
             os.remove(file_path)
         return
+    if not s3_enabled():
+        return
     
     try:
-        s3_client.delete_object(
+        s3_client().delete_object(
             Bucket=app.config['S3_BUCKET_NAME'],
-            Key=filename
+            Key=url.rsplit('/', 1)[1]
         )
     except Exception as e:
         print(f"S3 delete failed: {e}")
 
-def send_email_aws(to_email, subject, body):
-    """Send email using AWS SES"""
-    if not app.config['AWS_ACCESS_KEY_ID']:
-        print(f"AWS SES not configured. Email: {subject} to {to_email}")
-        return False
+def read_object(url):
+    """Bytes of a stored file, by its public URL"""
+    filename = local_filename(url)
+    if filename:
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'rb') as f:
+            return f.read()
+    return s3_client().get_object(Bucket=app.config['S3_BUCKET_NAME'], Key=blob_key(url))['Body'].read()
+
+def blob_key(url):
+    return url.rsplit('/', 1)[1]
+
+def retain_blob(key, url, size=None):
+    """Count one more reference to a stored file, registering it on first use.
+
+    Runs in the caller's transaction. Returns the URL the file is served from,
+    which is the existing one when the blob was already registered.
+    """
+    updated = StoredBlob.query.filter_by(key=key).update(
+        {StoredBlob.ref_count: StoredBlob.ref_count + 1}, synchronize_session=False
+    )
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredBlob(key=key, url=url, size=size, ref_count=1))
+            return url
+        except IntegrityError:
+            # A concurrent upload of the same content registered it first
+            StoredBlob.query.filter_by(key=key).update(
+                {StoredBlob.ref_count: StoredBlob.ref_count + 1}, synchronize_session=False
+            )
+    return db.session.query(StoredBlob.url).filter_by(key=key).scalar()
+
+def retain_blobs(urls):
+    """retain_blob for several stored files, with one UPDATE for those already registered"""
+    urls_by_key = {blob_key(url): url for url in urls}
+    registered = set(db.session.execute(
+        db.update(StoredBlob).where(StoredBlob.key.in_(urls_by_key)).values(
+            ref_count=StoredBlob.ref_count + 1
+        ).returning(StoredBlob.key)
+    ).scalars())
+    for key in urls_by_key.keys() - registered:
+        retain_blob(key, urls_by_key[key])
+
+def upload_to_s3(file, filename, content_type='image/jpeg'):
+    """Store an upload under its content hash and return its URL.
+
+    Only filename's extension is used. Content that is already stored gains a
+    reference instead of being uploaded again.
+    """
+    data = file.read()
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+    key = f'{hashlib.sha256(data).hexdigest()}.{extension}'
+    
+    # Take the reference first: a blob whose last reference is being dropped concurrently
+    # matches no row here, and its file may be removed, so the content is stored again
+    if StoredBlob.query.filter_by(key=key).update(
+        {StoredBlob.ref_count: StoredBlob.ref_count + 1}, synchronize_session=False
+    ):
+        return db.session.query(StoredBlob.url).filter_by(key=key).scalar()
+    return retain_blob(key, put_object(io.BytesIO(data), key, content_type), len(data))
+
+def delete_stored(url):
+    """Drop one reference to a stored file; the file is deleted after commit once unreferenced"""
+    key = blob_key(url)
+    if not StoredBlob.query.filter_by(key=key).update(
+        {StoredBlob.ref_count: StoredBlob.ref_count - 1}, synchronize_session=False
+    ):
+        # Uploaded before content addressing, so nothing else can share it
+        db.session.info.setdefault('pending_removals', []).append(url)
+        return
+    
+    blob_url = db.session.query(StoredBlob.url).filter_by(key=key).scalar()
+    if StoredBlob.query.filter(StoredBlob.key == key, StoredBlob.ref_count <= 0).delete(synchronize_session=False):
+        db.session.info.setdefault('pending_removals', []).append(blob_url)
+
+def discard_unreferenced(urls):
+    """Delete stored files no row refers to, e.g. renditions of a superseded upload"""
+    urls = list(urls)
+    if not urls:
+        return
+    referenced = {key for key, in db.session.query(StoredBlob.key).filter(StoredBlob.key.in_([blob_key(url) for url in urls]))}
+    for url in urls:
+        if blob_key(url) not in referenced:
+            remove_object(url)
+
+def local_filename(url):
+    """Upload folder filename for a /api/uploads URL, None for S3 URLs"""
+    return url.rsplit('/', 1)[1] if url and url.startswith('/api/uploads/') else None
+
+def item_image_url(item, rendition='full'):
+    """URL of an item's main image rendition; legacy uploads only have the full image"""
+    renditions = item.image_renditions or {}
+    if renditions.get(rendition):
+        return renditions[rendition]
+    if item.image_filename:
+        return f'/api/uploads/{item.image_filename}'
+    return item.image_url
+
+def image_columns(model):
+    """(url, filename, renditions, status) columns of an image-bearing model"""
+    if model is Item:
+        return Item.image_url, Item.image_filename, Item.image_renditions, Item.image_status
+    return ItemImage.url, ItemImage.filename, ItemImage.renditions, ItemImage.status
+
+def additional_image_urls(item, rendition='full'):
+    """URLs of an item's additional images, skipping uploads that failed processing"""
+    return [
+        (image.renditions or {}).get(rendition) or image.url or f'/api/uploads/{image.filename}'
+        for image in item.additional_images if image.status != 'failed'
+    ]
+
+def start_image_upload(row, file, replaced_urls=()):
+    """Point an Item or ItemImage at its pending full-size URL and return the job for run_image_jobs.
+
+    Renditions are named after the source's content hash, so a photo that was
+    uploaded before resolves to the files already in storage.
+    """
+    data = file.read()
+    base = hashlib.sha256(data).hexdigest()
+    url_column, filename_column, renditions_column, status_column = image_columns(type(row))
+    pending_url = storage_url(rendition_filename(base, 'full'))
+    
+    setattr(row, url_column.key, pending_url)
+    setattr(row, filename_column.key, local_filename(pending_url) if type(row) is Item else rendition_filename(base, 'full'))
+    setattr(row, renditions_column.key, None)
+    setattr(row, status_column.key, 'pending')
+    
+    return {
+        'row': row,
+        'name': file.filename,
+        'base': base,
+        'data': data,
+        'pending_url': pending_url,
+        'replaced_urls': [url for url in replaced_urls if url]
+    }
+
+def persist_image_jobs(jobs):
+    """Record image jobs in the uploading request's transaction.
+
+    Call before committing the rows start_image_upload pointed at pending
+    URLs. With background workers the upload itself is stored too, so queued
+    jobs don't hold its bytes and can be retried after a restart.
+    """
+    if not jobs:
+        return
+    db.session.flush()
+    for job in jobs:
+        source_url = None
+        if image_pipeline.workers > 0:
+            source_url = put_object(io.BytesIO(job['data']), f'source_{uuid.uuid4().hex}', 'application/octet-stream')
+        image_job = ImageJob(
+            model=type(job['row']).__tablename__,
+            row_id=job['row'].id,
+            base=job['base'],
+            pending_url=job['pending_url'],
+            source_url=source_url,
+            replaced_urls=job['replaced_urls']
+        )
+        db.session.add(image_job)
+        job['job'] = image_job
+    db.session.flush()
+    for job in jobs:
+        job['job_id'] = job.pop('job').id
+
+def finish_image_job(job_id):
+    """Delete a recorded job; its stored upload is removed after commit"""
+    source_url = db.session.query(ImageJob.source_url).filter_by(id=job_id).scalar()
+    ImageJob.query.filter_by(id=job_id).delete(synchronize_session=False)
+    if source_url:
+        db.session.info.setdefault('pending_removals', []).append(source_url)
+
+def existing_renditions(base):
+    """{rendition: url} when every rendition of this content is already stored, else None"""
+    filenames = rendition_filenames(base, app.config['IMAGE_WEBP'])
+    # Locked until record_renditions commits, so a concurrent delete_stored cannot drop them in between
+    urls = dict(db.session.query(StoredBlob.key, StoredBlob.url).filter(
+        StoredBlob.key.in_(filenames.values())
+    ).with_for_update())
+    if len(urls) < len(filenames):
+        return None
+    return {name: urls[filename] for name, filename in filenames.items()}
+
+def store_renditions(base, data):
+    """Render and store every rendition of an upload, returns {rendition: url}.
+
+    Storage only; record_renditions registers the blobs afterwards.
+    """
+    return {
+        name: put_object(io.BytesIO(body), filename, content_type)
+        for name, (filename, content_type, body) in render_renditions(data, base, app.config['IMAGE_WEBP']).items()
+    }
+
+def record_renditions(model, row_id, pending_url, stored, error=None, replaced_urls=(), job_id=None):
+    """Publish stored renditions on their row (or mark it failed) and return the per-image result.
+
+    The update only applies while the row is still pending at pending_url; if
+    a newer upload replaced it, or a retry of the job got there first, this
+    upload's files are discarded instead. Finishes job_id in the same commit.
+    """
+    url_column, filename_column, renditions_column, status_column = image_columns(model)
+    if error is None:
+        values = {
+            url_column: stored['full'],
+            renditions_column: stored,
+            status_column: 'ready'
+        }
+        if model is Item:
+            values[filename_column] = local_filename(stored['full'])
+    else:
+        values = {status_column: 'failed'}
+    
+    updated = model.query.filter(
+        model.id == row_id, url_column == pending_url, status_column == 'pending'
+    ).update(values, synchronize_session=False)
+    if updated:
+        item_id = row_id if model is Item else db.session.query(ItemImage.item_id).filter_by(id=row_id).scalar()
+        invalidate_cached('items', f'item:{item_id}')
+        retain_blobs(stored.values())
+        for url in replaced_urls:
+            delete_stored(url)
+    else:
+        discard_unreferenced(stored.values())
+    if job_id is not None:
+        finish_image_job(job_id)
+    db.session.commit()
     
-    try:
-        ses_client = boto3.client(
-            'ses',
-            aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-            region_name=os.getenv('AWS_SES_REGION', 'us-east-1')
+    if error is not None:
+        return {'status': 'failed', 'error': str(error)}
+    return {'status': 'ready', 'url': stored['full']}
+
+IMAGE_MODELS = {'item': Item, 'item_image': ItemImage}
+
+def process_image_job(job_id):
+    """Image pipeline job: store renditions of the stored upload unless identical content has them, then record"""
+    with app.app_context():
+        job = db.session.get(ImageJob, job_id)
+        if job is None:
+            return None  # Already recorded, e.g. by a retry
+        try:
+            stored, error = existing_renditions(job.base) or store_renditions(job.base, read_object(job.source_url)), None
+        except Exception as e:
+            print(f"Image processing failed for {job.model} {job.row_id}: {e}")
+            stored, error = {}, e
+        return record_renditions(
+            IMAGE_MODELS[job.model], job.row_id, job.pending_url, stored, error, job.replaced_urls or (), job.id
         )
+
+def retry_stale_image_jobs():
+    """Process the image jobs no worker recorded within IMAGE_JOB_STALE_MINUTES, one by one.
+
+    Jobs processed inside a request have no stored upload to retry from, so
+    they are marked failed, as are jobs out of attempts. Returns (retried, failed).
+    """
+    retried = failed = 0
+    cutoff = datetime.utcnow() - timedelta(minutes=app.config['IMAGE_JOB_STALE_MINUTES'])
+    for job_id, in db.session.query(ImageJob.id).filter(ImageJob.queued_at < cutoff).order_by(ImageJob.id).all():
+        # Claim the job so concurrent sweeps skip it
+        claimed = ImageJob.query.filter(ImageJob.id == job_id, ImageJob.queued_at < cutoff).update({
+            ImageJob.queued_at: datetime.utcnow(),
+            ImageJob.attempts: ImageJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            continue
         
-        response = ses_client.send_email(
-            Source=os.getenv('FROM_EMAIL', 'noreply@yourdomain.com'),
-            Destination={'ToAddresses': [to_email]},
-            Message={
-                'Subject': {'Data': subject},
-                'Body': {'Text': {'Data': body}}
-            }
+        job = db.session.get(ImageJob, job_id)
+        if job.source_url is None or job.attempts > app.config['IMAGE_JOB_MAX_ATTEMPTS']:
+            record_renditions(
+                IMAGE_MODELS[job.model], job.row_id, job.pending_url, {}, RuntimeError('Image job abandoned'), (), job.id
+            )
+            failed += 1
+        else:
+            process_image_job(job_id)
+            retried += 1
+    return retried, failed
+
+@app.cli.command('requeue-images')
+def requeue_images_command():
+    """Retry image uploads no worker finished (lost to a restart or crash), for cron"""
+    retried, failed = retry_stale_image_jobs()
+    print(f"Retried {retried} image jobs, marked {failed} failed")
+
+def run_image_jobs(jobs):
+    """Process committed image uploads and return a result per job.
+
+    With background workers the jobs are queued and reported as pending. In
+    inline mode each distinct new image is rendered concurrently and recorded
+    before returning, so the request waits roughly as long as the slowest one.
+    """
+    if image_pipeline.workers > 0:
+        queued = {}
+        for job in jobs:
+            if image_pipeline.submit(process_image_job, job['job_id']):
+                queued[job['job_id']] = {'name': job['name'], 'status': 'pending', 'url': job['pending_url']}
+        # The queue is full: process the rest here rather than hold more uploads in memory
+        processed = iter(process_image_jobs([job for job in jobs if job['job_id'] not in queued]))
+        return [queued.get(job['job_id']) or next(processed) for job in jobs]
+    return process_image_jobs(jobs)
+
+def process_image_jobs(jobs):
+    """Render and record jobs inside the request; see run_image_jobs"""
+    outcomes = {}
+    for job in jobs:
+        if job['base'] not in outcomes:
+            stored = existing_renditions(job['base'])
+            outcomes[job['base']] = (stored, None) if stored else job['data']
+    
+    to_render = [(base, data) for base, data in outcomes.items() if isinstance(data, bytes)]
+    for (base, _), outcome in zip(to_render, image_pipeline.run_concurrently(store_renditions, to_render)):
+        outcomes[base] = outcome
+    
+    results = []
+    for job in jobs:
+        stored, error = outcomes[job['base']]
+        if error is not None:
+            print(f"Image processing failed for {job['name']}: {error}")
+        result = record_renditions(
+            type(job['row']), job['row'].id, job['pending_url'], stored or {}, error, job['replaced_urls'], job['job_id']
         )
-        return True
-    except Exception as e:
-        print(f"AWS SES failed: {e}")
-        return False
+        results.append({'name': job['name'], **result})
+    return results
+
+# Response projections, one per shape a resource is returned in
+ITEM_SUMMARY = Projection(
+    'id', 'name', 'description', 'category', 'transaction_type', 'quantity',
+    'available_quantity', 'status', 'price_per_hour', 'created_at',
+    image_url=lambda item, _: item_image_url(item),
+    thumbnail_url=lambda item, _: item_image_url(item, 'thumb')
+)
+MY_ITEM = ITEM_SUMMARY.extend(additional_images=lambda item, _: additional_image_urls(item))
+ITEM_LISTING = MY_ITEM.extend(
+    username=lambda item, _: item.user.username,
+    address=lambda item, _: item.user.address
+)
+ITEM_DETAIL = ITEM_LISTING.extend(
+    'image_status', 'user_id',
+    contact=lambda item, _: {
+        'email': item.user.email,
+        'phone': item.user.phone,
+        'zalo_id': item.user.zalo_id
+    }
+)
+
+USER_REF = Projection('id', 'username')
+APPOINTMENT_SUMMARY = Projection(
+    'id', 'appointment_time', 'location', 'status', 'notes',
+    is_owner=lambda apt, context: apt.owner_id == context['user_id']
+)
+APPOINTMENT = APPOINTMENT_SUMMARY.extend(
+    'created_at',
+    item=Projection(
+        'id', 'name',
+        image_url=lambda item, _: f'/api/uploads/{item.image_filename}' if item.image_filename else None
+    ),
+    requester=USER_REF,
+    owner=USER_REF,
+    location_coords=lambda apt, _: {
+        'lat': apt.location_lat,
+        'lng': apt.location_lng
+    } if apt.location_lat and apt.location_lng else None
+)
+APPOINTMENT_REMINDER = Projection(
+    'id', 'appointment_time', 'location', 'requester_id', 'owner_id',
+    item_name=lambda apt, _: apt.item.name
+)
+
+def message_content(msg, _):
+    return msg.content if not msg.is_deleted else 'Deleted message'
+
+MESSAGE = Projection(
+    'id', 'sender_id', 'message_type', 'file_url', 'is_edited', 'is_deleted', 'created_at', 'edited_at',
+    sender_username=lambda msg, _: msg.sender.username,
+    content=message_content,
+    location=lambda msg, _: {
+        'lat': msg.location_lat,
+        'lng': msg.location_lng,
+        'name': msg.location_name
+    } if msg.location_lat and msg.location_lng else None,
+    reply_to=Projection('id', content=message_content, sender_username=lambda msg, _: msg.sender.username),
+    # A message is read once its recipient's cursor (context read_cursors, by sender) has reached it
+    is_read=lambda msg, context: msg.id <= context['read_cursors'].get(msg.sender_id, 0)
+)
+
+# Email outbox
+def queue_email(to_email, subject, body):
+    """Add an email to the outbox in the current transaction; call dispatch_emails after commit"""
+    db.session.add(EmailOutbox(to_email=to_email, subject=subject, body=body))
+
+def dispatch_emails():
+    """Wake the delivery worker; without one, queued emails wait for `flask deliver-emails`.
+
+    Requests never deliver themselves, so a slow or failing mail provider
+    (or a backlog) can't hold them up.
+    """
+    if app.config['EMAIL_WORKER']:
+        email_worker.notify()
+
+def due_emails():
+    """(email_id, next_attempt_at) for pending emails due before the next worker refresh"""
+    horizon = datetime.utcnow() + timedelta(seconds=2 * email_worker.refresh_interval)
+    return db.session.query(EmailOutbox.id, EmailOutbox.next_attempt_at).filter(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at <= horizon
+    ).order_by(EmailOutbox.next_attempt_at).limit(10 * app.config['EMAIL_BATCH_SIZE']).all()
+
+def deliver_emails(email_ids):
+    """Claim a batch of due emails, send them through the shared mailer and record each outcome.
+
+    Claiming pushes next_attempt_at past EMAIL_CLAIM_TIMEOUT, so concurrent
+    deliverers skip the batch and a crashed one's emails are retried later.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(EmailOutbox).where(
+            EmailOutbox.id.in_(email_ids),
+            EmailOutbox.status == 'pending',
+            EmailOutbox.next_attempt_at <= now
+        ).values(
+            attempts=EmailOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=app.config['EMAIL_CLAIM_TIMEOUT'])
+        ).returning(EmailOutbox.id)
+    ).scalars().all()
+    db.session.commit()
+    if not claimed:
+        return 0
+    
+    outcomes = []
+    for email in EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)):
+        try:
+            mailer.send(email.to_email, email.subject, email.body)
+            outcomes.append({'id': email.id, 'status': 'sent', 'sent_at': datetime.utcnow(), 'last_error': None})
+        except Exception as e:
+            print(f"Email {email.id} to {email.to_email} failed (attempt {email.attempts}): {e}")
+            retry_in = min(app.config['EMAIL_RETRY_BASE'] * 2 ** (email.attempts - 1), app.config['EMAIL_RETRY_MAX'])
+            outcomes.append({
+                'id': email.id,
+                'status': 'failed' if email.attempts >= app.config['EMAIL_MAX_ATTEMPTS'] else 'pending',
+                'next_attempt_at': datetime.utcnow() + timedelta(seconds=retry_in),
+                'last_error': str(e)[:1000]
+            })
+    
+    for outcome in outcomes:
+        EmailOutbox.query.filter_by(id=outcome.pop('id')).update(outcome, synchronize_session=False)
+    db.session.commit()
+    return sum(outcome['status'] == 'sent' for outcome in outcomes)
+
+def deliver_pending_emails():
+    """Deliver every email that is due now, in batches"""
+    sent = 0
+    while True:
+        ids = db.session.query(EmailOutbox.id).filter(
+            EmailOutbox.status == 'pending',
+            EmailOutbox.next_attempt_at <= datetime.utcnow()
+        ).order_by(EmailOutbox.next_attempt_at).limit(app.config['EMAIL_BATCH_SIZE']).all()
+        if not ids:
+            return sent
+        sent += deliver_emails([email_id for email_id, in ids])
+
+# Appointment reminders
+def acquire_lease(name, ttl):
+    """Take or renew a named lease for this process; False while another process holds it"""
+    now = datetime.utcnow()
+    values = {SchedulerLease.holder: LEASE_HOLDER, SchedulerLease.expires_at: now + timedelta(seconds=ttl)}
+    held = SchedulerLease.query.filter(
+        SchedulerLease.name == name,
+        db.or_(SchedulerLease.holder == LEASE_HOLDER, SchedulerLease.expires_at < now)
+    ).update(values, synchronize_session=False)
+    if not held:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SchedulerLease(name=name, holder=LEASE_HOLDER, expires_at=values[SchedulerLease.expires_at]))
+            held = True
+        except IntegrityError:
+            held = False  # Someone else's live lease
+    db.session.commit()
+    return bool(held)
+
+def upcoming_reminders():
+    """(appointment_id, reminder due time) for confirmed appointments due a reminder before the next refresh"""
+    now = datetime.utcnow()
+    lead = timedelta(minutes=app.config['REMINDER_LEAD_MINUTES'])
+    horizon = timedelta(seconds=2 * reminder_scheduler.refresh_interval)
+    rows = db.session.query(Appointment.id, Appointment.appointment_time).filter(
+        Appointment.status == 'confirmed',
+        Appointment.reminder_sent == False,
+        Appointment.appointment_time > now,
+        Appointment.appointment_time <= now + lead + horizon
+    )
+    return [(appointment_id, appointment_time - lead) for appointment_id, appointment_time in rows]
+
+def send_appointment_reminders(appointment_ids):
+    """Claim a batch of due reminders and email both participants.
+
+    The claim is a conditional UPDATE, so appointments reminded, cancelled or
+    moved into the past since they were scheduled are skipped.
+    """
+    claimed = db.session.execute(
+        db.update(Appointment).where(
+            Appointment.id.in_(appointment_ids),
+            Appointment.status == 'confirmed',
+            Appointment.reminder_sent == False,
+            Appointment.appointment_time > datetime.utcnow()
+        ).values(reminder_sent=True).returning(Appointment.id)
+    ).scalars().all()
+    if not claimed:
+        db.session.commit()
+        return []
+    
+    appointments = Appointment.query.options(
+        db.joinedload(Appointment.item), db.joinedload(Appointment.requester), db.joinedload(Appointment.owner)
+    ).filter(Appointment.id.in_(claimed)).all()
+    
+    for appointment in appointments:
+        when = appointment.appointment_time.strftime('%B %d, %Y at %I:%M %p')
+        for user in (appointment.requester, appointment.owner):
+            queue_email(
+                user.email,
+                "Appointment Reminder",
+                f"Hi {user.username},\n\nYour appointment for \"{appointment.item.name}\" is on {when} (UTC) at {appointment.location}."
+            )
+        publish_event([appointment.requester_id, appointment.owner_id], 'appointment_reminder', {
+            'appointment_id': appointment.id,
+            'item_name': appointment.item.name,
+            'appointment_time': appointment.appointment_time.isoformat(),
+            'location': appointment.location
+        })
+    db.session.commit()
+    
+    dispatch_emails()
+    return claimed
+
+LEASE_HOLDER = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+reminder_scheduler = Scheduler(
+    load=upcoming_reminders,
+    run=send_appointment_reminders,
+    acquire_lease=lambda ttl: acquire_lease('appointment-reminders', ttl),
+    context=app.app_context,
+    batch_size=app.config['REMINDER_BATCH_SIZE'],
+    broker=broker,
+    channel='scheduler:appointment-reminders'
+)
+email_worker = Scheduler(
+    load=due_emails,
+    run=deliver_emails,
+    acquire_lease=lambda ttl: acquire_lease('email-outbox', ttl),
+    context=app.app_context,
+    # Wake-ups only cross workers through Redis; without it other workers' emails wait for this refresh
+    refresh_interval=5,
+    batch_size=app.config['EMAIL_BATCH_SIZE'],
+    broker=broker,
+    channel='scheduler:email-outbox'
+)
+
+@app.before_request
+def start_background_scheduler():
+    if app.config['REMINDER_SCHEDULER']:
+        reminder_scheduler.start()
+    if app.config['EMAIL_WORKER']:
+        email_worker.start()
+
+@app.cli.command('deliver-emails')
+def deliver_emails_command():
+    """Deliver due outbox emails once (when no EMAIL_WORKER thread is running)"""
+    print(f"Delivered {deliver_pending_emails()} emails")
+
+@app.cli.command('send-reminders')
+def send_reminders_command():
+    """Send due appointment reminders once (for cron instead of the scheduler thread)"""
+    reminder_scheduler.tick()
 
 
 
@@ -322,7 +1579,7 @@ def register():
     user = User(
         username=data['username'],
         email=data['email'],
-        password_hash=generate_password_hash(data['password']),
+        password_hash=password_hasher.hash(data['password']),
         phone=data['phone'],
         zalo_id=data.get('zalo_id', ''),
         address=data['address']
@@ -348,7 +1605,10 @@ def login():
     data = request.get_json()
     user = User.query.filter_by(email=data['email']).first()
     
-    if user and check_password_hash(user.password_hash, data['password']):
+    if user and password_hasher.verify(user.password_hash, data['password']):
+        if password_hasher.needs_rehash(user.password_hash):
+            user.password_hash = password_hasher.hash(data['password'])
+            db.session.commit()
         access_token = create_access_token(identity=str(user.id), expires_delta=timedelta(days=1))
         return jsonify({
             'access_token': access_token,
@@ -376,14 +1636,12 @@ def send_email_verification():
         expires_at=datetime.utcnow() + timedelta(seconds=60)
     )
     db.session.add(verification)
-    db.session.commit()
     
-    # Send email using AWS SES
+    # Delivered by the outbox worker, off the request path
     body = f"Your email verification code is: {code}\n\nThis code will expire in 60 seconds."
-    email_sent = send_email_aws(user.email, "Email Verification Code", body)
-    
-    if not email_sent:
-        print(f"Email failed. Code for {user.email}: {code}")
+    queue_email(user.email, "Email Verification Code", body)
+    db.session.commit()
+    dispatch_emails()
     
     return jsonify({
         'message': 'Verification code sent to email',
@@ -420,30 +1678,26 @@ def verify_email():
     return jsonify({'message': 'Email verified successfully'}), 200
 
 @app.route('/api/items', methods=['GET'])
+@response_cache.cached(tags=['items'])
+@replica_router.reads
 def get_items():
     # Get query parameters
     search = request.args.get('search', '')
     category = request.args.get('category', '')
     transaction_type = request.args.get('transaction_type', '')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 30))
     
-    # Base query - only available items
-    query = Item.query.join(User).filter(
-        db.or_(
-            db.and_(Item.transaction_type == 'lend', Item.available_quantity > 0),
-            db.and_(Item.transaction_type.in_(['give_away', 'exchange']), Item.status == 'available')
-        )
-    )
+    # Base query - only available items, with owner and images loaded up front
+    query = Item.query.join(User).options(
+        db.contains_eager(Item.user),
+        db.selectinload(Item.additional_images)
+    ).filter(available_items_filter())
     
-    # Apply search filters
+    # Cursor mode (opt-in with ?cursor=) pages newest-first, so relevance ranking is skipped
+    use_cursor = 'cursor' in request.args
+    
+    # Apply search filters (ranked by relevance, newest first on ties)
     if search:
-        search_filter = db.or_(
-            Item.name.ilike(f'%{search}%'),
-            Item.description.ilike(f'%{search}%'),
-            User.username.ilike(f'%{search}%')
-        )
-        query = query.filter(search_filter)
+        query = search_index.search(query, search, ranked=not use_cursor)
     
     if category:
         query = query.filter(Item.category == category)
@@ -451,63 +1705,18 @@ def get_items():
     if transaction_type:
         query = query.filter(Item.transaction_type == transaction_type)
     
-    # Get paginated results
-    items = query.order_by(Item.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    return jsonify({
-        'items': [{
-            'id': item.id,
-            'name': item.name,
-            'description': item.description,
-            'category': item.category,
-            'transaction_type': item.transaction_type,
-            'quantity': item.quantity,
-            'available_quantity': item.available_quantity,
-            'status': item.status,
-            'image_url': f'/api/uploads/{item.image_filename}' if item.image_filename else None,
-            'additional_images': [f'/api/uploads/{img.filename}' for img in item.additional_images],
-            'username': item.user.username,
-            'address': item.user.address,
-            'price_per_hour': item.price_per_hour,
-            'created_at': item.created_at.isoformat()
-        } for item in items.items],
-        'pagination': {
-            'page': items.page,
-            'pages': items.pages,
-            'per_page': items.per_page,
-            'total': items.total,
-            'has_next': items.has_next,
-            'has_prev': items.has_prev
-        }
-    })
+    return listing_response(query, Item, ITEM_LISTING)
 
 @app.route('/api/items/<int:item_id>', methods=['GET'])
+@response_cache.cached(tags=lambda item_id: [f'item:{item_id}'])
+@replica_router.reads
 def get_item(item_id):
-    item = Item.query.join(User).filter(Item.id == item_id).first_or_404()
-    return jsonify({
-        'id': item.id,
-        'name': item.name,
-        'description': item.description,
-        'category': item.category,
-        'transaction_type': item.transaction_type,
-        'quantity': item.quantity,
-        'available_quantity': item.available_quantity,
-        'status': item.status,
-        'image_url': f'/api/uploads/{item.image_filename}' if item.image_filename else None,
-        'additional_images': [f'/api/uploads/{img.filename}' for img in item.additional_images],
-        'username': item.user.username,
-        'user_id': item.user.id,
-        'address': item.user.address,
-        'price_per_hour': item.price_per_hour,
-        'contact': {
-            'email': item.user.email,
-            'phone': item.user.phone,
-            'zalo_id': item.user.zalo_id
-        },
-        'created_at': item.created_at.isoformat()
-    })
+    item = Item.query.join(User).options(
+        db.contains_eager(Item.user),
+        db.selectinload(Item.additional_images)
+    ).filter(Item.id == item_id).first_or_404()
+    response_cache.add_tags(f'user:{item.user_id}')  # Owner contact details
+    return jsonify(ITEM_DETAIL.dump(item))
 
 @app.route('/api/items', methods=['POST'])
 @jwt_required()
@@ -546,18 +1755,6 @@ def create_item():
         # Ensure uploads directory exists
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         
-        image_url = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = str(uuid.uuid4()) + '.jpg'  # Always save as JPG
-                image_url = upload_to_s3(file, filename)
-                image_filename = filename if not image_url.startswith('http') else None
-            else:
-                image_filename = None
-        else:
-            image_filename = None
-        
         item = Item(
             name=name,
             description=description,
@@ -566,38 +1763,75 @@ def create_item():
             price_per_hour=price_per_hour,
             quantity=quantity,
             available_quantity=quantity,
-            image_filename=image_filename,
-            image_url=image_url,
             user_id=user_id
         )
         
+        # Every image goes through the same pipeline; rows point at pending URLs until processed
+        image_jobs = []
+        rejected_images = []
+        uploads = [(item, request.files.get('image'))]
+        uploads += [(None, img_file) for img_file in request.files.getlist('additional_images')[:10]]  # Max 10 additional images
+        for row, img_file in uploads:
+            if not (img_file and img_file.filename):
+                continue
+            if not allowed_file(img_file.filename):
+                rejected_images.append({'name': img_file.filename, 'status': 'rejected', 'error': 'Unsupported file type'})
+                continue
+            if row is None:
+                row = ItemImage(item=item)
+                db.session.add(row)
+            image_jobs.append(start_image_upload(row, img_file))
+        
         db.session.add(item)
+        db.session.flush()
+        search_index.index_item(item)
+        invalidate_cached('items')
+        persist_image_jobs(image_jobs)
         db.session.commit()
         
-        # Handle additional images
-        additional_images = request.files.getlist('additional_images')
-        for img_file in additional_images[:10]:  # Max 10 additional images
-            if img_file and img_file.filename and allowed_file(img_file.filename):
-                filename = str(uuid.uuid4()) + '.' + img_file.filename.rsplit('.', 1)[1].lower()
-                img_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                
-                item_image = ItemImage(
-                    item_id=item.id,
-                    filename=filename
-                )
-                db.session.add(item_image)
+        image_results = run_image_jobs(image_jobs)
         
-        db.session.commit()
-        
-        return jsonify({'message': 'Item created successfully', 'item_id': item.id}), 201
+        return jsonify({
+            'message': 'Item created successfully',
+            'item_id': item.id,
+            'image_url': item.image_url,
+            'image_status': item.image_status,
+            'images': image_results + rejected_images
+        }), 201
     
     except Exception as e:
         print(f"Error creating item: {str(e)}")
         return jsonify({'message': f'Error creating item: {str(e)}'}), 422
 
+# <sha256>[_<rendition>].<ext>, as written by upload_to_s3 and the image pipeline
+HASHED_UPLOAD_RE = re.compile(r'^([0-9a-f]{64}(?:_\w+)?)\.\w+$')
+
 @app.route('/api/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    hashed = HASHED_UPLOAD_RE.match(filename)
+    etag = hashed.group(1) if hashed else True  # the name is the content hash
+    max_age = app.config['UPLOADS_MAX_AGE'] if hashed else app.config['LEGACY_UPLOADS_MAX_AGE']
+    
+    if app.config['UPLOADS_ACCEL_PREFIX']:
+        # nginx streams the file (sendfile, ranges); we only answer the conditional part
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if file_path is None or not os.path.isfile(file_path):
+            return jsonify({'message': 'File not found'}), 404
+        stat = os.stat(file_path)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(etag if hashed else f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        response.last_modified = datetime.utcfromtimestamp(stat.st_mtime)
+        response = response.make_conditional(request)
+        if response.status_code != 304:
+            response.headers['X-Accel-Redirect'] = app.config['UPLOADS_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+    else:
+        # Werkzeug handles If-None-Match/If-Modified-Since, Range and wsgi.file_wrapper (sendfile under gunicorn)
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, etag=etag, max_age=max_age)
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = bool(hashed)
+    return response
 
 @app.route('/api/items/<int:item_id>/request', methods=['POST'])
 @jwt_required()
@@ -629,6 +1863,13 @@ def create_request(item_id):
         )
         
         db.session.add(transaction_request)
+        db.session.flush()
+        invalidate_badge_count(item.user_id, 'pending_requests')
+        publish_event([item.user_id], 'request', {
+            'request_id': transaction_request.id,
+            'item_id': item_id,
+            'status': transaction_request.status
+        })
         db.session.commit()
         
         return jsonify({'message': 'Request sent successfully'}), 201
@@ -641,30 +1882,20 @@ def create_request(item_id):
 def get_user_requests():
     user_id = int(get_jwt_identity())
     
-    # Get all requests for items I own - with proper joins
-    received_requests = db.session.query(TransactionRequest).join(
-        Item, TransactionRequest.item_id == Item.id
-    ).join(
-        User, TransactionRequest.requester_id == User.id
-    ).filter(
-        Item.user_id == user_id
-    ).order_by(TransactionRequest.created_at.desc()).all()
-    
-    # Get requests I made - with proper joins
-    sent_requests = db.session.query(TransactionRequest).join(
-        Item, TransactionRequest.item_id == Item.id
-    ).join(
-        User, TransactionRequest.owner_id == User.id
-    ).filter(
-        TransactionRequest.requester_id == user_id
-    ).order_by(TransactionRequest.created_at.desc()).all()
+    # Items and both parties come back in the same query as the requests
+    query = TransactionRequest.query.options(
+        db.joinedload(TransactionRequest.item),
+        db.joinedload(TransactionRequest.requester),
+        db.joinedload(TransactionRequest.owner),
+        db.joinedload(TransactionRequest.exchange_item)
+    ).order_by(TransactionRequest.created_at.desc())
+    
+    # Requests for items I own, and requests I made
+    received_requests = query.filter(TransactionRequest.owner_id == user_id).all()
+    sent_requests = query.filter(TransactionRequest.requester_id == user_id).all()
     
     def format_request(req):
-        # Manually fetch related data to avoid relationship issues
-        item = Item.query.get(req.item_id)
-        requester = User.query.get(req.requester_id)
-        owner = User.query.get(req.owner_id)
-        exchange_item = Item.query.get(req.exchange_item_id) if req.exchange_item_id else None
+        item, requester, owner, exchange_item = req.item, req.requester, req.owner, req.exchange_item
         
         return {
             'id': req.id,
@@ -698,16 +1929,20 @@ def respond_to_request(request_id):
     if transaction_request.owner_id != user_id:
         return jsonify({'message': 'Unauthorized'}), 403
     
-    if data['status'] == 'accepted':
+    previous_status = transaction_request.status
+    if transaction_request.status == 'pending' and data['status'] != 'pending':
+        invalidate_badge_count(transaction_request.owner_id, 'pending_requests')
+    transaction_request.status = data['status']  # 'accepted' or 'rejected'
+    # Versioned UPDATE first: of two concurrent responses to this request only one gets past here
+    db.session.flush()
+    
+    if data['status'] == 'accepted' and previous_status != 'accepted':
         item = Item.query.get(transaction_request.item_id)
         
         if item.transaction_type == 'lend':
-            # Check if enough quantity available
-            if item.available_quantity < transaction_request.quantity_requested:
+            if not reserve_quantity(item.id, transaction_request.quantity_requested):
+                db.session.rollback()
                 return jsonify({'message': 'Not enough quantity available'}), 400
-            
-            # Decrease available quantity for lend
-            item.available_quantity -= transaction_request.quantity_requested
         
         elif item.transaction_type in ['give_away', 'exchange']:
             # Mark as completed for give away or exchange
@@ -718,8 +1953,15 @@ def respond_to_request(request_id):
                 exchange_item = Item.query.get(transaction_request.exchange_item_id)
                 if exchange_item:
                     exchange_item.status = 'completed'
+                    invalidate_cached(f'item:{exchange_item.id}')
+        
+        invalidate_cached('items', f'item:{item.id}')
     
-    transaction_request.status = data['status']  # 'accepted' or 'rejected'
+    publish_event([transaction_request.requester_id, transaction_request.owner_id], 'request', {
+        'request_id': transaction_request.id,
+        'item_id': transaction_request.item_id,
+        'status': transaction_request.status
+    })
     db.session.commit()
     
     return jsonify({'message': f'Request {data["status"]}'})
@@ -730,14 +1972,7 @@ def get_request_count():
     user_id = int(get_jwt_identity())
     
     # Count pending requests for items I own
-    pending_received = db.session.query(TransactionRequest).join(
-        Item, TransactionRequest.item_id == Item.id
-    ).filter(
-        Item.user_id == user_id,
-        TransactionRequest.status == 'pending'
-    ).count()
-    
-    return jsonify({'pending_received': pending_received})
+    return jsonify({'pending_received': badge_count(user_id, 'pending_requests')})
 
 @app.route('/api/messages/count', methods=['GET'])
 @jwt_required()
@@ -745,47 +1980,77 @@ def get_unread_message_count():
     user_id = int(get_jwt_identity())
     
     # Count unread messages in conversations where user is participant
-    unread_count = db.session.query(Message).join(
-        Conversation, Message.conversation_id == Conversation.id
-    ).filter(
-        db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id),
-        Message.sender_id != user_id,  # Not sent by current user
-        Message.is_read == False,
-        Message.is_deleted == False
-    ).count()
+    return jsonify({'unread_count': badge_count(user_id, 'unread_messages')})
+
+@app.route('/api/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def event_stream():
+    """Server-Sent Events for the current user: messages, requests, appointments and badge counters.
+
+    EventSource can't send headers, so the token may also be passed as ?jwt=.
+    Answers 503 when streams are disabled or every slot of this process is
+    taken; clients fall back to polling.
+    """
+    if not app.config['EVENT_STREAM_ENABLED']:
+        return jsonify({'message': 'Event stream unavailable'}), 503
+    if not event_stream_slots.acquire(blocking=False):
+        return jsonify({'message': 'Too many open event streams'}), 503, {'Retry-After': '30'}
+    
+    user_id = int(get_jwt_identity())
+    subscription = broker.subscribe(f'user:{user_id}')
+    heartbeat = app.config['EVENT_STREAM_HEARTBEAT']
+    
+    def close():
+        subscription.close()
+        event_stream_slots.release()
+    
+    def counters():
+        with app.app_context():
+            return {
+                'unread_count': badge_count(user_id, 'unread_messages'),
+                'pending_received': badge_count(user_id, 'pending_requests')
+            }
     
-    return jsonify({'unread_count': unread_count})
+    def sse(event_type, data):
+        return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    
+    def generate():
+        yield sse('counters', counters())
+        while True:
+            event = subscription.get(timeout=heartbeat)
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            
+            yield sse(event['type'], event)
+            
+            # Badge counts only move for messages from others, reads and request changes
+            if event['type'] in ('request', 'read') or (event['type'] == 'message' and event['sender_id'] != user_id):
+                yield sse('counters', counters())
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+    })
+    # Runs even if the client disconnects before the stream starts
+    response.call_on_close(close)
+    return response
 
 @app.route('/api/appointments/reminders', methods=['GET'])
 @jwt_required()
 def get_appointment_reminders():
-    # Get appointments in next 30 minutes that haven't been reminded
+    # The current user's confirmed appointments starting soon; emails are sent by the reminder scheduler
+    user_id = int(get_jwt_identity())
     now = datetime.utcnow()
-    reminder_time = now + timedelta(minutes=30)
+    reminder_time = now + timedelta(minutes=app.config['REMINDER_LEAD_MINUTES'])
     
-    appointments = Appointment.query.filter(
+    appointments = Appointment.query.options(db.joinedload(Appointment.item)).filter(
+        db.or_(Appointment.requester_id == user_id, Appointment.owner_id == user_id),
         Appointment.appointment_time.between(now, reminder_time),
-        Appointment.status == 'confirmed',
-        Appointment.reminder_sent == False
+        Appointment.status == 'confirmed'
     ).all()
     
-    reminders = []
-    for apt in appointments:
-        reminders.append({
-            'id': apt.id,
-            'item_name': apt.item.name,
-            'appointment_time': apt.appointment_time.isoformat(),
-            'location': apt.location,
-            'requester_id': apt.requester_id,
-            'owner_id': apt.owner_id
-        })
-        
-        # Mark as reminded
-        apt.reminder_sent = True
-    
-    db.session.commit()
-    
-    return jsonify(reminders)
+    return jsonify(APPOINTMENT_REMINDER.many(appointments))
 
 @app.route('/api/forgot-password', methods=['POST'])
 def forgot_password():
@@ -805,16 +2070,14 @@ def forgot_password():
         expires_at=datetime.utcnow() + timedelta(minutes=10)
     )
     db.session.add(verification)
-    db.session.commit()
     
-    # Send email using AWS SES
+    # Delivered by the outbox worker, off the request path
     body = f"Your password reset code is: {code}\n\nThis code will expire in 10 minutes."
-    email_sent = send_email_aws(user.email, "Password Reset Code", body)
+    queue_email(user.email, "Password Reset Code", body)
+    db.session.commit()
+    dispatch_emails()
     
-    if email_sent:
-        return jsonify({'message': 'Reset code sent to your email'}), 200
-    else:
-        return jsonify({'message': 'Failed to send email', 'code': code}), 500
+    return jsonify({'message': 'Reset code sent to your email'}), 200
 
 @app.route('/api/reset-password', methods=['POST'])
 def reset_password():
@@ -840,7 +2103,7 @@ def reset_password():
         return jsonify({'message': 'Reset code expired'}), 400
     
     # Update password and verify email
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = password_hasher.hash(new_password)
     user.email_verified = True  # Verify email when resetting password
     
     # Delete used verification code
@@ -871,18 +2134,7 @@ def get_conversation_appointments(conversation_id):
         )
     ).order_by(Appointment.appointment_time.desc()).all()
     
-    result = []
-    for apt in appointments:
-        result.append({
-            'id': apt.id,
-            'appointment_time': apt.appointment_time.isoformat(),
-            'location': apt.location,
-            'status': apt.status,
-            'notes': apt.notes,
-            'is_owner': apt.owner_id == user_id
-        })
-    
-    return jsonify(result)
+    return jsonify(APPOINTMENT_SUMMARY.many(appointments, user_id=user_id))
 
 @app.route('/api/conversations/<int:conversation_id>/appointments', methods=['POST'])
 @jwt_required()
@@ -919,8 +2171,11 @@ def create_conversation_appointment(conversation_id):
         content=f"📅 {User.query.get(user_id).username} scheduled an appointment for {datetime.fromisoformat(data['appointment_time']).strftime('%B %d, %Y at %I:%M %p')}"
     )
     
-    db.session.add(system_message)
-    conversation.updated_at = datetime.utcnow()
+    add_message(conversation, system_message)
+    publish_event([appointment.requester_id, appointment.owner_id], 'appointment', {
+        'appointment_id': appointment.id,
+        'status': appointment.status
+    })
     db.session.commit()
     
     return jsonify({'appointment_id': appointment.id}), 201
@@ -973,8 +2228,11 @@ def create_appointment():
         content=f"📅 {User.query.get(user_id).username} scheduled an appointment for {appointment.appointment_time.strftime('%B %d, %Y at %I:%M %p')}"
     )
     
-    db.session.add(system_message)
-    conversation.updated_at = datetime.utcnow()
+    add_message(conversation, system_message)
+    publish_event([appointment.requester_id, appointment.owner_id], 'appointment', {
+        'appointment_id': appointment.id,
+        'status': appointment.status
+    })
     db.session.commit()
     
     return jsonify({'appointment_id': appointment.id}), 201
@@ -988,19 +2246,18 @@ def get_my_items():
     search = request.args.get('search', '')
     category = request.args.get('category', '')
     transaction_type = request.args.get('transaction_type', '')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 30))
     
-    # Base query
-    query = Item.query.filter_by(user_id=user_id)
+    # Base query - additional images loaded in one batch per page
+    query = Item.query.options(
+        db.selectinload(Item.additional_images)
+    ).filter_by(user_id=user_id)
+    
+    # Cursor mode (opt-in with ?cursor=) pages newest-first, so relevance ranking is skipped
+    use_cursor = 'cursor' in request.args
     
     # Apply search filters
     if search:
-        search_filter = db.or_(
-            Item.name.ilike(f'%{search}%'),
-            Item.description.ilike(f'%{search}%')
-        )
-        query = query.filter(search_filter)
+        query = search_index.search(query, search, include_owner=False, ranked=not use_cursor)
     
     if category:
         query = query.filter(Item.category == category)
@@ -1008,35 +2265,7 @@ def get_my_items():
     if transaction_type:
         query = query.filter(Item.transaction_type == transaction_type)
     
-    # Get paginated results
-    items = query.order_by(Item.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    return jsonify({
-        'items': [{
-            'id': item.id,
-            'name': item.name,
-            'description': item.description,
-            'category': item.category,
-            'transaction_type': item.transaction_type,
-            'quantity': item.quantity,
-            'available_quantity': item.available_quantity,
-            'status': item.status,
-            'image_url': f'/api/uploads/{item.image_filename}' if item.image_filename else None,
-            'additional_images': [f'/api/uploads/{img.filename}' for img in item.additional_images],
-            'price_per_hour': item.price_per_hour,
-            'created_at': item.created_at.isoformat()
-        } for item in items.items],
-        'pagination': {
-            'page': items.page,
-            'pages': items.pages,
-            'per_page': items.per_page,
-            'total': items.total,
-            'has_next': items.has_next,
-            'has_prev': items.has_prev
-        }
-    })
+    return listing_response(query, Item, MY_ITEM)
 
 @app.route('/api/items/<int:item_id>', methods=['PUT'])
 @jwt_required()
@@ -1064,28 +2293,25 @@ def update_item(item_id):
             except ValueError:
                 price_per_hour = None
         
-        # Handle new image upload
+        # Handle new image upload; old renditions are removed once the new ones are stored
+        image_jobs = []
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                # Delete old image if exists
-                if item.image_filename:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], item.image_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                
-                # Save new image
-                filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                item.image_filename = filename
+                replaced_urls = list((item.image_renditions or {}).values()) or [item_image_url(item)]
+                image_jobs.append(start_image_upload(item, file, replaced_urls))
         
         # Update item fields
         item.name = name
         item.description = description
         item.transaction_type = transaction_type
         item.price_per_hour = price_per_hour
+        search_index.index_item(item)
+        invalidate_cached('items', f'item:{item.id}')
+        persist_image_jobs(image_jobs)
         
         db.session.commit()
+        run_image_jobs(image_jobs)
         
         return jsonify({'message': 'Item updated successfully'}), 200
     
@@ -1130,18 +2356,28 @@ def update_profile():
         # Update password if provided
         new_password = data.get('password')
         if new_password:
-            user.password_hash = generate_password_hash(new_password)
+            user.password_hash = password_hasher.hash(new_password)
+        
+        # Owner names are part of the item search index
+        new_username = data.get('username', user.username)
+        if new_username != user.username:
+            user.username = new_username
+            db.session.flush()
+            search_index.reindex_user(user.id)
         
         # Update other fields
-        user.username = data.get('username', user.username)
         user.phone = data.get('phone', user.phone)
         user.zalo_id = data.get('zalo_id', user.zalo_id)
         user.address = data.get('address', user.address)
+        # Owner names and contact details appear on listings and profiles
+        invalidate_cached('items', f'user:{user.id}')
         
         db.session.commit()
         
         return jsonify({'message': 'Profile updated successfully'}), 200
     
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         return jsonify({'message': f'Error updating profile: {str(e)}'}), 422
 
@@ -1156,25 +2392,24 @@ def change_password():
     new_password = data.get('new_password')
     
     # Verify old password
-    if not check_password_hash(user.password_hash, old_password):
+    if not password_hasher.verify(user.password_hash, old_password):
         return jsonify({'message': 'Current password is incorrect'}), 400
     
     # Update password
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = password_hasher.hash(new_password)
     db.session.commit()
     
     return jsonify({'message': 'Password changed successfully'}), 200
 
 @app.route('/api/users/<int:user_id>', methods=['GET'])
+@response_cache.cached(tags=lambda user_id: [f'user:{user_id}', 'items'])
+@replica_router.reads
 def get_public_profile(user_id):
     user = User.query.get_or_404(user_id)
     
     # Get user's items
     items = Item.query.filter_by(user_id=user_id).filter(
-        db.or_(
-            db.and_(Item.transaction_type == 'lend', Item.available_quantity > 0),
-            db.and_(Item.transaction_type.in_(['give_away', 'exchange']), Item.status == 'available')
-        )
+        available_items_filter()
     ).order_by(Item.created_at.desc()).all()
     
     return jsonify({
@@ -1187,20 +2422,9 @@ def get_public_profile(user_id):
         'address': user.address,
         'average_rating': user.average_rating,
         'total_ratings': user.total_ratings,
+        'rating_histogram': user.rating_histogram,
         'created_at': user.created_at.isoformat(),
-        'items': [{
-            'id': item.id,
-            'name': item.name,
-            'description': item.description,
-            'category': item.category,
-            'transaction_type': item.transaction_type,
-            'quantity': item.quantity,
-            'available_quantity': item.available_quantity,
-            'status': item.status,
-            'image_url': f'/api/uploads/{item.image_filename}' if item.image_filename else None,
-            'price_per_hour': item.price_per_hour,
-            'created_at': item.created_at.isoformat()
-        } for item in items]
+        'items': ITEM_SUMMARY.many(items)
     })
 
 @app.route('/api/items/<int:item_id>/repost', methods=['POST'])
@@ -1227,6 +2451,7 @@ def repost_item(item_id):
         item.quantity = new_quantity
         item.available_quantity = new_quantity
         item.status = 'available'
+        invalidate_cached('items', f'item:{item.id}')
         
         db.session.commit()
         
@@ -1280,6 +2505,7 @@ def cancel_request(request_id):
         if transaction_request.status != 'pending':
             return jsonify({'message': 'Cannot cancel non-pending request'}), 400
         
+        invalidate_badge_count(transaction_request.owner_id, 'pending_requests')
         db.session.delete(transaction_request)
         db.session.commit()
         
@@ -1295,53 +2521,69 @@ def get_conversations():
     user_id = int(get_jwt_identity())
     search = request.args.get('search', '')
     
-    query = Conversation.query.filter(
-        db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
+    # One query: conversation, other participant, item and last message
+    other_user = db.aliased(User)
+    last_message = db.aliased(Message)
+    is_user1 = Conversation.user1_id == user_id
+    
+    query = db.session.query(Conversation, other_user, Item, last_message).join(
+        other_user, other_user.id == db.case((is_user1, Conversation.user2_id), else_=Conversation.user1_id)
+    ).outerjoin(
+        Item, Item.id == Conversation.item_id
+    ).outerjoin(
+        last_message, last_message.id == Conversation.last_message_id
+    ).filter(
+        db.or_(is_user1, Conversation.user2_id == user_id)
     )
     
     # Apply search filter for usernames
     if search:
-        query = query.join(
-            User, db.or_(
-                db.and_(Conversation.user1_id == User.id, User.id != user_id),
-                db.and_(Conversation.user2_id == User.id, User.id != user_id)
-            )
-        ).filter(User.username.ilike(f'%{search}%'))
+        query = query.filter(other_user.username.ilike(f'%{search}%'))
     
-    conversations = query.order_by(Conversation.updated_at.desc()).all()
+    # Cursor mode (opt-in with ?cursor=) pages the inbox by most recent activity
+    use_cursor = 'cursor' in request.args
+    if use_cursor:
+        try:
+            per_page = per_page_arg(30)
+            rows, next_cursor = keyset_page(
+                query, Conversation, request.args['cursor'], per_page, sort_column=Conversation.updated_at
+            )
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    else:
+        rows = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).all()
     
     result = []
-    for conv in conversations:
-        other_user = conv.user2 if conv.user1_id == user_id else conv.user1
-        last_message = Message.query.filter_by(conversation_id=conv.id).order_by(Message.created_at.desc()).first()
-        
-        # Count unread messages in this conversation
-        unread_count = Message.query.filter(
-            Message.conversation_id == conv.id,
-            Message.sender_id != user_id,
-            Message.is_read == False,
-            Message.is_deleted == False
-        ).count()
-        
+    for conv, other, item, last in rows:
         result.append({
             'id': conv.id,
             'other_user': {
-                'id': other_user.id,
-                'username': other_user.username
+                'id': other.id,
+                'username': other.username
             },
             'item': {
-                'id': conv.item.id,
-                'name': conv.item.name
-            } if conv.item else None,
+                'id': item.id,
+                'name': item.name
+            } if item else None,
             'last_message': {
-                'content': last_message.content if last_message and not last_message.is_deleted else 'Deleted message',
-                'created_at': last_message.created_at.isoformat() if last_message else conv.created_at.isoformat(),
-                'sender_id': last_message.sender_id if last_message else None
-            } if last_message else None,
-            'unread_count': unread_count,
+                'content': last.content if not last.is_deleted else 'Deleted message',
+                'created_at': last.created_at.isoformat(),
+                'sender_id': last.sender_id
+            } if last else None,
+            'unread_count': (conv.user1_unread_count if conv.user1_id == user_id else conv.user2_unread_count) or 0,
             'updated_at': conv.updated_at.isoformat()
         })
     
+    if use_cursor:
+        return jsonify({
+            'conversations': result,
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
+        })
+    
     return jsonify(result)
 
 @app.route('/api/conversations', methods=['POST'])
@@ -1386,37 +2628,40 @@ def get_messages(conversation_id):
         db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
     ).first_or_404()
     
-    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at.asc()).all()
+    # Each sender's messages are read up to the other participant's cursor
+    read_cursors = {
+        conversation.user1_id: conversation.user2_last_read_message_id or 0,
+        conversation.user2_id: conversation.user1_last_read_message_id or 0
+    }
+    
+    # Senders and reply targets (with their senders) come back in the same query
+    query = Message.query.options(
+        db.joinedload(Message.sender),
+        db.joinedload(Message.reply_to).joinedload(Message.sender)
+    ).filter_by(conversation_id=conversation_id)
+    
+    # Cursor mode (opt-in with ?cursor=) returns the latest per_page messages, then older pages
+    use_cursor = 'cursor' in request.args
+    if use_cursor:
+        try:
+            per_page = per_page_arg(50)
+            messages, next_cursor = keyset_page(query, Message, request.args['cursor'], per_page)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        messages.reverse()
+    else:
+        messages = query.order_by(Message.created_at.asc(), Message.id.asc()).all()
     
-    result = []
-    for msg in messages:
-        reply_to = None
-        if msg.reply_to_id:
-            reply_msg = Message.query.get(msg.reply_to_id)
-            if reply_msg:
-                reply_to = {
-                    'id': reply_msg.id,
-                    'content': reply_msg.content if not reply_msg.is_deleted else 'Deleted message',
-                    'sender_username': reply_msg.sender.username
-                }
-        
-        result.append({
-            'id': msg.id,
-            'sender_id': msg.sender_id,
-            'sender_username': msg.sender.username,
-            'message_type': msg.message_type,
-            'content': msg.content if not msg.is_deleted else 'Deleted message',
-            'file_url': msg.file_url,
-            'location': {
-                'lat': msg.location_lat,
-                'lng': msg.location_lng,
-                'name': msg.location_name
-            } if msg.location_lat and msg.location_lng else None,
-            'reply_to': reply_to,
-            'is_edited': msg.is_edited,
-            'is_deleted': msg.is_deleted,
-            'created_at': msg.created_at.isoformat(),
-            'edited_at': msg.edited_at.isoformat() if msg.edited_at else None
+    result = MESSAGE.many(messages, read_cursors=read_cursors)
+    
+    if use_cursor:
+        return jsonify({
+            'messages': result,
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
         })
     
     return jsonify(result)
@@ -1432,12 +2677,40 @@ def mark_messages_read(conversation_id):
         db.or_(Conversation.user1_id == user_id, Conversation.user2_id == user_id)
     ).first_or_404()
     
-    # Mark all unread messages in this conversation as read
-    Message.query.filter(
-        Message.conversation_id == conversation_id,
-        Message.sender_id != user_id,  # Not sent by current user
-        Message.is_read == False
-    ).update({'is_read': True})
+    # Move this participant's read cursor up to the latest (or a given) message; it never moves back
+    data = request.get_json(silent=True) or {}
+    last_read_column, unread_column = participant_columns(conversation, user_id)
+    previous = getattr(conversation, last_read_column.key) or 0
+    read_up_to = conversation.last_message_id or 0
+    if data.get('last_read_message_id'):
+        read_up_to = min(int(data['last_read_message_id']), read_up_to)
+    
+    if read_up_to > previous:
+        newly_read = Message.query.filter(
+            Message.conversation_id == conversation_id,
+            Message.id > previous,
+            Message.id <= read_up_to,
+            Message.sender_id != user_id,  # Not sent by current user
+            Message.is_deleted == False
+        ).count()
+        
+        # One row, and only if no concurrent mark-read moved the cursor first; doesn't bump the inbox order
+        moved = Conversation.query.filter(
+            Conversation.id == conversation_id,
+            db.func.coalesce(last_read_column, 0) == previous
+        ).update({
+            last_read_column: read_up_to,
+            unread_column: db.case((unread_column > newly_read, unread_column - newly_read), else_=0),
+            Conversation.updated_at: Conversation.updated_at
+        }, synchronize_session=False)
+        if moved:
+            invalidate_badge_count(user_id, 'unread_messages')
+            # The sender's view shows read receipts
+            publish_event([conversation.user1_id, conversation.user2_id], 'read', {
+                'conversation_id': conversation_id,
+                'reader_id': user_id,
+                'last_read_message_id': read_up_to
+            })
     
     db.session.commit()
     
@@ -1464,9 +2737,9 @@ def send_message(conversation_id):
         if 'file' in request.files:
             file = request.files['file']
             if file and file.filename:
-                filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                file_url = filename
+                url = upload_to_s3(file, file.filename, file.mimetype or 'application/octet-stream')
+                # Local uploads keep the historical bare-filename form
+                file_url = local_filename(url) or url
     else:
         # Handle JSON data
         data = request.get_json()
@@ -1492,10 +2765,8 @@ def send_message(conversation_id):
         reply_to_id=int(reply_to_id) if reply_to_id else None
     )
     
-    db.session.add(message)
-    
-    # Update conversation timestamp
-    conversation.updated_at = datetime.utcnow()
+    # Also updates the conversation's inbox summary
+    add_message(conversation, message)
     db.session.commit()
     
     return jsonify({'message_id': message.id}), 201
@@ -1514,6 +2785,7 @@ def edit_message(message_id):
     message.content = data.get('content', message.content)
     message.is_edited = True
     message.edited_at = datetime.utcnow()
+    publish_message_change(message, 'edited')
     
     db.session.commit()
     
@@ -1529,8 +2801,25 @@ def delete_message(message_id):
     if message.sender_id != user_id:
         return jsonify({'message': 'Unauthorized'}), 403
     
+    # Deleted messages no longer count as unread for the recipient
+    conversation = message.conversation
+    recipient = recipient_id(conversation, message.sender_id)
+    last_read_column, unread_column = participant_columns(conversation, recipient)
+    if not message.is_deleted and message.id > (getattr(conversation, last_read_column.key) or 0):
+        invalidate_badge_count(recipient, 'unread_messages')
+        Conversation.query.filter_by(id=conversation.id).update({
+            unread_column: db.case((unread_column > 0, unread_column - 1), else_=0),
+            Conversation.updated_at: Conversation.updated_at
+        }, synchronize_session=False)
+    
+    # Release the attachment; local uploads are stored as a bare filename
+    if message.file_url and not message.is_deleted:
+        delete_stored(message.file_url if '/' in message.file_url else f'/api/uploads/{message.file_url}')
+        message.file_url = None
+    
     message.is_deleted = True
     message.content = None  # Clear content for privacy
+    publish_message_change(message, 'deleted')
     
     db.session.commit()
     
@@ -1553,13 +2842,14 @@ def delete_item_image(item_id, image_index):
         if image_index < 0 or image_index >= len(additional_images):
             return jsonify({'message': 'Image not found'}), 404
         
-        # Delete the image file and database record
+        # Delete the stored files (every rendition) and database record
         image_to_delete = additional_images[image_index]
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_to_delete.filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        renditions = image_to_delete.renditions or {}
+        for url in renditions.values() or [image_to_delete.url or f'/api/uploads/{image_to_delete.filename}']:
+            delete_stored(url)
         
         db.session.delete(image_to_delete)
+        invalidate_cached('items', f'item:{item_id}')
         db.session.commit()
         
         return jsonify({'message': 'Image deleted successfully'}), 200
@@ -1574,40 +2864,13 @@ def delete_item_image(item_id, image_index):
 def get_appointments():
     user_id = int(get_jwt_identity())
     
-    appointments = Appointment.query.filter(
+    appointments = Appointment.query.options(
+        db.joinedload(Appointment.item), db.joinedload(Appointment.requester), db.joinedload(Appointment.owner)
+    ).filter(
         db.or_(Appointment.requester_id == user_id, Appointment.owner_id == user_id)
     ).order_by(Appointment.appointment_time.desc()).all()
     
-    result = []
-    for apt in appointments:
-        result.append({
-            'id': apt.id,
-            'item': {
-                'id': apt.item.id,
-                'name': apt.item.name,
-                'image_url': f'/api/uploads/{apt.item.image_filename}' if apt.item.image_filename else None
-            },
-            'requester': {
-                'id': apt.requester.id,
-                'username': apt.requester.username
-            },
-            'owner': {
-                'id': apt.owner.id,
-                'username': apt.owner.username
-            },
-            'appointment_time': apt.appointment_time.isoformat(),
-            'location': apt.location,
-            'location_coords': {
-                'lat': apt.location_lat,
-                'lng': apt.location_lng
-            } if apt.location_lat and apt.location_lng else None,
-            'status': apt.status,
-            'notes': apt.notes,
-            'is_owner': apt.owner_id == user_id,
-            'created_at': apt.created_at.isoformat()
-        })
-    
-    return jsonify(result)
+    return jsonify(APPOINTMENT.many(appointments, user_id=user_id))
 
 @app.route('/api/appointments/<int:appointment_id>/status', methods=['PUT'])
 @jwt_required()
@@ -1641,10 +2904,14 @@ def update_appointment_status(appointment_id):
             content=f"📅 {user.username} {data['status']} the appointment on {appointment.appointment_time.strftime('%B %d, %Y at %I:%M %p')}"
         )
         
-        db.session.add(system_message)
-        conversation.updated_at = datetime.utcnow()
+        add_message(conversation, system_message)
     
+    publish_event([appointment.requester_id, appointment.owner_id], 'appointment', {
+        'appointment_id': appointment.id,
+        'status': appointment.status
+    })
     db.session.commit()
+    reminder_scheduler.notify()
     
     return jsonify({'message': f'Appointment {data["status"]}'})
 
@@ -1662,6 +2929,7 @@ def update_appointment(appointment_id):
     # Update appointment
     if 'appointment_time' in data:
         appointment.appointment_time = datetime.fromisoformat(data['appointment_time'])
+        appointment.reminder_sent = False  # Remind again for the new time
     if 'location' in data:
         appointment.location = data['location']
     if 'notes' in data:
@@ -1684,10 +2952,14 @@ def update_appointment(appointment_id):
             content=f"📅 {user.username} updated the appointment on {appointment.appointment_time.strftime('%B %d, %Y at %I:%M %p')}"
         )
         
-        db.session.add(system_message)
-        conversation.updated_at = datetime.utcnow()
+        add_message(conversation, system_message)
     
+    publish_event([appointment.requester_id, appointment.owner_id], 'appointment', {
+        'appointment_id': appointment.id,
+        'status': appointment.status
+    })
     db.session.commit()
+    reminder_scheduler.notify()
     
     return jsonify({'message': 'Appointment updated'})
 
@@ -1718,9 +2990,12 @@ def delete_appointment(appointment_id):
             content=f"📅 {user.username} cancelled the appointment on {appointment.appointment_time.strftime('%B %d, %Y at %I:%M %p')}"
         )
         
-        db.session.add(system_message)
-        conversation.updated_at = datetime.utcnow()
+        add_message(conversation, system_message)
     
+    publish_event([appointment.requester_id, appointment.owner_id], 'appointment', {
+        'appointment_id': appointment.id,
+        'status': 'deleted'
+    })
     db.session.delete(appointment)
     db.session.commit()
     
@@ -1733,6 +3008,11 @@ def create_rating():
     user_id = int(get_jwt_identity())
     data = request.get_json()
     
+    # Whole stars only: the value picks the rating_<n>_count histogram column (5.0 and True would not)
+    stars = data.get('rating')
+    if not isinstance(stars, int) or isinstance(stars, bool) or stars not in range(1, 6):
+        return jsonify({'message': 'Rating must be between 1 and 5'}), 400
+    
     # Check if user already rated this user for this item
     existing_rating = Rating.query.filter_by(
         rater_id=user_id,
@@ -1756,13 +3036,28 @@ def create_rating():
     )
     
     db.session.add(rating)
+    
+    # Update aggregates atomically in the same transaction as the rating
+    histogram_column = getattr(User, f"rating_{data['rating']}_count")
+    User.query.filter_by(id=data['rated_user_id']).update({
+        User.rating_count: db.func.coalesce(User.rating_count, 0) + 1,
+        User.rating_sum: db.func.coalesce(User.rating_sum, 0) + data['rating'],
+        histogram_column: db.func.coalesce(histogram_column, 0) + 1
+    }, synchronize_session=False)
+    invalidate_cached(f"user:{data['rated_user_id']}")
     db.session.commit()
     
     return jsonify({'message': 'Rating submitted successfully'}), 201
 
 @app.route('/api/users/<int:user_id>/ratings', methods=['GET'])
+@response_cache.cached(tags=lambda user_id: [f'user:{user_id}'])
+@replica_router.reads
 def get_user_ratings(user_id):
-    ratings = Rating.query.filter_by(rated_user_id=user_id).order_by(Rating.created_at.desc()).all()
+    # Raters and items come back in the same query as the ratings
+    ratings = Rating.query.options(
+        db.joinedload(Rating.rater),
+        db.joinedload(Rating.item)
+    ).filter_by(rated_user_id=user_id).order_by(Rating.created_at.desc()).all()
     
     result = []
     for rating in ratings:
@@ -1806,8 +3101,7 @@ def can_rate_item(item_id):
 
 if __name__ == '__main__':
     with app.app_context():
-        # Drop and recreate tables to add new models
-        db.drop_all()
-        db.create_all()
-        print("Database recreated with messaging and appointment models")
+        # Bring the schema up to date without discarding existing data
+        for version, name in upgrade(db.engine, db.metadata, MIGRATIONS):
+            print(f"Applied migration {version}: {name}")
     app.run(debug=True)
\ No newline at end of file
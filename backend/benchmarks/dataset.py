@@ -0,0 +1,216 @@
+"""Synthetic marketplace dataset for load benchmarks.
+
+Rows are generated in batches and written with Core executemany inserts on
+one connection (secondary indexes dropped during the load and rebuilt after),
+so the full size (100k users, 1M items, 500k conversations, 10M messages,
+500k requests) loads in minutes rather than hours. IDs are assigned here,
+which lets related rows be generated without reading anything back, and the
+conversation inbox summaries and read cursors come out consistent.
+
+    python benchmarks/dataset.py --scale 0.01      # 1k users, 10k items, 100k messages
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+FULL_SIZES = {
+    'users': 100000,
+    'items': 1000000,
+    'conversations': 500000,
+    'messages': 10000000,
+    'requests': 500000,
+}
+WORDS = (
+    'honda yamaha toyota vespa suzuki ford kia hyundai mazda ducati bicycle sedan scooter '
+    'roadster pickup van electric hybrid diesel manual automatic red blue black white silver '
+    'vintage new used clean spacious reliable fast cheap family sport city touring helmet rack'
+).split()
+MESSAGES = [
+    'Is this still available?', 'Can I pick it up tomorrow morning?', 'Sure, what time works for you?',
+    'Could you do a lower price?', 'Thanks, see you then!', 'Where should we meet?', 'Sent you the address.'
+]
+# Only the benchmark user's password is real; hashing one per row would dominate the load
+PASSWORD_HASH = 'pbkdf2:sha256:1000$benchmark$' + '0' * 64
+
+
+def sizes_for(scale):
+    return {name: max(1, int(count * scale)) for name, count in FULL_SIZES.items()}
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(db, sizes, batch_size=10000, seed=42):
+    """Load a dataset of the given sizes into an empty schema.
+
+    Returns the row counts written; the benchmark user is id 1
+    (bench0@example.com, password 'benchmark').
+    """
+    from app import Conversation, Item, Message, TransactionRequest, User
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    users, items, conversations = sizes['users'], sizes['items'], sizes['conversations']
+    per_conversation = max(1, sizes['messages'] // conversations)
+
+    tables = [model.__table__ for model in (User, Item, Conversation, Message, TransactionRequest)]
+    indexes = [index for table in tables for index in table.indexes]
+
+    started = time.time()
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+            connection.exec_driver_sql('PRAGMA journal_mode = MEMORY')
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+        connection.commit()
+
+        def load(model, rows):
+            count = 0
+            for batch in batches(rows, batch_size):
+                connection.execute(db.insert(model), batch)
+                connection.commit()
+                count += len(batch)
+            print(f"  {model.__tablename__}: {count} rows ({time.time() - started:.0f}s)")
+            return count
+
+        bench_hash = generate_password_hash('benchmark', method='pbkdf2:sha256:1000')
+        load(User, ({
+            'id': i + 1,
+            'username': f'bench{i}',
+            'email': f'bench{i}@example.com',
+            'password_hash': bench_hash if i == 0 else PASSWORD_HASH,
+            'phone': f'09{i:08d}',
+            'address': f'{i % 500} Benchmark street',
+            'created_at': now - timedelta(days=400)
+        } for i in range(users)))
+
+        item_owners = array('i', (rng.randint(1, users) for _ in range(items)))
+        load(Item, ({
+            'id': i + 1,
+            'name': ' '.join(rng.choice(WORDS) for _ in range(3)),
+            'description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+            'category': rng.choice(('car', 'motorbike')),
+            'transaction_type': rng.choice(('lend', 'lend', 'give_away', 'exchange')),
+            'quantity': 1,
+            'available_quantity': 1,
+            'status': 'available',
+            'price_per_hour': 10.0,
+            'user_id': item_owners[i],
+            'created_at': now - timedelta(seconds=rng.randrange(365 * 86400))
+        } for i in range(items)))
+
+        # Conversation c owns message ids (c - 1) * per_conversation + 1 ..., so its summary is known upfront.
+        # The benchmark user takes part in the first conversations so its inbox is never empty.
+        def conversation_rows():
+            for c in range(1, conversations + 1):
+                user1 = 1 if c <= 50 else rng.randint(1, users)
+                user2 = rng.randint(2, users) if user1 == 1 else rng.randint(1, users)
+                last_id = c * per_conversation
+                # user2 has not read the last few messages; user1 sends the even-numbered ones
+                behind = rng.randint(0, min(3, per_conversation))
+                yield {
+                    'id': c,
+                    'user1_id': user1,
+                    'user2_id': user2 if user2 != user1 else user1 % users + 1,
+                    'item_id': rng.randint(1, items),
+                    'created_at': now - timedelta(days=30, seconds=c),
+                    'updated_at': now - timedelta(seconds=c),
+                    'user1_unread_count': 0,
+                    'user2_unread_count': sum(1 for k in range(per_conversation - behind, per_conversation) if k % 2 == 0),
+                    'user1_last_read_message_id': last_id,
+                    'user2_last_read_message_id': last_id - behind
+                }
+        participants = {}
+
+        def remember(rows):
+            for row in rows:
+                participants[row['id']] = (row['user1_id'], row['user2_id'])
+                yield row
+        load(Conversation, remember(conversation_rows()))
+
+        def message_rows():
+            for c in range(1, conversations + 1):
+                pair = participants[c]
+                started_at = now - timedelta(days=30, seconds=c)
+                for k in range(per_conversation):
+                    yield {
+                        'id': (c - 1) * per_conversation + k + 1,
+                        'conversation_id': c,
+                        'sender_id': pair[k % 2],
+                        'message_type': 'text',
+                        'content': MESSAGES[k % len(MESSAGES)],
+                        'created_at': started_at + timedelta(minutes=k)
+                    }
+        load(Message, message_rows())
+        participants.clear()
+        connection.execute(db.update(Conversation).values(
+            last_message_id=Conversation.id * per_conversation
+        ))
+        connection.commit()
+
+        def request_rows():
+            for r in range(sizes['requests']):
+                item_id = 1 + (r % 100 if r < 200 else rng.randrange(items))
+                owner = item_owners[item_id - 1]
+                requester = 1 if r < 100 else rng.randint(1, users)
+                yield {
+                    'id': r + 1,
+                    'item_id': item_id,
+                    'requester_id': requester if requester != owner else requester % users + 1,
+                    'owner_id': owner,
+                    'status': rng.choice(('pending', 'accepted', 'rejected')),
+                    'hours': 2,
+                    'quantity_requested': 1,
+                    'created_at': now - timedelta(seconds=rng.randrange(90 * 86400))
+                }
+        load(TransactionRequest, request_rows())
+
+        for index in indexes:
+            index.create(connection)
+        connection.exec_driver_sql('ANALYZE')
+        connection.commit()
+        print(f"  indexes rebuilt ({time.time() - started:.0f}s)")
+
+    return {**sizes, 'messages': conversations * per_conversation}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the full dataset size')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('UPLOAD_FOLDER', tmpdir)
+
+    from app import app, db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        print(f"Seeding {os.environ['DATABASE_URL']}")
+        print(seed(db, sizes_for(args.scale), args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
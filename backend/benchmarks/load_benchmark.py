@@ -0,0 +1,182 @@
+"""Latency and query counts for the hot read routes on a synthetic dataset.
+
+Seeds a database with benchmarks/dataset.py (unless --no-seed is given for a
+DATABASE_URL seeded earlier), then drives each route through the Flask test
+client as randomly chosen users and reports p50/p95/p99 latency and queries
+per request (from X-Query-Count). The response cache is off unless --cache
+is passed, so the numbers measure the database path.
+
+    python benchmarks/load_benchmark.py --scale 0.1 --requests 200 --output run.json
+    python benchmarks/load_benchmark.py --no-seed --baseline run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# (name, path template); {user_id} and {conversation_id} are filled per request
+ROUTES = [
+    ('items', '/api/items'),
+    ('conversations', '/api/conversations'),
+    ('messages', '/api/conversations/{conversation_id}/messages'),
+    ('requests', '/api/requests'),
+    ('profile', '/api/users/{user_id}'),
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_route(client, path, pick, tokens, count, warmup):
+    """Issue warmup + count requests, returns the stats of the timed ones"""
+    samples, queries, statuses = [], [], {}
+    for n in range(warmup + count):
+        user_id, conversation_id = pick()
+        url = path.format(user_id=user_id, conversation_id=conversation_id)
+        headers = {'Authorization': f'Bearer {tokens(user_id)}'}
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        if n < warmup:
+            continue
+        samples.append(elapsed)
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return {
+        'requests': count,
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p95_ms': round(percentile(samples, 95), 2),
+        'p99_ms': round(percentile(samples, 99), 2),
+        'mean_ms': round(statistics.mean(samples), 2),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'status_codes': {str(code): n for code, n in sorted(statuses.items())}
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'route':<15}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}  status")
+    for name, stats in report['routes'].items():
+        print(f"{name:<15}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+              f"{stats['queries_per_request']:>9.1f}  {stats['status_codes']}")
+        previous = (baseline or {}).get('routes', {}).get(name)
+        if previous:
+            deltas = [
+                f"{key[:-3]} {(stats[key] - previous[key]) / previous[key] * 100:+.0f}%"
+                for key in ('p50_ms', 'p95_ms', 'p99_ms') if previous[key]
+            ]
+            print(f"{'  vs baseline':<15}{', '.join(deltas)}, queries {previous['queries_per_request']:.1f}"
+                  f" -> {stats['queries_per_request']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=0.1, help='dataset size as a fraction of the full one')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the dataset already in DATABASE_URL')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--routes', nargs='*', choices=[name for name, _ in ROUTES])
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-of-sufficient-length')
+    os.environ.setdefault('UPLOAD_FOLDER', tmpdir)
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'true' if args.cache else 'false'
+    os.environ['QUERY_STATS_ENABLED'] = 'true'
+
+    from flask_jwt_extended import create_access_token
+    from app import app, db, Conversation, User
+    import dataset
+
+    with app.app_context():
+        if args.no_seed:
+            sizes = {'users': User.query.count(), 'conversations': Conversation.query.count()}
+        else:
+            db.drop_all()
+            db.create_all()
+            print(f"Seeding {os.environ['DATABASE_URL']} at scale {args.scale}")
+            sizes = dataset.seed(db, dataset.sizes_for(args.scale))
+
+        # Conversation participants, so message requests come from someone allowed to read them;
+        # the seeder gives the first 50 conversations to the heavy benchmark user (id 1)
+        rng = random.Random(7)
+        sample_ids = set(rng.sample(range(1, sizes['conversations'] + 1), min(1000, sizes['conversations'])))
+        sample_ids.update(range(1, min(50, sizes['conversations']) + 1))
+        participants = db.session.query(Conversation.id, Conversation.user1_id, Conversation.user2_id).filter(
+            Conversation.id.in_(sample_ids)
+        ).all()
+        heavy = [row for row in participants if row.id <= 50]
+
+        token_cache = {}
+
+        def tokens(user_id):
+            if user_id not in token_cache:
+                token_cache[user_id] = create_access_token(identity=str(user_id))
+            return token_cache[user_id]
+
+        def pick():
+            # Half the requests come from the heavy benchmark user, half from random participants
+            if rng.random() < 0.5:
+                conversation_id, user1, _ = rng.choice(heavy)
+                return user1, conversation_id
+            conversation_id, user1, user2 = rng.choice(participants)
+            return rng.choice((user1, user2)), conversation_id
+
+        client = app.test_client()
+        report = {
+            'run': {
+                'date': datetime.utcnow().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'database': db.engine.dialect.name,
+                'python': platform.python_version(),
+                'dataset': sizes,
+                'requests_per_route': args.requests,
+                'response_cache': args.cache
+            },
+            'routes': {}
+        }
+        for name, path in ROUTES:
+            if args.routes and name not in args.routes:
+                continue
+            report['routes'][name] = run_route(client, path, pick, tokens, args.requests, args.warmup)
+            print(f"  {name}: done")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
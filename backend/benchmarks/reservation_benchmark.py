@@ -0,0 +1,165 @@
+"""Concurrent request acceptances against one lend item.
+
+Seeds an item with --capacity units and --requests pending one-unit requests
+from different users, then has the owner accept all of them at once from
+--threads threads through the Flask test client. Reports the response codes,
+responses per second and whether the item was oversold: exactly min(capacity,
+requests) acceptances may succeed and available_quantity must end at
+capacity minus those.
+
+    python benchmarks/reservation_benchmark.py --requests 500 --capacity 100 --threads 16
+
+SQLite allows one writer at a time, so on SQLite every transaction starts
+with BEGIN IMMEDIATE and waits its turn (see serialize_sqlite_writers).
+PostgreSQL/MySQL only serialize the single reservation UPDATE on the item row.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+
+def serialize_sqlite_writers(engine, busy_timeout=30):
+    """Take SQLite's write lock at BEGIN so concurrent transactions queue instead of deadlocking.
+
+    Call after creating the schema (the search index opens a second connection
+    while create_all holds the lock); pooled connections are discarded.
+    """
+    engine.dispose()
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None  # let the begin hook below issue BEGIN
+        dbapi_connection.execute(f'PRAGMA busy_timeout = {busy_timeout * 1000}')
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def seed_contention(db, capacity, requests):
+    """One lend item with capacity units and requests pending requests for it.
+
+    Returns (owner_id, item_id, request ids); ids continue after existing rows.
+    """
+    from app import Item, TransactionRequest, User
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        first_user = (connection.scalar(db.select(db.func.max(User.id))) or 0) + 1
+        connection.execute(db.insert(User), [{
+            'id': first_user + i,
+            'username': f'contender{first_user + i}',
+            'email': f'contender{first_user + i}@example.com',
+            'password_hash': 'x',
+            'phone': '0900000000',
+            'address': 'Benchmark street',
+            'created_at': now
+        } for i in range(requests + 1)])
+        item_id = connection.execute(db.insert(Item).values(
+            name='Contended car', category='car', transaction_type='lend', quantity=capacity,
+            available_quantity=capacity, price_per_hour=10.0, user_id=first_user, created_at=now
+        )).inserted_primary_key[0]
+        first_request = (connection.scalar(db.select(db.func.max(TransactionRequest.id))) or 0) + 1
+        connection.execute(db.insert(TransactionRequest), [{
+            'id': first_request + i,
+            'item_id': item_id,
+            'requester_id': first_user + 1 + i,
+            'owner_id': first_user,
+            'status': 'pending',
+            'hours': 2,
+            'quantity_requested': 1,
+            'created_at': now
+        } for i in range(requests)])
+    return first_user, item_id, list(range(first_request, first_request + requests))
+
+
+def fire_accepts(app, owner_id, request_ids, threads):
+    """Accept every request concurrently; returns ({status code: count}, seconds)"""
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(owner_id))}'}
+
+    def accept(request_id):
+        return app.test_client().post(f'/api/requests/{request_id}/respond', json={'status': 'accepted'},
+                                      headers=headers).status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        codes = list(executor.map(accept, request_ids))
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for code in codes:
+        statuses[code] = statuses.get(code, 0) + 1
+    return statuses, elapsed
+
+
+def outcome(db, item_id):
+    """(available_quantity, accepted requests) as stored"""
+    from app import Item, TransactionRequest
+    with db.engine.connect() as connection:
+        available = connection.scalar(db.select(Item.available_quantity).where(Item.id == item_id))
+        accepted = connection.scalar(db.select(db.func.count()).select_from(TransactionRequest).where(
+            TransactionRequest.item_id == item_id, TransactionRequest.status == 'accepted'
+        ))
+    return available, accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--capacity', type=int, default=100)
+    parser.add_argument('--threads', type=int, nargs='*', default=[1, 4, 16])
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'reservations.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-of-sufficient-length')
+    os.environ.setdefault('UPLOAD_FOLDER', tmpdir)
+    os.environ['QUERY_STATS_ENABLED'] = 'false'
+
+    from app import app, db
+
+    report = {'requests': args.requests, 'capacity': args.capacity, 'runs': []}
+    with app.app_context():
+        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            serialize_sqlite_writers(db.engine)
+        database = db.engine.dialect.name
+
+    for threads in args.threads:
+        with app.app_context():
+            owner_id, item_id, request_ids = seed_contention(db, args.capacity, args.requests)
+        statuses, elapsed = fire_accepts(app, owner_id, request_ids, threads)
+        with app.app_context():
+            available, accepted = outcome(db, item_id)
+        expected = min(args.capacity, args.requests)
+        run = {
+            'threads': threads,
+            'responses_per_second': round(len(request_ids) / elapsed, 1),
+            'status_codes': {str(code): n for code, n in sorted(statuses.items())},
+            'accepted': accepted,
+            'available_quantity': available,
+            'oversold': accepted > expected or available != args.capacity - accepted or statuses.get(200, 0) != accepted
+        }
+        report['runs'].append(run)
+        print(f"{threads:>3} threads: {run['responses_per_second']:>8.1f} responses/s  {run['status_codes']}  "
+              f"accepted {accepted}/{expected}, left {available}{'  OVERSOLD' if run['oversold'] else ''}")
+
+    print(f"({database})")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
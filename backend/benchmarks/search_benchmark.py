@@ -0,0 +1,107 @@
+"""Item search latency: full-text index vs leading-wildcard substring matching.
+
+Seeds a throwaway SQLite database (or DATABASE_URL if set) and times
+GET /api/items?search=... with the index enabled and with the ILIKE fallback.
+
+    python benchmarks/search_benchmark.py --items 500000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+WORDS = (
+    'honda yamaha toyota vespa suzuki ford kia hyundai mazda ducati bicycle sedan scooter '
+    'roadster pickup van electric hybrid diesel manual automatic red blue black white silver '
+    'vintage new used clean spacious reliable fast cheap family sport city touring helmet rack'
+).split()
+QUERIES = ['vespa', 'red scooter', 'vint', 'family sedan automatic', 'nomatchatall']
+
+
+def sentence(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def seed(db, Item, User, items, users, batch=10000):
+    rng = random.Random(42)
+    now = time.time()
+    db.session.execute(db.insert(User), [{
+        'id': i + 1,
+        'username': f'user{i}',
+        'email': f'user{i}@example.com',
+        'password_hash': 'x',
+        'phone': '0000000000',
+        'address': 'Benchmark street'
+    } for i in range(users)])
+    for start in range(0, items, batch):
+        db.session.execute(db.insert(Item), [{
+            'name': sentence(rng, 3),
+            'description': sentence(rng, 20),
+            'category': rng.choice(['car', 'motorbike']),
+            'transaction_type': 'lend',
+            'quantity': 1,
+            'available_quantity': 1,
+            'status': 'available',
+            'user_id': rng.randint(1, users)
+        } for _ in range(start, min(start + batch, items))])
+    db.session.commit()
+    print(f"Seeded {items} items in {time.time() - now:.1f}s")
+
+
+def time_queries(client, repeat):
+    results = {}
+    for q in QUERIES:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(f'/api/items?search={q}')
+            samples.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200
+        results[q] = (statistics.median(samples), response.get_json()['pagination']['total'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=500000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'search_bench.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('UPLOAD_FOLDER', tmpdir)
+
+    from app import app, db, Item, User, search_index
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, Item, User, args.items, args.users)
+
+        started = time.time()
+        search_index.rebuild()
+        db.session.commit()
+        print(f"Built search index in {time.time() - started:.1f}s")
+
+        client = app.test_client()
+        indexed = time_queries(client, args.repeat)
+
+        # Force the substring fallback on the same data
+        search_index._backends[str(db.engine.url)] = None
+        fallback = time_queries(client, args.repeat)
+
+    print(f"\n{'query':<26}{'matches':>10}{'index ms':>12}{'ILIKE ms':>12}")
+    for q in QUERIES:
+        print(f"{q:<26}{indexed[q][1]:>10}{indexed[q][0]:>12.1f}{fallback[q][0]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
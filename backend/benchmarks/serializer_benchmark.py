@@ -0,0 +1,88 @@
+"""Item serialization cost: projection plus JSON encoding, per 1,000 items.
+
+Builds unsaved Item rows (with an owner and two additional images each), so
+no database is touched, and times ITEM_LISTING.many() followed by encoding
+with orjson (if installed) and with the stdlib json fallback.
+
+    python benchmarks/serializer_benchmark.py --items 1000 --repeat 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+
+def build_items(Item, ItemImage, User, count):
+    owner = User(id=1, username='owner', email='owner@example.com', phone='0000000000', address='Benchmark street')
+    items = []
+    for i in range(count):
+        item = Item(
+            id=i + 1,
+            name=f'Item {i}',
+            description='A reasonably sized description of a car or motorbike available to borrow nearby. ' * 2,
+            category='car',
+            transaction_type='lend',
+            quantity=1,
+            available_quantity=1,
+            status='available',
+            price_per_hour=12.5,
+            image_renditions={'full': f'/api/uploads/{i:064x}.jpg', 'thumb': f'/api/uploads/{i:064x}_thumb.jpg'},
+            created_at=datetime(2024, 1, 1, 12, 0, i % 60, i),
+            user=owner
+        )
+        item.additional_images = [ItemImage(filename=f'{i}-{j}.jpg', status='ready') for j in range(2)]
+        items.append(item)
+    return items
+
+
+def time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'serializer_bench.db')}")
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('UPLOAD_FOLDER', tmpdir)
+
+    import serializers
+    from app import app, Item, ItemImage, User, ITEM_LISTING
+
+    items = build_items(Item, ItemImage, User, args.items)
+    payload = {'items': ITEM_LISTING.many(items)}
+    per_thousand = 1000 / args.items
+
+    results = [('project', time_ms(lambda: ITEM_LISTING.many(items), args.repeat))]
+    if serializers.orjson is not None:
+        results.append(('encode orjson', time_ms(lambda: app.json.encode(payload), args.repeat)))
+    fast = serializers.orjson
+    serializers.orjson = None
+    try:
+        results.append(('encode stdlib', time_ms(lambda: app.json.encode(payload), args.repeat)))
+    finally:
+        serializers.orjson = fast
+
+    print(f"{args.items} items, {len(app.json.encode(payload)) / args.items:.0f} bytes each, median of {args.repeat}")
+    print(f"\n{'step':<16}{'ms / 1,000 items':>18}")
+    for step, ms in results:
+        print(f"{step:<16}{ms * per_thousand:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
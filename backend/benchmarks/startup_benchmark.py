@@ -0,0 +1,107 @@
+"""Cold start: import time by package and time to the first /api/items response.
+
+Each sample runs in a fresh interpreter configured like production (AWS
+credentials and a bucket set, so S3 is enabled) against a throwaway SQLite
+database. Reports the median import and first-response times, the heaviest
+packages from ``python -X importtime``, and which optional heavy packages were
+loaded by the time the first response was sent.
+
+    python benchmarks/startup_benchmark.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+HEAVY_PACKAGES = ('boto3', 'botocore', 'PIL', 'sentry_sdk', 'smtplib')
+
+FIRST_RESPONSE = f'''
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+response = app_module.app.test_client().get('/api/items')
+assert response.status_code == 200, response.status_code
+responded = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (responded - started) * 1000,
+    'loaded': [name for name in {HEAVY_PACKAGES!r} if name in sys.modules]
+}}))
+'''
+
+
+def environment(tmpdir):
+    database = os.path.join(tmpdir, 'startup.db')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{database}',
+        JWT_SECRET_KEY='benchmark-secret-key-of-sufficient-length',
+        UPLOAD_FOLDER=tmpdir,
+        AWS_ACCESS_KEY_ID='benchmark',
+        AWS_SECRET_ACCESS_KEY='benchmark',
+        S3_BUCKET_NAME='benchmark-bucket',
+        IMAGE_WORKERS='0'
+    )
+    # Schema outside the timed runs, as a deployed database already has it
+    subprocess.run([sys.executable, '-c', 'from app import app, db\nwith app.app_context(): db.create_all()'],
+                   cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+    return env
+
+
+def import_profile(env):
+    """{top-level package: self microseconds} from one -X importtime run"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True)
+    totals = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    env = environment(tempfile.mkdtemp())
+    samples = []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, '-c', FIRST_RESPONSE],
+                                cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    profile = import_profile(env)
+
+    report = {
+        'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 1),
+        'first_response_ms': round(statistics.median(sample['first_response_ms'] for sample in samples), 1),
+        'loaded_before_first_response': samples[-1]['loaded'],
+        'import_self_ms_by_package': {
+            name: round(us / 1000, 1) for name, us in sorted(profile.items(), key=lambda entry: -entry[1])[:args.top]
+        }
+    }
+
+    print(f"import app:            {report['import_ms']:.0f} ms (median of {args.runs})")
+    print(f"first /api/items:      {report['first_response_ms']:.0f} ms from interpreter start of import")
+    print(f"heavy packages loaded: {', '.join(report['loaded_before_first_response']) or 'none'}")
+    print(f"\n{'package':<28}{'self ms':>10}")
+    for name, ms in report['import_self_ms_by_package'].items():
+        print(f"{name:<28}{ms:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
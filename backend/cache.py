@@ -0,0 +1,85 @@
+"""Small key/value cache backends.
+
+LRUCache lives in process memory; RedisCache shares entries across gunicorn
+workers when REDIS_URL is set. Values must be JSON-serializable.
+"""
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe in-process cache with LRU eviction and optional per-entry TTL"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return entry[1] if entry else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """Redis-backed cache with the same interface as LRUCache"""
+
+    def __init__(self, url, prefix='cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        # EX only takes whole seconds; round fractional TTLs up rather than expiring early
+        self.client.set(self.prefix + key, json.dumps(value), ex=math.ceil(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_cache(redis_url=None, max_entries=10000, prefix='cache:'):
+    """RedisCache when a URL is configured, otherwise an LRUCache"""
+    if redis_url:
+        return RedisCache(redis_url, prefix=prefix)
+    return LRUCache(max_entries=max_entries)
@@ -0,0 +1,83 @@
+"""Connection pool options and read-replica routing.
+
+Replicas are ordinary Flask-SQLAlchemy binds. Views wrapped in
+ReplicaRouter.reads run their queries on a random replica bind through
+RoutingSession, unless one of the request's sticky keys (e.g. the caller's
+user, or a cache tag the view renders) changed within the replication lag
+window; those requests read from the primary so users see their own writes
+and freshly invalidated cache entries are not rebuilt from stale rows.
+"""
+import logging
+import random
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+logger = logging.getLogger(__name__)
+
+
+def pool_options(url, pool_size=8, max_overflow=4, pre_ping=True, recycle=1800, timeout=30):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL.
+
+    Sizing only applies to server databases; SQLite engines keep the pool
+    Flask-SQLAlchemy picks for them.
+    """
+    options = {'pool_pre_ping': pre_ping}
+    if url and not url.startswith('sqlite'):
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_recycle=recycle, pool_timeout=timeout)
+    return options
+
+
+class RoutingSession(Session):
+    """Uses the request's replica bind for reads while ReplicaRouter.reads is active"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and bind is None and not self._flushing:
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """Decides, per request, whether a read-only view may use a replica.
+
+    recent_changes is a cache (cache.py) shared by the workers; record()
+    marks keys as changed for lag_seconds. sticky_keys() returns the keys
+    the current request depends on.
+    """
+
+    def __init__(self, replica_keys, recent_changes, sticky_keys, lag_seconds=5):
+        self.replica_keys = list(replica_keys)
+        self.recent_changes = recent_changes
+        self.sticky_keys = sticky_keys
+        self.lag_seconds = lag_seconds
+
+    def record(self, *keys):
+        if not self.replica_keys:
+            return
+        for key in keys:
+            try:
+                self.recent_changes.set(key, 1, ttl=self.lag_seconds)
+            except Exception:
+                # Without the marker this user's next reads may hit a lagging replica
+                logger.exception("Replica stickiness write failed for %s", key)
+
+    def changed_recently(self, keys):
+        try:
+            return any(self.recent_changes.get(key) for key in keys)
+        except Exception:
+            logger.exception("Replica stickiness read failed")
+            return True
+
+    def reads(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.replica_keys or self.changed_recently(self.sticky_keys()):
+                return view(*args, **kwargs)
+            g.db_replica = random.choice(self.replica_keys)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                g.pop('db_replica', None)
+        return wrapper
@@ -0,0 +1,26 @@
+"""gunicorn hooks, loaded from the working directory; the Dockerfile CMD flags set the rest.
+
+With PROMETHEUS_MULTIPROC_DIR set, workers share metrics through files in that
+directory (see metrics.py), which must start empty and forget exited workers.
+
+/api/events streams only see events published in their own process unless
+REDIS_URL is set, so several workers serving them need Redis.
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and os.getenv('EVENT_STREAM_ENABLED', '').lower() == 'true' and not os.getenv('REDIS_URL'):
+        raise RuntimeError('EVENT_STREAM_ENABLED with several workers needs REDIS_URL')
+    
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
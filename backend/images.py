@@ -0,0 +1,111 @@
+"""Image renditions and the background pool that produces them.
+
+Uploads are decoded once and re-encoded at several widths so listing pages
+can serve small thumbnails while the detail page gets the full image.
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# (name, max width), largest first so each rendition is scaled from the previous one
+RENDITIONS = (
+    ('full', 1200),
+    ('card', 640),
+    ('thumb', 320),
+)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+def rendition_filename(base, name, extension='jpg'):
+    """<base>_<name>.jpg; the suffix keeps renditions apart from raw uploads stored as <base>.<ext>"""
+    return f'{base}_{name}.{extension}'
+
+
+def rendition_filenames(base, webp=False):
+    """{key: filename} for everything render_renditions produces from one upload"""
+    filenames = {}
+    for name, _ in RENDITIONS:
+        filenames[name] = rendition_filename(base, name)
+        if webp:
+            filenames[f'{name}_webp'] = rendition_filename(base, name, 'webp')
+    return filenames
+
+
+def render_renditions(data, base, webp=False):
+    """Encode every rendition of an uploaded image.
+
+    Returns {key: (filename, content_type, bytes)} where key is the rendition
+    name, or '<name>_webp' for the optional WebP copies.
+    """
+    # Pillow is only needed once an upload arrives, not at worker start
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft('RGB', (RENDITIONS[0][1], RENDITIONS[0][1]))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    results = {}
+    for name, width in RENDITIONS:
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        results[name] = (rendition_filename(base, name), 'image/jpeg', buffer.getvalue())
+
+        if webp:
+            buffer = io.BytesIO()
+            image.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+            results[f'{name}_webp'] = (rendition_filename(base, name, 'webp'), 'image/webp', buffer.getvalue())
+    return results
+
+
+class ImagePipeline:
+    """Bounded background pool for image jobs.
+
+    At most max_pending jobs are queued or running; submit() refuses more so
+    callers can process them inline instead. With workers=0 (tests, Lambda)
+    callers use run_concurrently to process a request's images in parallel
+    before responding instead.
+    """
+
+    def __init__(self, workers=2, inline_concurrency=4, max_pending=16):
+        self.workers = workers
+        self.inline_concurrency = inline_concurrency
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run_concurrently(self, fn, arg_tuples):
+        """Call fn for each argument tuple on a short-lived bounded pool and wait.
+
+        Returns (result, exception) per call, in order.
+        """
+        if not arg_tuples:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(arg_tuples), self.inline_concurrency)) as executor:
+            futures = [executor.submit(fn, *args) for args in arg_tuples]
+        return [(None, future.exception()) if future.exception() else (future.result(), None) for future in futures]
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn on the background workers; None when max_pending jobs are already waiting"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-pipeline')
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Image job failed', exc_info=future.exception())
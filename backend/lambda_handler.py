@@ -1,4 +1,9 @@
+import os
 import serverless_wsgi
+
+# Lambda freezes background threads once a response is returned, so process images inline
+os.environ.setdefault('IMAGE_WORKERS', '0')
+
 from app import app
 
 def lambda_handler(event, context):
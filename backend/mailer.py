@@ -0,0 +1,79 @@
+"""Outbound email transports used by the outbox delivery worker.
+
+SESMailer keeps one SES client for the life of the process (boto3 clients are
+thread-safe and reuse their HTTP connections), created on the first send so
+boto3 is not imported at start-up. StubMailer stands in for local development
+without AWS credentials, and records messages for tests.
+"""
+import threading
+
+
+class SESMailer:
+    def __init__(self, source, region, access_key_id=None, secret_access_key=None, endpoint_url=None, session=None):
+        self.source = source
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.endpoint_url = endpoint_url  # e.g. a local SES stub such as localstack
+        self.session = session  # callable returning the boto3 session to create the client from
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if self.session is not None:
+                    factory = self.session()
+                else:
+                    import boto3
+                    factory = boto3
+                self._client = factory.client(
+                    'ses',
+                    aws_access_key_id=self.access_key_id,
+                    aws_secret_access_key=self.secret_access_key,
+                    region_name=self.region,
+                    endpoint_url=self.endpoint_url
+                )
+            return self._client
+
+    def send(self, to_email, subject, body):
+        """Send one message, raising on failure"""
+        self.client.send_email(
+            Source=self.source,
+            Destination={'ToAddresses': [to_email]},
+            Message={
+                'Subject': {'Data': subject},
+                'Body': {'Text': {'Data': body}}
+            }
+        )
+
+
+class StubMailer:
+    """Logs each message's subject instead of sending it.
+
+    With keep_sent (tests) messages are also kept in .sent; exceptions queued
+    in .failures are raised by the next sends. Bodies are never logged, as
+    they carry verification and reset codes.
+    """
+
+    def __init__(self, verbose=True, keep_sent=False):
+        self.verbose = verbose
+        self.keep_sent = keep_sent
+        self.sent = []
+        self.failures = []
+
+    def send(self, to_email, subject, body):
+        if self.failures:
+            raise self.failures.pop(0)
+        if self.keep_sent:
+            self.sent.append((to_email, subject, body))
+        if self.verbose:
+            print(f"Email (not sent, no SES configured): {subject}")
+
+
+def create_mailer(backend, **ses_options):
+    """SESMailer for backend 'ses', otherwise a StubMailer"""
+    if backend == 'ses':
+        return SESMailer(**ses_options)
+    return StubMailer()
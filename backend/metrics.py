@@ -0,0 +1,124 @@
+"""Prometheus metrics served at /metrics.
+
+Covers request latency by route and status, requests in flight, time spent
+waiting for a pooled database connection, AWS (S3/SES) call latency and
+cache lookups (hit ratio = hits / all lookups per cache).
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR (to an empty directory, before
+the workers start): every worker then writes its samples there and /metrics
+aggregates all of them, whichever worker serves the scrape. gunicorn.conf.py
+cleans up after workers that exit. Without it the in-process registry is used.
+"""
+import os
+import time
+
+from flask import Response, g, has_app_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['method', 'route', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests being handled', ['method', 'route'], multiprocess_mode='livesum'
+)
+DB_POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled database connection',
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+)
+EXTERNAL_CALL_LATENCY = Histogram(
+    'external_call_duration_seconds', 'AWS API call latency', ['service', 'operation', 'outcome'],
+    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups', ['cache', 'result'])
+
+
+def route_label():
+    """The matched URL rule, so label values stay bounded"""
+    return request.url_rule.rule if request.url_rule else '<unmatched>'
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+class Metrics:
+    """Attach with init_app(app); instrument engines and boto3 sessions separately"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._observe)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def export(self):
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+    def instrument_engine(self, engine):
+        """Time connection checkouts from the engine's pool"""
+        pool = engine.pool
+        do_get = pool._do_get
+
+        def timed_do_get():
+            started = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                DB_POOL_CHECKOUT.observe(time.perf_counter() - started)
+
+        pool._do_get = timed_do_get
+
+    def instrument_boto3(self, session):
+        """Time every call made by clients created from this boto3 session from now on"""
+        # Timed from parameter building, the first per-call event every client emits
+        session.events.register('before-parameter-build', self._before_aws_call)
+        session.events.register('after-call', self._after_aws_call)
+        session.events.register('after-call-error', self._after_aws_error)
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_labels = (request.method, route_label())
+        REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+    def _observe(self, response):
+        if 'metrics_started' in g:
+            REQUEST_LATENCY.labels(*g.metrics_labels, response.status_code).observe(
+                time.perf_counter() - g.pop('metrics_started')
+            )
+        return response
+
+    def _finish(self, exception):
+        # The test client can tear a request down after its app context (and g) is gone
+        if not has_app_context() or 'metrics_labels' not in g:
+            return
+        if 'metrics_started' in g:
+            # Unhandled exception: after_request never ran
+            REQUEST_LATENCY.labels(*g.metrics_labels, 500).observe(time.perf_counter() - g.pop('metrics_started'))
+        REQUESTS_IN_PROGRESS.labels(*g.pop('metrics_labels')).dec()
+
+    def _before_aws_call(self, model, context, **kwargs):
+        context['metrics_call'] = (model.service_model.service_name, model.name, time.perf_counter())
+
+    def _after_aws_call(self, http_response, context, **kwargs):
+        self._observe_aws(context, 'ok' if http_response.status_code < 400 else 'error')
+
+    def _after_aws_error(self, context, **kwargs):
+        # Connection failures and timeouts; no response was received
+        self._observe_aws(context, 'error')
+
+    def _observe_aws(self, context, outcome):
+        call = context.pop('metrics_call', None)
+        if call is not None:
+            service, operation, started = call
+            EXTERNAL_CALL_LATENCY.labels(service, operation, outcome).observe(time.perf_counter() - started)
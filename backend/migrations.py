@@ -0,0 +1,142 @@
+"""Versioned schema migrations and query-plan checks.
+
+Each migration is ``(version, name, fn)`` where fn(connection, metadata)
+brings the database forward; ``upgrade`` runs the ones newer than the highest
+version recorded in ``schema_version``, each in its own transaction.
+Migrations are written to be idempotent, so a database created with
+``create_all`` can be upgraded (or merely stamped) safely.
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, func, inspect, select, text
+
+version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Serializes concurrent upgrades (several gunicorn workers starting at once) on Postgres
+POSTGRES_LOCK_KEY = 7319
+
+
+def current_version(connection):
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine, metadata, migrations):
+    """Apply pending migrations in version order, returns [(version, name)] applied"""
+    with engine.begin() as connection:
+        version_metadata.create_all(connection)
+
+    applied = []
+    for version, name, migrate in sorted(migrations, key=lambda migration: migration[0]):
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': POSTGRES_LOCK_KEY})
+            if version <= current_version(connection):
+                continue
+            migrate(connection, metadata)
+            connection.execute(schema_version.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append((version, name))
+    return applied
+
+
+# Migration building blocks
+def create_missing_schema(connection, metadata):
+    """Create missing tables and add columns the models gained since their table was created.
+
+    Added columns are nullable and unconstrained; backfill them separately.
+    """
+    metadata.create_all(connection, checkfirst=True)
+    for table in metadata.sorted_tables:
+        _add_missing_columns(connection, table, [column.name for column in table.columns])
+
+
+def add_columns(table_name, *column_names):
+    """Migration adding the named model columns to an existing table, if missing"""
+    def migrate(connection, metadata):
+        _add_missing_columns(connection, metadata.tables[table_name], column_names)
+    return migrate
+
+
+def _add_missing_columns(connection, table, column_names):
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    preparer = connection.dialect.identifier_preparer
+    for name in column_names:
+        if name not in existing:
+            column = table.columns[name]
+            connection.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} '
+                f'ADD COLUMN {preparer.format_column(column)} {column.type.compile(connection.dialect)}'
+            ))
+
+
+def create_tables(*names):
+    """Migration creating the named model tables (and their indexes), if missing"""
+    def migrate(connection, metadata):
+        metadata.create_all(connection, tables=[metadata.tables[name] for name in names], checkfirst=True)
+    return migrate
+
+
+def create_indexes(*names):
+    """Migration creating the named indexes declared on the models, if missing"""
+    def migrate(connection, metadata):
+        declared = {index.name: index for table in metadata.tables.values() for index in table.indexes}
+        for name in names:
+            declared[name].create(connection, checkfirst=True)
+    return migrate
+
+
+def create_retired_index(name, table_name, *column_names, **dialect_kw):
+    """Migration creating an index the models no longer declare, as a shipped migration did.
+
+    Keeps old migrations doing exactly what they did when they shipped; a
+    later migration drops the index again.
+    """
+    def migrate(connection, metadata):
+        table = Table(table_name, MetaData(), *[Column(column_name) for column_name in column_names])
+        Index(name, *table.columns, **dialect_kw).create(connection, checkfirst=True)
+    return migrate
+
+
+def drop_indexes(*names):
+    """Migration dropping indexes the models no longer declare"""
+    def migrate(connection, metadata):
+        for name in names:
+            connection.execute(text(f'DROP INDEX IF EXISTS {connection.dialect.identifier_preparer.quote(name)}'))
+    return migrate
+
+
+def run_all(*migrations):
+    """Combine several migration steps into one version"""
+    def migrate(connection, metadata):
+        for step in migrations:
+            step(connection, metadata)
+    return migrate
+
+
+# Query plans
+def explain(connection, statement, parameters=()):
+    """Plan lines for a raw SQL statement as the driver would run it.
+
+    On Postgres sequential scans are disabled for the duration so the plan
+    shows whether an index *can* serve the query, regardless of table size.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).all()
+    else:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return [row[-1] for row in rows]
+
+
+FULL_SCAN_RE = re.compile(r'^\s*(?:->\s*)?(?:SCAN (?!.*VIRTUAL TABLE)|Seq Scan on )"?(\w+)"?')
+
+
+def full_scans(plan):
+    """Tables (or aliases) a plan reads in full"""
+    return {match.group(1) for match in map(FULL_SCAN_RE.match, plan) if match}
@@ -0,0 +1,95 @@
+"""Password hashing off the request threads.
+
+Hashes are computed by a small process pool so a burst of logins cannot hold
+the GIL of a gunicorn worker (and the browsing requests on its other threads).
+At most max_pending hash operations per worker are queued or running; callers
+beyond that wait up to queue_timeout for a slot and then get
+PasswordHasherBusy, which the routes turn into a 503; so do hashes that take
+longer than result_timeout. A pool broken by a dying process (OOM kill) is
+replaced, and the hash retried once.
+
+Hashes use Werkzeug's format, so existing rows keep verifying. When the
+configured method (e.g. pbkdf2:sha256:600000) differs from the one a stored
+hash was made with, needs_rehash() tells login to re-hash the password.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULTS = {
+    'pbkdf2': ('sha256', str(DEFAULT_PBKDF2_ITERATIONS)),
+    'scrypt': ('32768', '8', '1'),
+}
+
+
+class PasswordHasherBusy(Exception):
+    """Every hashing slot stayed taken for queue_timeout seconds"""
+
+
+def normalize_method(method):
+    """'pbkdf2' -> 'pbkdf2:sha256:600000', the prefix Werkzeug stores"""
+    name, *params = method.split(':')
+    defaults = DEFAULTS.get(name, ())
+    return ':'.join([name, *params, *defaults[len(params):]])
+
+
+class PasswordHasher:
+    """Werkzeug hashing on a bounded process pool (workers=0 hashes inline, for tests)"""
+
+    def __init__(self, method='pbkdf2', workers=2, max_pending=4, queue_timeout=1.0, result_timeout=10.0):
+        self.method = normalize_method(method)
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.result_timeout = result_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            for attempt in range(2):
+                pool = self._pool()
+                try:
+                    return pool.submit(fn, *args).result(timeout=self.result_timeout)
+                except BrokenProcessPool:
+                    self._discard(pool)
+                    if attempt:
+                        raise
+                except TimeoutError:
+                    # Later hashes would queue behind a stuck one; give them a fresh pool
+                    self._discard(pool)
+                    raise PasswordHasherBusy()
+        finally:
+            self._slots.release()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a worker that already runs threads can copy held locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _discard(self, pool):
+        """Stop handing out pool; the next call starts a new one"""
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False, cancel_futures=True)
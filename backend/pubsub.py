@@ -0,0 +1,92 @@
+"""Publish/subscribe brokers for pushing events to connected clients.
+
+InMemoryBroker only reaches subscribers in the same process; set REDIS_URL to
+fan events out across gunicorn workers with RedisBroker.
+"""
+import json
+import queue
+import threading
+
+
+class InMemorySubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=1000)
+
+    def get(self, timeout=None):
+        """Next event dict, or None if nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class InMemoryBroker:
+    """Process-local broker, used when no Redis is configured"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                pass  # Slow consumer; it will resync counters on reconnect
+
+    def subscribe(self, channel):
+        subscription = InMemorySubscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout=None):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if not message:
+            return None
+        return json.loads(message['data'])
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    """Redis PUBLISH/SUBSCRIBE broker shared by every worker"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, event):
+        self.client.publish(channel, json.dumps(event))
+
+    def subscribe(self, channel):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(channel)
+        return RedisSubscription(pubsub)
+
+
+def create_broker(redis_url=None):
+    """RedisBroker when a URL is configured, otherwise an InMemoryBroker"""
+    if redis_url:
+        return RedisBroker(redis_url)
+    return InMemoryBroker()
@@ -0,0 +1,114 @@
+"""Per-request SQL instrumentation and N+1 detection.
+
+Engine events record every statement a request runs: the count, total time
+and how often each statement fingerprint (the SQL with whitespace and IN
+lists normalized) repeats. Responses carry the totals in X-Query-Count and
+Server-Timing. Slow statements and SELECTs repeated past a threshold (the
+signature of a per-row lazy load) are logged; in strict mode (tests) a
+repeated SELECT fails the request instead.
+"""
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+IN_LIST_RE = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class NPlusOneError(AssertionError):
+    """Raised in strict mode when a request repeats the same SELECT"""
+
+
+def fingerprint(statement):
+    """Statement text with whitespace collapsed and IN lists reduced to one placeholder"""
+    statement = WHITESPACE_RE.sub(' ', statement.strip())
+    return IN_LIST_RE.sub('(?)', statement)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.fingerprints = Counter()
+        self.slow = []  # [(ms, statement)]
+
+    def record(self, statement, ms, slow_query_ms):
+        self.count += 1
+        self.total_ms += ms
+        self.fingerprints[fingerprint(statement)] += 1
+        if ms >= slow_query_ms:
+            self.slow.append((ms, statement))
+
+    def repeated(self, threshold):
+        """{fingerprint: count} for SELECTs run at least threshold times"""
+        return {
+            statement: count for statement, count in self.fingerprints.items()
+            if count >= threshold and statement.upper().startswith('SELECT')
+        }
+
+
+class QueryInspector:
+    """Attach with init_app(app); reads config keys QUERY_STATS_ENABLED,
+    SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD and N_PLUS_ONE_STRICT.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # Listening on Engine covers every engine and bind the app creates
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    @property
+    def enabled(self):
+        return self.app.config['QUERY_STATS_ENABLED']
+
+    def start(self):
+        if self.enabled:
+            g.query_stats = QueryStats()
+
+    def current(self):
+        """Stats for the request being handled, or None outside one"""
+        if has_request_context():
+            return g.get('query_stats')
+        return None
+
+    def finish(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers.add('Server-Timing', f'db;dur={stats.total_ms:.1f};desc="{stats.count} queries"')
+
+        route = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        for ms, statement in stats.slow:
+            print(f"Slow query ({ms:.0f}ms) in {route}: {fingerprint(statement)[:500]}")
+        repeated = stats.repeated(self.app.config['N_PLUS_ONE_THRESHOLD'])
+        for statement, count in repeated.items():
+            print(f"Possible N+1 in {route}: {count}x {statement[:500]}")
+        if repeated and self.app.config['N_PLUS_ONE_STRICT']:
+            statement, count = max(repeated.items(), key=lambda entry: entry[1])
+            raise NPlusOneError(f"{route} ran the same SELECT {count} times: {statement}")
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self.current()
+        started = conn.info.get('query_started')
+        if stats is not None and started:
+            ms = (time.perf_counter() - started.pop()) * 1000
+            stats.record(statement, ms, self.app.config['SLOW_QUERY_MS'])
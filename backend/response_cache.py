@@ -0,0 +1,98 @@
+"""Cache for public GET responses with tag-based invalidation.
+
+Entries are keyed by endpoint, view arguments and the normalized query string,
+and remember the version of every tag they were built from. Invalidating a tag
+gives it a new version, so every entry built from the old one misses on its
+next lookup and is rebuilt. Entries and tag versions share one backend from
+cache.py (LRU in-process, or Redis across workers).
+"""
+import hashlib
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import g, make_response, request
+
+
+class ResponseCache:
+    def __init__(self, backend, default_ttl=30, enabled=True, on_lookup=None):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self.on_lookup = on_lookup  # Called with whether each lookup hit, e.g. for metrics
+
+    def cached(self, ttl=None, tags=()):
+        """Cache a view's 200 responses for ttl seconds.
+
+        tags is a list, or a callable taking the view's arguments. The view
+        can depend on more tags with add_tags() while it renders.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = self.key(request.endpoint, kwargs)
+                entry = self.backend.get(key)
+                hit = entry is not None and self._current(entry['tags'])
+                if self.on_lookup is not None:
+                    self.on_lookup(hit)
+                if hit:
+                    response = make_response(entry['body'], 200, {'Content-Type': entry['content_type']})
+                    response.headers['X-Cache'] = 'HIT'
+                else:
+                    # Versions are read before rendering so an invalidation mid-render still wins
+                    g.response_cache_tags = list(tags(**kwargs) if callable(tags) else tags)
+                    versions = self._versions(g.response_cache_tags)
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    versions.update(self._versions(set(g.response_cache_tags) - set(versions)))
+                    entry = {
+                        'body': response.get_data(as_text=True),
+                        'content_type': response.content_type,
+                        'etag': hashlib.sha1(response.get_data()).hexdigest(),
+                        'tags': versions
+                    }
+                    self.backend.set(key, entry, ttl=ttl or self.default_ttl)
+                    response.headers['X-Cache'] = 'MISS'
+
+                # Clients may keep the body but must revalidate; unchanged data costs a 304
+                response.set_etag(entry['etag'])
+                response.cache_control.public = True
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def add_tags(self, *tags):
+        """Make the response being rendered depend on more tags"""
+        if 'response_cache_tags' in g:
+            g.response_cache_tags.extend(tags)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', uuid.uuid4().hex)
+
+    def clear(self):
+        self.backend.clear()
+
+    def key(self, endpoint, view_args):
+        query = urlencode(sorted(request.args.items(multi=True)))
+        raw = f'{endpoint}|{urlencode(sorted(view_args.items()))}|{query}'
+        return 'page:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def _versions(self, tags):
+        versions = {}
+        for tag in tags:
+            version = self.backend.get(f'tag:{tag}')
+            if version is None:
+                # Never reuse a version: an evicted tag must not revive entries built before it changed
+                version = uuid.uuid4().hex
+                self.backend.set(f'tag:{tag}', version)
+            versions[tag] = version
+        return versions
+
+    def _current(self, versions):
+        return all(self.backend.get(f'tag:{tag}') == version for tag, version in versions.items())
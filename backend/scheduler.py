@@ -0,0 +1,152 @@
+"""Background scheduler for time-based jobs (appointment reminders).
+
+Every worker process may start a Scheduler, but only the one holding the
+named lease runs jobs; the others stand by and take over if it stops renewing.
+Due work sits in a min-heap so the thread sleeps until exactly the next job.
+With a pub/sub broker, notify() wakes the scheduler in every process, so new
+work queued by a worker that doesn't hold the lease is picked up right away.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+
+
+class DueQueue:
+    """Min-heap of (due_at, key); pushing a key again reschedules it"""
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}  # key -> current due_at; stale heap entries are skipped
+
+    def __len__(self):
+        return len(self._due)
+
+    def push(self, key, due_at):
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, key))
+
+    def replace(self, entries):
+        """Reset to exactly these (key, due_at) entries"""
+        self._due = dict(entries)
+        self._heap = [(due_at, key) for key, due_at in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def next_due(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit):
+        """Up to limit keys due at or before now, earliest first"""
+        keys = []
+        while len(keys) < limit and self.next_due() is not None and self._heap[0][0] <= now:
+            _, key = heapq.heappop(self._heap)
+            del self._due[key]
+            keys.append(key)
+        return keys
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class Scheduler:
+    """Runs due jobs on one background thread while holding a lease.
+
+    load() returns [(key, due_at)] for work due before the next refresh;
+    run(keys) processes one batch and must tolerate keys already handled.
+    acquire_lease(ttl) takes or renews the lease and returns whether it is
+    held. Each tick runs inside context() (e.g. app.app_context).
+    Wake-ups from notify() travel over broker's channel when one is given.
+    """
+
+    def __init__(self, load, run, acquire_lease, context, refresh_interval=60, batch_size=50, lease_ttl=90,
+                 broker=None, channel=None):
+        self.load = load
+        self.run = run
+        self.acquire_lease = acquire_lease
+        self.context = context
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.broker = broker
+        self.channel = channel
+        self.queue = DueQueue()
+        self._next_refresh = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+                self._thread.start()
+                if self.broker is not None:
+                    threading.Thread(target=self._listen, name='scheduler-wakeups', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Reload due work now, e.g. after an appointment changed in this process"""
+        self._wake.set()
+
+    def notify(self):
+        """Reload due work now in whichever process holds the lease"""
+        self.wake()
+        if self.broker is not None:
+            try:
+                self.broker.publish(self.channel, {'type': 'wake'})
+            except Exception as e:
+                print(f"Scheduler wake-up publish failed: {e}")
+
+    def tick(self):
+        """Run everything due and return how many seconds to sleep"""
+        with self.context():
+            if not self.acquire_lease(self.lease_ttl):
+                self.queue.replace([])
+                self._next_refresh = 0
+                return self.lease_ttl / 3
+
+            if self._wake.is_set() or time.monotonic() >= self._next_refresh:
+                self._wake.clear()
+                self.queue.replace(self.load())
+                self._next_refresh = time.monotonic() + self.refresh_interval
+
+            while True:
+                keys = self.queue.pop_due(datetime.utcnow(), self.batch_size)
+                if not keys:
+                    break
+                self.run(keys)
+
+        # Wake for the next job, the next refresh, or to renew the lease
+        sleep = min(self._next_refresh - time.monotonic(), self.lease_ttl / 3)
+        next_due = self.queue.next_due()
+        if next_due is not None:
+            sleep = min(sleep, (next_due - datetime.utcnow()).total_seconds())
+        return max(sleep, 0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                sleep = self.tick()
+            except Exception as e:
+                print(f"Scheduler tick failed: {e}")
+                sleep = self.lease_ttl / 3
+            self._wake.wait(sleep)
+
+    def _listen(self):
+        subscription = self.broker.subscribe(self.channel)
+        try:
+            while not self._stop.is_set():
+                try:
+                    if subscription.get(timeout=1) is not None:
+                        self._wake.set()
+                except Exception as e:
+                    print(f"Scheduler wake-up listener failed: {e}")
+                    self._stop.wait(self.lease_ttl / 3)
+        finally:
+            subscription.close()
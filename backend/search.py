@@ -0,0 +1,171 @@
+"""Full-text search index for item listings.
+
+Postgres keeps a weighted tsvector per item in ``item_search`` behind a GIN
+index; SQLite keeps an FTS5 virtual table of the same name. Any other backend
+(or a SQLite build without FTS5) falls back to substring matching.
+"""
+import re
+
+from sqlalchemy import Float, Integer, event, text
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 16
+
+POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('simple', coalesce({name}, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({username}, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce({description}, '')), 'C')
+"""
+
+POSTGRES_CREATE = [
+    """CREATE TABLE IF NOT EXISTS item_search (
+        item_id INTEGER PRIMARY KEY REFERENCES item (id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_item_search_document ON item_search USING GIN (document)",
+]
+
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5(
+        name, description, username, tokenize='unicode61 remove_diacritics 2'
+    )""",
+]
+
+# bm25 column weights for (name, description, username)
+SQLITE_BM25 = "bm25(item_search, 10.0, 1.0, 5.0)"
+
+
+class ItemSearchIndex:
+    """Keeps ``item_search`` in sync with items and builds ranked search queries"""
+
+    def __init__(self, db, item_model, user_model):
+        self.db = db
+        self.Item = item_model
+        self.User = user_model
+        self._backends = {}
+
+        # Created and dropped together with the ORM tables
+        event.listen(db.metadata, 'after_create', self._after_create)
+        event.listen(db.metadata, 'before_drop', self._before_drop)
+
+    def backend(self, bind=None):
+        """'postgres', 'fts5' or None when only substring matching is available"""
+        bind = bind if bind is not None else self.db.engine
+        key = str(bind.engine.url)
+        if key not in self._backends:
+            dialect = bind.dialect.name
+            if dialect == 'postgresql':
+                self._backends[key] = 'postgres'
+            elif dialect == 'sqlite':
+                with bind.engine.connect() as conn:
+                    has_fts5 = conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar()
+                self._backends[key] = 'fts5' if has_fts5 else None
+            else:
+                self._backends[key] = None
+        return self._backends[key]
+
+    def _after_create(self, target, connection, **kw):
+        backend = self.backend(connection)
+        statements = POSTGRES_CREATE if backend == 'postgres' else SQLITE_CREATE if backend == 'fts5' else []
+        for statement in statements:
+            connection.execute(text(statement))
+
+    def _before_drop(self, target, connection, **kw):
+        if self.backend(connection):
+            connection.execute(text("DROP TABLE IF EXISTS item_search"))
+
+    # Write path
+    def index_item(self, item):
+        """Insert or refresh one item; runs inside the caller's transaction"""
+        backend = self.backend()
+        if not backend:
+            return
+        params = {
+            'item_id': item.id,
+            'name': item.name,
+            'description': item.description,
+            'username': item.user.username if item.user else None,
+        }
+        if backend == 'postgres':
+            document = POSTGRES_DOCUMENT.format(name=':name', username=':username', description=':description')
+            self.db.session.execute(text(
+                f"INSERT INTO item_search (item_id, document) VALUES (:item_id, {document}) "
+                "ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document"
+            ), params)
+        else:
+            self.db.session.execute(text("DELETE FROM item_search WHERE rowid = :item_id"), params)
+            self.db.session.execute(text(
+                "INSERT INTO item_search (rowid, name, description, username) "
+                "VALUES (:item_id, :name, :description, :username)"
+            ), params)
+
+    def reindex_user(self, user_id):
+        """Refresh every item owned by a user, e.g. after a username change"""
+        self._reindex('item.user_id = :user_id', {'user_id': user_id})
+
+    def rebuild(self, connection=None):
+        """Repopulate the whole index from the item table (on connection, e.g. in a migration)"""
+        self._reindex('1 = 1', {}, connection)
+
+    def _reindex(self, where, params, connection=None):
+        backend = self.backend(connection)
+        if not backend:
+            return
+        executor = connection if connection is not None else self.db.session
+        if backend == 'postgres':
+            document = POSTGRES_DOCUMENT.format(name='item.name', username='"user".username', description='item.description')
+            executor.execute(text(
+                f'DELETE FROM item_search USING item WHERE item.id = item_search.item_id AND {where}'
+            ), params)
+            executor.execute(text(
+                f'INSERT INTO item_search (item_id, document) SELECT item.id, {document} '
+                f'FROM item JOIN "user" ON "user".id = item.user_id WHERE {where}'
+            ), params)
+        else:
+            executor.execute(text(
+                f'DELETE FROM item_search WHERE rowid IN (SELECT item.id FROM item WHERE {where})'
+            ), params)
+            executor.execute(text(
+                'INSERT INTO item_search (rowid, name, description, username) '
+                f'SELECT item.id, item.name, item.description, "user".username '
+                f'FROM item JOIN "user" ON "user".id = item.user_id WHERE {where}'
+            ), params)
+
+    # Read path
+    def search(self, query, search, include_owner=True, ranked=True):
+        """Restrict an Item query to matches of search, best matches first.
+
+        With include_owner the owner's username is searched too, so the query
+        must already be joined to User for the substring fallback. Pass
+        ranked=False to leave the ordering to the caller (keyset pagination).
+        """
+        backend = self.backend()
+        if not backend:
+            columns = [self.Item.name, self.Item.description]
+            if include_owner:
+                columns.append(self.User.username)
+            return query.filter(self.db.or_(*[column.ilike(f'%{search}%') for column in columns]))
+
+        terms = TOKEN_RE.findall(search.lower())[:MAX_TERMS]
+        if not terms:
+            return query.filter(self.db.false())
+
+        if backend == 'postgres':
+            # Prefix match every term; weights A/C are name/description, B is the owner
+            weights = '' if include_owner else 'AC'
+            hits = text(
+                "SELECT item_id, ts_rank(document, to_tsquery('simple', :q)) AS rank "
+                "FROM item_search WHERE document @@ to_tsquery('simple', :q)"
+            ).bindparams(q=' & '.join(f'{term}:*{weights}' for term in terms))
+        else:
+            match = ' '.join(f'"{term}"*' for term in terms)
+            if not include_owner:
+                match = f'{{name description}} : ({match})'
+            hits = text(
+                f"SELECT rowid AS item_id, -{SQLITE_BM25} AS rank "
+                "FROM item_search WHERE item_search MATCH :q"
+            ).bindparams(q=match)
+
+        hits = hits.columns(item_id=Integer, rank=Float).subquery('item_search_hits')
+        query = query.join(hits, hits.c.item_id == self.Item.id)
+        return query.order_by(hits.c.rank.desc()) if ranked else query
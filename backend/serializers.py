@@ -0,0 +1,88 @@
+"""Declarative response projections and the JSON encoder behind jsonify.
+
+A Projection names the keys a resource exposes and how each is read from a
+model, so every route returning that resource shares one definition.
+Values are left as Python objects (datetimes included); FastJSONProvider
+encodes them with orjson when it is installed and the stdlib otherwise, with
+datetimes rendered as ISO 8601 either way.
+"""
+import json
+from datetime import date
+from operator import attrgetter
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional C encoder
+    orjson = None
+
+
+class Projection:
+    """Maps an object to a dict.
+
+    Positional fields are attribute names. Keyword fields map a key to a
+    getter called with (obj, context), where context holds per-request values
+    passed to dump/many, or to a nested Projection applied to the attribute
+    of that name (None stays None).
+    """
+
+    def __init__(self, *attributes, **computed):
+        self.fields = {name: None for name in attributes}
+        self.fields.update(computed)
+        # Plain attributes are read in one call; the rest are evaluated per field
+        plain = [name for name, field in self.fields.items() if field is None]
+        self._plain = plain
+        self._read_plain = attrgetter(*plain) if len(plain) > 1 else None
+        self._computed = [(name, field) for name, field in self.fields.items() if field is not None]
+
+    def extend(self, *attributes, **computed):
+        """A copy with more (or replaced) fields"""
+        fields = {**self.fields, **{name: None for name in attributes}, **computed}
+        return Projection(*[name for name, field in fields.items() if field is None],
+                          **{name: field for name, field in fields.items() if field is not None})
+
+    def dump(self, obj, **context):
+        if self._read_plain is not None:
+            result = dict(zip(self._plain, self._read_plain(obj)))
+        else:
+            result = {name: getattr(obj, name) for name in self._plain}
+        for name, field in self._computed:
+            if isinstance(field, Projection):
+                value = getattr(obj, name)
+                result[name] = None if value is None else field.dump(value, **context)
+            else:
+                result[name] = field(obj, context)
+        return result
+
+    def many(self, objs, **context):
+        return [self.dump(obj, **context) for obj in objs]
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes responses with orjson when available"""
+
+    @staticmethod
+    def default(o):
+        # Flask's default would render datetimes as HTTP dates
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def encode(self, obj):
+        """obj as UTF-8 JSON bytes"""
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+            return orjson.dumps(obj, default=self.default, option=option)
+        return json.dumps(obj, default=self.default, ensure_ascii=self.ensure_ascii,
+                          sort_keys=self.sort_keys, separators=(',', ':')).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', self.default)
+            return json.dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
@@ -7,8 +7,11 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-from app import app, db, User, Item
+from app import app, db, User, Item, ItemImage, Conversation, broker, publish_event, counter_cache, response_cache, password_hasher
+from flask_jwt_extended import create_access_token
 from werkzeug.security import generate_password_hash
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 @pytest.fixture
 def client():
@@ -22,6 +25,13 @@ def client():
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
+            counter_cache.clear()
+            response_cache.clear()
+            app.config['N_PLUS_ONE_STRICT'] = True
+            # One process, so the in-memory caches stay in sync
+            app.config['COUNTER_CACHE_ENABLED'] = app.config['EVENT_STREAM_ENABLED'] = response_cache.enabled = True
+            # Cheap inline hashing; test users are created with 1000-iteration hashes
+            password_hasher.method, password_hasher.workers = 'pbkdf2:sha256:1000', 0
             yield client
             db.drop_all()
 
@@ -48,6 +58,59 @@ def auth_headers(client):
     token = json.loads(response.data)['access_token']
     return {'Authorization': f'Bearer {token}'}
 
+@contextmanager
+def count_queries():
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    db.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+def create_user_headers(client, username):
+    user = User(
+        username=username,
+        email=f'{username}@example.com',
+        password_hash=generate_password_hash('password123', method='pbkdf2:sha256:1000'),
+        phone='1234567890',
+        address='Test Address'
+    )
+    db.session.add(user)
+    db.session.commit()
+    
+    response = client.post('/api/login',
+        data=json.dumps({'email': f'{username}@example.com', 'password': 'password123'}),
+        content_type='application/json'
+    )
+    return user, {'Authorization': f"Bearer {json.loads(response.data)['access_token']}"}
+
+def seed_items(count, images_per_item=2):
+    for i in range(count):
+        owner = User(
+            username=f'owner{i}',
+            email=f'owner{i}@example.com',
+            password_hash='x',
+            phone='1234567890',
+            address='Owner Address'
+        )
+        item = Item(
+            name=f'Item {i}',
+            description='Seeded item',
+            category='car',
+            transaction_type='lend',
+            quantity=1,
+            available_quantity=1,
+            user=owner
+        )
+        db.session.add(item)
+        for j in range(images_per_item):
+            db.session.add(ItemImage(item=item, filename=f'{i}-{j}.jpg'))
+    db.session.commit()
+
 class TestAuthentication:
     def test_register_success(self, client):
         response = client.post('/api/register',
@@ -78,6 +141,57 @@ class TestAuthentication:
         data = json.loads(response.data)
         assert 'access_token' in data
 
+    def test_login_rehashes_outdated_password_hashes(self, client, auth_headers):
+        user = User.query.filter_by(email='test@example.com').first()
+        user.password_hash = generate_password_hash('password123', method='pbkdf2:sha256:500')
+        db.session.commit()
+
+        for _ in range(2):
+            response = client.post('/api/login', json={'email': 'test@example.com', 'password': 'password123'})
+            assert response.status_code == 200
+            assert db.session.get(User, user.id).password_hash.startswith('pbkdf2:sha256:1000$')
+        assert client.post('/api/login', json={'email': 'test@example.com', 'password': 'wrong'}).status_code == 401
+
+    def test_hashing_is_capped_per_worker(self, client, auth_headers, monkeypatch):
+        from passwords import PasswordHasher
+        import app as app_module
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=0, max_pending=1, queue_timeout=0.01)
+        monkeypatch.setattr(app_module, 'password_hasher', hasher)
+
+        hasher._slots.acquire()  # another request is hashing
+        try:
+            response = client.post('/api/login', json={'email': 'test@example.com', 'password': 'password123'})
+        finally:
+            hasher._slots.release()
+        assert (response.status_code, response.headers['Retry-After']) == (503, '5')
+        assert client.post('/api/login', json={'email': 'test@example.com', 'password': 'password123'}).status_code == 200
+
+    def test_hashing_process_pool(self):
+        from passwords import PasswordHasher, normalize_method
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+        password_hash = hasher.hash('secret')
+        assert hasher.verify(password_hash, 'secret') and not hasher.verify(password_hash, 'other')
+        assert not hasher.needs_rehash(password_hash)
+        assert normalize_method('pbkdf2') == 'pbkdf2:sha256:600000'
+        assert normalize_method('scrypt:65536') == 'scrypt:65536:8:1'
+
+    def test_hashing_survives_a_broken_pool_and_times_out(self):
+        import os
+        import time
+        from passwords import PasswordHasher, PasswordHasherBusy
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+        
+        # A pool process dying (e.g. OOM killed) breaks the pool; the next hash gets a new one
+        with pytest.raises(Exception):
+            hasher._pool().submit(os._exit, 1).result(timeout=30)
+        assert hasher.verify(hasher.hash('secret'), 'secret')
+        
+        hasher.result_timeout = 0.5
+        with pytest.raises(PasswordHasherBusy):
+            hasher._run(time.sleep, 5)
+        hasher.result_timeout = 30
+        assert hasher.verify(hasher.hash('secret'), 'secret')
+
 class TestItems:
     def test_get_items(self, client):
         response = client.get('/api/items')
@@ -97,4 +211,1491 @@ class TestItems:
             headers=auth_headers
         )
         
-        assert response.status_code == 201
\ No newline at end of file
+        assert response.status_code == 201
+
+class TestQueryBudget:
+    def test_item_listing_query_count_independent_of_page_size(self, client):
+        seed_items(30)
+        
+        with count_queries() as small_page:
+            response = client.get('/api/items?per_page=5')
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['items']) == 5
+        
+        with count_queries() as full_page:
+            response = client.get('/api/items?per_page=30')
+        data = json.loads(response.data)
+        assert len(data['items']) == 30
+        assert len(data['items'][0]['additional_images']) == 2
+        
+        # COUNT + page of items (owner joined) + one batched ItemImage load
+        assert len(full_page) == len(small_page) <= 3
+    
+    def test_my_items_query_count_independent_of_page_size(self, client, auth_headers):
+        user = User.query.filter_by(username='testuser').first()
+        for i in range(20):
+            item = Item(name=f'Mine {i}', category='car', transaction_type='lend', user_id=user.id)
+            db.session.add(item)
+            db.session.add(ItemImage(item=item, filename=f'mine-{i}.jpg'))
+        db.session.commit()
+        
+        with count_queries() as small_page:
+            client.get('/api/my-items?per_page=2', headers=auth_headers)
+        with count_queries() as full_page:
+            response = client.get('/api/my-items?per_page=20', headers=auth_headers)
+        
+        assert len(json.loads(response.data)['items']) == 20
+        assert len(full_page) == len(small_page)
+
+class TestQueryInstrumentation:
+    def test_headers_and_constant_queries_for_requests(self, client, auth_headers):
+        from app import TransactionRequest
+        seed_items(6, images_per_item=0)
+        me = User.query.filter_by(username='testuser').first()
+        for item in Item.query.all():
+            db.session.add(TransactionRequest(item_id=item.id, requester_id=me.id, owner_id=item.user_id))
+        db.session.commit()
+        
+        # Strict mode (on in tests) would fail this if requests were formatted row by row
+        response = client.get('/api/requests', headers=auth_headers)
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['sent']) == 6
+        assert int(response.headers['X-Query-Count']) <= 4
+        assert response.headers['Server-Timing'].startswith('db;dur=')
+    
+    def test_strict_mode_fails_on_repeated_selects(self, client):
+        from app import query_inspector
+        from query_stats import NPlusOneError, fingerprint
+        seed_items(5, images_per_item=0)
+        db.session.expire_all()
+        
+        with app.test_request_context('/api/items'):
+            query_inspector.start()
+            [item.user.username for item in Item.query.all()]  # One lazy load per owner
+            with pytest.raises(NPlusOneError):
+                query_inspector.finish(app.response_class())
+        
+        assert fingerprint('SELECT * FROM item\n WHERE id IN (?, ?,?)') == 'SELECT * FROM item WHERE id IN (?)'
+
+
+class TestReadReplicas:
+    @pytest.fixture
+    def replica(self, client, monkeypatch):
+        # A second SQLite database as the replica bind; it never receives the primary's rows
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+        from app import replica_router
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        db.metadata.create_all(engine)
+        monkeypatch.setitem(db.engines, 'replica_0', engine)
+        monkeypatch.setattr(replica_router, 'replica_keys', ['replica_0'])
+        replica_router.recent_changes.clear()
+        yield engine
+        engine.dispose()
+    
+    def total(self, client, query, headers=None):
+        return json.loads(client.get(f'/api/items?{query}', headers=headers or {}).data)['pagination']['total']
+    
+    def test_reads_use_replica_except_after_own_and_tagged_writes(self, client, auth_headers, replica):
+        seed_items(2, images_per_item=0)
+        assert self.total(client, 'page=1') == 0
+        
+        # The requester's own write pins their reads to the primary; others stay on the replica
+        item_id = Item.query.first().id
+        response = client.post(f'/api/items/{item_id}/request', data=json.dumps({'hours': 2}),
+            content_type='application/json', headers=auth_headers)
+        assert response.status_code == 201
+        assert self.total(client, 'page=2', auth_headers) == 2
+        assert self.total(client, 'page=3') == 0
+        
+        # A write invalidating the listing's cache tag sends everyone's listing reads to the primary
+        client.post('/api/items', data={'name': 'New', 'description': 'd', 'category': 'car',
+            'transaction_type': 'lend', 'price_per_hour': '1'}, headers=auth_headers)
+        assert self.total(client, 'page=4') == 3
+
+    def test_replicas_refused_without_a_shared_cache(self, tmp_path):
+        import subprocess
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'primary.db'}",
+                   DATABASE_REPLICA_URLS=f"sqlite:///{tmp_path / 'replica.db'}", JWT_SECRET_KEY='x' * 32,
+                   UPLOAD_FOLDER=str(tmp_path), REMINDER_SCHEDULER='false', EMAIL_WORKER='false')
+        env.pop('REDIS_URL', None)
+        result = subprocess.run([sys.executable, '-c', 'import app'], cwd=os.path.join(os.path.dirname(__file__), '..'),
+                                env=env, capture_output=True, text=True)
+        assert result.returncode != 0
+        assert 'DATABASE_REPLICA_URLS needs REDIS_URL' in result.stderr
+
+    def test_pool_options_only_size_server_pools(self):
+        from db_routing import pool_options
+        assert pool_options('sqlite:///app.db') == {'pool_pre_ping': True}
+        options = pool_options('postgresql://db/app', pool_size=8, max_overflow=4)
+        assert (options['pool_size'], options['max_overflow'], options['pool_recycle']) == (8, 4, 1800)
+
+    def test_stickiness_markers_use_whole_second_redis_ttls(self):
+        from cache import RedisCache
+        from db_routing import ReplicaRouter
+
+        class FakeRedis:
+            def __init__(self):
+                self.calls = []
+
+            def set(self, key, value, ex=None):
+                # Redis rejects a non-integer EX
+                if ex is not None and not isinstance(ex, int):
+                    raise ValueError(f'invalid expire time {ex!r}')
+                self.calls.append((key, ex))
+
+        cache = RedisCache.__new__(RedisCache)
+        cache.client, cache.prefix = FakeRedis(), 'recent-change:'
+        ReplicaRouter(['replica_0'], cache, sticky_keys=list, lag_seconds=2.5).record('user:1')
+        ReplicaRouter(['replica_0'], cache, sticky_keys=list, lag_seconds=app.config['REPLICA_LAG_SECONDS']).record('user:2')
+
+        assert cache.client.calls == [('recent-change:user:1', 3), ('recent-change:user:2', 5)]
+
+
+class TestMetrics:
+    def test_requests_caches_and_aws_calls_are_exported(self, client):
+        import app as app_module
+        from botocore.stub import Stubber
+        from prometheus_client import REGISTRY
+        
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+        
+        before = sample('http_request_duration_seconds_count', method='GET', route='/api/items', status='200')
+        hits = sample('cache_lookups_total', cache='response', result='hit')
+        client.get('/api/items')
+        client.get('/api/items')
+        
+        assert sample('http_request_duration_seconds_count', method='GET', route='/api/items', status='200') == before + 2
+        assert sample('cache_lookups_total', cache='response', result='hit') == hits + 1
+        
+        ses = app_module.aws_session().client('ses', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        calls = sample('external_call_duration_seconds_count', service='ses', operation='SendEmail', outcome='ok')
+        with Stubber(ses) as stub:
+            stub.add_response('send_email', {'MessageId': 'stubbed'})
+            ses.send_email(Source='a@example.com', Destination={'ToAddresses': ['b@example.com']},
+                Message={'Subject': {'Data': 's'}, 'Body': {'Text': {'Data': 'b'}}})
+        assert sample('external_call_duration_seconds_count', service='ses', operation='SendEmail', outcome='ok') == calls + 1
+        
+        exported = client.get('/metrics').data.decode()
+        assert 'db_pool_checkout_seconds_count' in exported
+        assert 'http_requests_in_progress{method="GET",route="/metrics"} 1.0' in exported
+
+
+class TestSearch:
+    def create_item(self, client, auth_headers, name, description=''):
+        response = client.post('/api/items',
+            data={
+                'name': name,
+                'description': description,
+                'category': 'car',
+                'transaction_type': 'lend'
+            },
+            headers=auth_headers
+        )
+        return json.loads(response.data)['item_id']
+    
+    def search(self, client, term, path='/api/items', headers=None):
+        response = client.get(f'{path}?search={term}', headers=headers)
+        assert response.status_code == 200
+        return [item['name'] for item in json.loads(response.data)['items']]
+    
+    def test_search_ranks_name_matches_first(self, client, auth_headers):
+        self.create_item(client, auth_headers, 'Blue bicycle', 'Lightweight frame')
+        self.create_item(client, auth_headers, 'Sedan', 'Comes with a bicycle rack')
+        self.create_item(client, auth_headers, 'Scooter', 'City commuter')
+        
+        assert self.search(client, 'bicy') == ['Blue bicycle', 'Sedan']
+    
+    def test_search_matches_owner_username(self, client, auth_headers):
+        self.create_item(client, auth_headers, 'Sedan')
+        
+        assert self.search(client, 'testuser') == ['Sedan']
+        assert self.search(client, 'testuser', '/api/my-items', auth_headers) == []
+    
+    def test_search_index_follows_updates(self, client, auth_headers):
+        item_id = self.create_item(client, auth_headers, 'Old name')
+        client.put(f'/api/items/{item_id}',
+            data={'name': 'Vintage roadster', 'transaction_type': 'lend'},
+            headers=auth_headers
+        )
+        
+        assert self.search(client, 'old') == []
+        assert self.search(client, 'roadster') == ['Vintage roadster']
+        
+        client.put('/api/profile', data=json.dumps({'username': 'renamed'}),
+            content_type='application/json', headers=auth_headers)
+        
+        assert self.search(client, 'renamed') == ['Vintage roadster']
+        assert self.search(client, 'testuser') == []
+
+class TestCursorPagination:
+    def test_cursor_walks_every_item_once_without_count(self, client):
+        seed_items(25, images_per_item=0)
+        
+        seen = []
+        cursor = ''
+        while True:
+            with count_queries() as statements:
+                response = client.get(f'/api/items?per_page=10&cursor={cursor}')
+            assert response.status_code == 200
+            assert not any('count(' in statement.lower() for statement in statements)
+            data = json.loads(response.data)
+            seen.extend(item['id'] for item in data['items'])
+            cursor = data['pagination']['next_cursor']
+            if not cursor:
+                break
+        
+        assert len(seen) == 25
+        assert seen == sorted(set(seen), reverse=True)
+        assert data['pagination']['has_next'] is False
+    
+    def test_invalid_cursor_rejected(self, client):
+        response = client.get('/api/items?cursor=not-a-cursor')
+        assert response.status_code == 400
+
+    def test_page_arguments_validated_and_capped(self, client, auth_headers):
+        seed_items(3, images_per_item=0)
+
+        for url in ('/api/items', '/api/my-items'):
+            for query in ('per_page=abc', 'per_page=0', 'per_page=2.5', 'page=x', 'cursor=&per_page=-1'):
+                response = client.get(f'{url}?{query}', headers=auth_headers)
+                assert response.status_code == 400, (url, query)
+        assert client.get('/api/conversations?cursor=&per_page=abc', headers=auth_headers).status_code == 400
+
+        for query in ('per_page=100000', 'cursor=&per_page=100000'):
+            data = json.loads(client.get(f'/api/items?{query}').data)
+            assert data['pagination']['per_page'] == app.config['MAX_PER_PAGE']
+            assert len(data['items']) == 3
+
+class TestRatingAggregates:
+    def rate(self, client, headers, rated_user_id, item_id, stars):
+        return client.post('/api/ratings',
+            data=json.dumps({'rated_user_id': rated_user_id, 'item_id': item_id, 'rating': stars}),
+            content_type='application/json',
+            headers=headers
+        )
+    
+    def test_create_rating_updates_profile_aggregates(self, client, auth_headers):
+        seed_items(3, images_per_item=0)
+        owner = User.query.filter_by(username='owner0').first()
+        item_ids = [item.id for item in Item.query.all()]
+        
+        for item_id, stars in zip(item_ids, [5, 4, 5]):
+            assert self.rate(client, auth_headers, owner.id, item_id, stars).status_code == 201
+        for invalid in (6, 5.0, True, '5'):
+            assert self.rate(client, auth_headers, owner.id, item_ids[0], invalid).status_code == 400
+        
+        with count_queries() as statements:
+            data = json.loads(client.get(f'/api/users/{owner.id}').data)
+        
+        assert data['total_ratings'] == 3
+        assert data['average_rating'] == 4.7
+        assert data['rating_histogram'] == {'1': 0, '2': 0, '3': 0, '4': 1, '5': 2}
+        assert not any('FROM rating' in statement for statement in statements)
+    
+    def test_repair_rating_stats_recomputes_from_ratings(self, client, auth_headers):
+        seed_items(1, images_per_item=0)
+        owner = User.query.filter_by(username='owner0').first()
+        self.rate(client, auth_headers, owner.id, Item.query.first().id, 3)
+        
+        owner.rating_count = 99
+        owner.rating_3_count = 0
+        db.session.commit()
+        
+        result = app.test_cli_runner().invoke(args=['repair-rating-stats'])
+        assert 'repaired for 1 users' in result.output
+        
+        db.session.refresh(owner)
+        assert (owner.rating_count, owner.rating_sum, owner.rating_3_count) == (1, 3, 1)
+    
+    def test_rating_list_loads_raters_and_items_together(self, client, auth_headers):
+        from app import Rating
+        seed_items(7, images_per_item=0)
+        rated = User.query.filter_by(username='testuser').first()
+        for item in Item.query.all():
+            db.session.add(Rating(rater_id=item.user_id, rated_user_id=rated.id, item_id=item.id, rating=4))
+        db.session.commit()
+        db.session.expire_all()
+        
+        # Strict mode (on in tests) fails the request if raters or items load one by one
+        response = client.get(f'/api/users/{rated.id}/ratings')
+        assert response.status_code == 200
+        assert sorted(rating['rater_username'] for rating in json.loads(response.data)) == [f'owner{i}' for i in range(7)]
+
+class TestConversationInbox:
+    def start_conversation(self, client, headers, other_user_id):
+        response = client.post('/api/conversations',
+            data=json.dumps({'user_id': other_user_id}),
+            content_type='application/json',
+            headers=headers
+        )
+        return json.loads(response.data)['conversation_id']
+    
+    def send(self, client, headers, conversation_id, content):
+        response = client.post(f'/api/conversations/{conversation_id}/messages',
+            data=json.dumps({'content': content}),
+            content_type='application/json',
+            headers=headers
+        )
+        return json.loads(response.data)['message_id']
+    
+    def inbox(self, client, headers, query=''):
+        response = client.get(f'/api/conversations{query}', headers=headers)
+        assert response.status_code == 200
+        return json.loads(response.data)
+    
+    def test_inbox_query_count_independent_of_thread_count(self, client, auth_headers):
+        for i in range(12):
+            user, headers = create_user_headers(client, f'trader{i}')
+            conversation_id = self.start_conversation(client, headers, 1)
+            self.send(client, headers, conversation_id, f'hello {i}')
+        
+        with count_queries() as statements:
+            inbox = self.inbox(client, auth_headers)
+        
+        assert len(inbox) == 12
+        assert inbox[0]['other_user']['username'] == 'trader11'
+        assert inbox[0]['last_message']['content'] == 'hello 11'
+        assert all(conversation['unread_count'] == 1 for conversation in inbox)
+        assert len(statements) == 1
+    
+    def test_unread_counters_follow_reads_and_deletes(self, client, auth_headers):
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = self.start_conversation(client, other_headers, 1)
+        first = self.send(client, other_headers, conversation_id, 'first')
+        self.send(client, other_headers, conversation_id, 'second')
+        self.send(client, auth_headers, conversation_id, 'reply')
+        
+        assert self.inbox(client, auth_headers)[0]['unread_count'] == 2
+        assert self.inbox(client, other_headers)[0]['unread_count'] == 1
+        
+        client.delete(f'/api/messages/{first}', headers=other_headers)
+        assert self.inbox(client, auth_headers)[0]['unread_count'] == 1
+        
+        client.post(f'/api/conversations/{conversation_id}/mark-read', headers=auth_headers)
+        assert self.inbox(client, auth_headers)[0]['unread_count'] == 0
+        assert self.inbox(client, other_headers)[0]['unread_count'] == 1
+    
+    def test_inbox_cursor_pagination(self, client, auth_headers):
+        for i in range(5):
+            user, headers = create_user_headers(client, f'trader{i}')
+            self.send(client, headers, self.start_conversation(client, headers, 1), 'hi')
+        
+        first_page = self.inbox(client, auth_headers, '?cursor=&per_page=3')
+        cursor = first_page['pagination']['next_cursor']
+        second_page = self.inbox(client, auth_headers, f'?cursor={cursor}&per_page=3')
+        
+        usernames = [c['other_user']['username'] for c in first_page['conversations'] + second_page['conversations']]
+        assert usernames == ['trader4', 'trader3', 'trader2', 'trader1', 'trader0']
+        assert second_page['pagination']['has_next'] is False
+    
+    def test_read_cursor_drives_is_read_and_unread_counts(self, client, auth_headers):
+        other, other_headers = create_user_headers(client, 'cursorfriend')
+        conversation_id = self.start_conversation(client, auth_headers, other.id)
+        first, second, third = [self.send(client, other_headers, conversation_id, f'm{i}') for i in range(3)]
+        self.send(client, auth_headers, conversation_id, 'mine')
+        
+        with count_queries() as statements:
+            client.post(f'/api/conversations/{conversation_id}/mark-read',
+                data=json.dumps({'last_read_message_id': first}),
+                content_type='application/json',
+                headers=auth_headers
+            )
+        assert not [statement for statement in statements if statement.startswith('UPDATE message')]
+        
+        messages = json.loads(client.get(f'/api/conversations/{conversation_id}/messages', headers=auth_headers).data)
+        assert [message['is_read'] for message in messages] == [True, False, False, False]
+        assert self.inbox(client, auth_headers)[0]['unread_count'] == 2
+        counter_cache.clear()
+        assert json.loads(client.get('/api/messages/count', headers=auth_headers).data)['unread_count'] == 2
+        
+        # Older cursors are ignored; the other side reading marks my message read
+        client.post(f'/api/conversations/{conversation_id}/mark-read', headers=auth_headers)
+        client.post(f'/api/conversations/{conversation_id}/mark-read',
+            data=json.dumps({'last_read_message_id': first}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+        client.post(f'/api/conversations/{conversation_id}/mark-read', headers=other_headers)
+        messages = json.loads(client.get(f'/api/conversations/{conversation_id}/messages', headers=auth_headers).data)
+        assert all(message['is_read'] for message in messages)
+        assert self.inbox(client, auth_headers)[0]['unread_count'] == 0
+        counter_cache.clear()
+        assert json.loads(client.get('/api/messages/count', headers=auth_headers).data)['unread_count'] == 0
+    
+    def test_repair_conversation_summaries(self, client, auth_headers):
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = self.start_conversation(client, other_headers, 1)
+        self.send(client, other_headers, conversation_id, 'hi')
+        
+        Conversation.query.update({'last_message_id': None, 'user1_unread_count': 0, 'user2_unread_count': 0})
+        db.session.commit()
+        
+        result = app.test_cli_runner().invoke(args=['repair-conversation-summaries'])
+        assert 'repaired for 1 conversations' in result.output
+        
+        inbox = self.inbox(client, auth_headers)
+        assert inbox[0]['last_message']['content'] == 'hi'
+        assert inbox[0]['unread_count'] == 1
+
+class TestMessageHistory:
+    def setup_conversation(self, client, auth_headers, count):
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = TestConversationInbox().start_conversation(client, other_headers, 1)
+        message_ids = []
+        for i in range(count):
+            headers = other_headers if i % 2 else auth_headers
+            response = client.post(f'/api/conversations/{conversation_id}/messages',
+                data=json.dumps({'content': f'msg {i}', 'reply_to_id': message_ids[-1] if message_ids else None}),
+                content_type='application/json',
+                headers=headers
+            )
+            message_ids.append(json.loads(response.data)['message_id'])
+        return conversation_id
+    
+    def test_history_resolves_replies_in_constant_queries(self, client, auth_headers):
+        conversation_id = self.setup_conversation(client, auth_headers, 20)
+        
+        with count_queries() as statements:
+            response = client.get(f'/api/conversations/{conversation_id}/messages', headers=auth_headers)
+        messages = json.loads(response.data)
+        
+        assert len(messages) == 20
+        assert messages[5]['reply_to']['content'] == 'msg 4'
+        assert messages[5]['reply_to']['sender_username'] == 'testuser'
+        # Conversation access check + one message query
+        assert len(statements) == 2
+    
+    def test_history_cursor_pages_backwards(self, client, auth_headers):
+        conversation_id = self.setup_conversation(client, auth_headers, 7)
+        url = f'/api/conversations/{conversation_id}/messages?per_page=3&cursor='
+        
+        latest = json.loads(client.get(url, headers=auth_headers).data)
+        assert [m['content'] for m in latest['messages']] == ['msg 4', 'msg 5', 'msg 6']
+        
+        cursor = latest['pagination']['next_cursor']
+        older = json.loads(client.get(url + cursor, headers=auth_headers).data)
+        assert [m['content'] for m in older['messages']] == ['msg 1', 'msg 2', 'msg 3']
+        assert older['pagination']['has_next'] is True
+
+class TestEventStream:
+    def open_stream(self, client, headers):
+        token = headers['Authorization'].split(' ')[1]
+        response = client.get(f'/api/events?jwt={token}', buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        return response, iter(response.response)
+    
+    def next_event(self, stream):
+        chunk = next(stream)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        event_line, data_line = chunk.strip().split('\n')
+        return event_line[len('event: '):], json.loads(data_line[len('data: '):])
+    
+    def test_stream_pushes_messages_and_counters(self, client, auth_headers):
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = TestConversationInbox().start_conversation(client, other_headers, 1)
+        
+        response, stream = self.open_stream(client, auth_headers)
+        assert self.next_event(stream) == ('counters', {'unread_count': 0, 'pending_received': 0})
+        
+        TestConversationInbox().send(client, other_headers, conversation_id, 'ping')
+        
+        event_type, event = self.next_event(stream)
+        assert event_type == 'message'
+        assert event['conversation_id'] == conversation_id
+        assert self.next_event(stream) == ('counters', {'unread_count': 1, 'pending_received': 0})
+        response.close()
+    
+    def test_stream_pushes_request_events(self, client, auth_headers):
+        seed_items(1, images_per_item=0)
+        owner = User.query.filter_by(username='owner0').first()
+        owner_headers = {'Authorization': f'Bearer {create_access_token(identity=str(owner.id))}'}
+        
+        response, stream = self.open_stream(client, owner_headers)
+        self.next_event(stream)
+        
+        client.post(f'/api/items/{Item.query.first().id}/request',
+            data=json.dumps({'quantity_requested': 1}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+        
+        event_type, event = self.next_event(stream)
+        assert (event_type, event['status']) == ('request', 'pending')
+        assert self.next_event(stream) == ('counters', {'unread_count': 0, 'pending_received': 1})
+        response.close()
+    
+    def test_stream_pushes_reads_edits_and_deletes(self, client, auth_headers):
+        inbox = TestConversationInbox()
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = inbox.start_conversation(client, other_headers, 1)
+        message_id = inbox.send(client, other_headers, conversation_id, 'ping')
+        
+        response, stream = self.open_stream(client, other_headers)
+        self.next_event(stream)
+        
+        client.post(f'/api/conversations/{conversation_id}/mark-read', headers=auth_headers)
+        event_type, event = self.next_event(stream)
+        assert (event_type, event['reader_id'], event['last_read_message_id']) == ('read', 1, message_id)
+        self.next_event(stream)
+        
+        client.put(f'/api/messages/{message_id}', data=json.dumps({'content': 'pong'}),
+            content_type='application/json', headers=other_headers)
+        client.delete(f'/api/messages/{message_id}', headers=other_headers)
+        assert [self.next_event(stream)[1]['action'] for _ in range(2)] == ['edited', 'deleted']
+        response.close()
+    
+    def test_streams_capped_per_process(self, client, auth_headers, monkeypatch):
+        import threading
+        import app as app_module
+        monkeypatch.setattr(app_module, 'event_stream_slots', threading.BoundedSemaphore(1))
+        token = auth_headers['Authorization'].split(' ')[1]
+        
+        response, _ = self.open_stream(client, auth_headers)
+        refused = client.get(f'/api/events?jwt={token}')
+        assert refused.status_code == 503
+        assert refused.headers['Retry-After'] == '30'
+        response.close()
+        self.open_stream(client, auth_headers)[0].close()
+        
+        app.config['EVENT_STREAM_ENABLED'] = False
+        assert client.get(f'/api/events?jwt={token}').status_code == 503
+    
+    def test_rolled_back_events_are_not_published(self, client):
+        subscription = broker.subscribe('user:42')
+        db.session.add(User(username='ghost', email='ghost@example.com', password_hash='x', phone='0', address='-'))
+        db.session.flush()
+        publish_event([42], 'message', {'conversation_id': 1})
+        db.session.rollback()
+        db.session.commit()
+        assert subscription.get(timeout=0) is None
+        subscription.close()
+
+class TestBadgeCounters:
+    def counts(self, client, headers):
+        unread = json.loads(client.get('/api/messages/count', headers=headers).data)['unread_count']
+        pending = json.loads(client.get('/api/requests/count', headers=headers).data)['pending_received']
+        return unread, pending
+    
+    def test_counters_served_from_cache_and_kept_in_sync(self, client, auth_headers):
+        inbox = TestConversationInbox()
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = inbox.start_conversation(client, other_headers, 1)
+        
+        assert self.counts(client, auth_headers) == (0, 0)
+        
+        first = inbox.send(client, other_headers, conversation_id, 'one')
+        inbox.send(client, other_headers, conversation_id, 'two')
+        assert self.counts(client, auth_headers) == (2, 0)
+        with count_queries() as statements:
+            assert self.counts(client, auth_headers) == (2, 0)
+        assert statements == []
+        
+        client.delete(f'/api/messages/{first}', headers=other_headers)
+        assert self.counts(client, auth_headers) == (1, 0)
+        
+        client.post(f'/api/conversations/{conversation_id}/mark-read', headers=auth_headers)
+        assert self.counts(client, auth_headers) == (0, 0)
+    
+    def test_request_counter_follows_create_and_respond(self, client, auth_headers):
+        user = User.query.filter_by(username='testuser').first()
+        item = Item(name='Car', category='car', transaction_type='lend', quantity=2, available_quantity=2, user_id=user.id)
+        db.session.add(item)
+        db.session.commit()
+        buyer, buyer_headers = create_user_headers(client, 'buyer')
+        
+        assert self.counts(client, auth_headers) == (0, 0)
+        for _ in range(2):
+            client.post(f'/api/items/{item.id}/request',
+                data=json.dumps({'quantity_requested': 1}),
+                content_type='application/json',
+                headers=buyer_headers
+            )
+        assert self.counts(client, auth_headers) == (0, 2)
+        
+        request_id = json.loads(client.get('/api/requests', headers=auth_headers).data)['received'][0]['id']
+        client.post(f'/api/requests/{request_id}/respond',
+            data=json.dumps({'status': 'accepted'}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+        assert self.counts(client, auth_headers) == (0, 1)
+        
+        # Lazily rebuilt after eviction
+        counter_cache.clear()
+        assert self.counts(client, auth_headers) == (0, 1)
+    
+    def test_counters_read_the_database_without_a_shared_cache(self, client, auth_headers):
+        app.config['COUNTER_CACHE_ENABLED'] = False
+        inbox = TestConversationInbox()
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = inbox.start_conversation(client, other_headers, 1)
+        inbox.send(client, other_headers, conversation_id, 'one')
+        assert self.counts(client, auth_headers) == (1, 0)
+        
+        # Committed by another worker: nothing in this process was told to drop a cached value
+        from app import Message
+        db.session.execute(db.insert(Message).values(conversation_id=conversation_id, sender_id=other.id,
+                                                     content='two', created_at=datetime.utcnow()))
+        db.session.commit()
+        assert self.counts(client, auth_headers) == (2, 0)
+        assert counter_cache.get('unread_messages:1') is None
+
+class TestLRUCache:
+    def test_eviction_and_ttl(self):
+        from cache import LRUCache
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        
+        cache.set('short', 1, ttl=0.01)
+        import time
+        time.sleep(0.02)
+        assert cache.get('short') is None
+
+class TestResponseCache:
+    def test_hit_etag_and_normalized_query(self, client):
+        seed_items(2, images_per_item=0)
+        
+        first = client.get('/api/items?per_page=5&transaction_type=lend')
+        assert first.headers['X-Cache'] == 'MISS'
+        
+        with count_queries() as statements:
+            second = client.get('/api/items?transaction_type=lend&per_page=5')
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.data == first.data
+        assert not statements
+        
+        revalidated = client.get('/api/items?per_page=5&transaction_type=lend',
+            headers={'If-None-Match': first.headers['ETag']})
+        assert revalidated.status_code == 304
+    
+    def test_writes_invalidate_tagged_responses(self, client, auth_headers):
+        seed_items(1, images_per_item=0)
+        item = Item.query.first()
+        owner_id = item.user_id
+        
+        assert len(json.loads(client.get('/api/items').data)['items']) == 1
+        client.get(f'/api/items/{item.id}')
+        client.get(f'/api/users/{owner_id}/ratings')
+        
+        client.post('/api/items', data={'name': 'New', 'description': 'd', 'category': 'car',
+            'transaction_type': 'lend', 'price_per_hour': '1'}, headers=auth_headers)
+        listing = client.get('/api/items')
+        assert listing.headers['X-Cache'] == 'MISS'
+        assert len(json.loads(listing.data)['items']) == 2
+        assert client.get(f'/api/items/{item.id}').headers['X-Cache'] == 'HIT'
+        
+        client.post('/api/ratings', data=json.dumps({'rated_user_id': owner_id, 'item_id': item.id, 'rating': 4}),
+            content_type='application/json', headers=auth_headers)
+        ratings = client.get(f'/api/users/{owner_id}/ratings')
+        assert ratings.headers['X-Cache'] == 'MISS'
+        # The item page shows the owner, so it depends on the owner's tag too
+        assert client.get(f'/api/items/{item.id}').headers['X-Cache'] == 'MISS'
+    
+    def test_deleting_an_image_invalidates_listings(self, client):
+        seed_items(1, images_per_item=2)
+        item = Item.query.first()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(item.user_id))}'}
+        assert len(json.loads(client.get('/api/items').data)['items'][0]['additional_images']) == 2
+        
+        assert client.delete(f'/api/items/{item.id}/images/0', headers=headers).status_code == 200
+        listing = client.get('/api/items')
+        assert listing.headers['X-Cache'] == 'MISS'
+        assert len(json.loads(listing.data)['items'][0]['additional_images']) == 1
+
+
+class TestBenchmarkDataset:
+    def test_seeded_inbox_summaries_match_the_messages(self, client):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+        import dataset
+        from app import Message, TransactionRequest
+        
+        sizes = {'users': 20, 'items': 40, 'conversations': 12, 'messages': 60, 'requests': 30}
+        assert dataset.seed(db, sizes, batch_size=16) == sizes
+        assert (Message.query.count(), TransactionRequest.query.count()) == (60, 30)
+        
+        def summaries():
+            db.session.expire_all()
+            return [(c.last_message_id, c.user1_unread_count, c.user2_unread_count) for c in Conversation.query.order_by(Conversation.id)]
+        
+        seeded = summaries()
+        app.test_cli_runner().invoke(args=['repair-conversation-summaries'])
+        assert summaries() == seeded
+
+
+class TestReservations:
+    def test_parallel_accepts_never_oversell(self, client, monkeypatch, tmp_path):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+        import reservation_benchmark as bench
+        from sqlalchemy import create_engine
+
+        # A file database shared by the request threads (the in-memory one is a single connection)
+        engine = create_engine(f"sqlite:///{tmp_path / 'reservations.db'}", pool_size=16)
+        db.metadata.create_all(engine)
+        bench.serialize_sqlite_writers(engine)
+        monkeypatch.setitem(db.engines, None, engine)
+
+        owner_id, item_id, request_ids = bench.seed_contention(db, capacity=40, requests=300)
+        statuses, _ = bench.fire_accepts(app, owner_id, request_ids, threads=16)
+
+        assert statuses == {200: 40, 400: 260}
+        assert bench.outcome(db, item_id) == (0, 40)
+        db.session.remove()
+        engine.dispose()
+
+    def test_responses_based_on_a_stale_version_conflict(self, client, auth_headers):
+        from app import TransactionRequest
+        owner = User.query.filter_by(username='testuser').first()
+        buyer, _ = create_user_headers(client, 'buyer')
+        item = Item(name='Car', category='car', transaction_type='give_away', user_id=owner.id)
+        db.session.add(item)
+        db.session.flush()
+        transaction_request = TransactionRequest(item_id=item.id, requester_id=buyer.id, owner_id=owner.id)
+        db.session.add(transaction_request)
+        db.session.commit()
+        assert (item.version, transaction_request.version) == (1, 1)
+
+        def respond_concurrently(session, flush_context, instances):
+            # Another response to the same request lands between this one's read and write
+            table = TransactionRequest.__table__
+            session.execute(db.update(table).values(status='rejected', version=table.c.version + 1))
+
+        db.event.listen(db.session, 'before_flush', respond_concurrently)
+        try:
+            response = client.post(f'/api/requests/{transaction_request.id}/respond', json={'status': 'accepted'},
+                headers={'Authorization': f'Bearer {create_access_token(identity=str(owner.id))}'})
+        finally:
+            db.event.remove(db.session, 'before_flush', respond_concurrently)
+
+        assert response.status_code == 409
+        db.session.expire_all()
+        assert db.session.get(Item, item.id).status == 'available'
+
+
+class TestStartup:
+    def test_heavy_packages_load_on_first_use(self):
+        import subprocess
+        script = (
+            "import sys, app\n"
+            "print(sorted(name for name in ('boto3', 'PIL', 'sentry_sdk') if name in sys.modules))\n"
+            "app.s3_client()\n"
+            "print('boto3' in sys.modules)\n"
+        )
+        env = dict(os.environ, AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test', S3_BUCKET_NAME='bucket')
+        env.pop('SENTRY_DSN', None)
+        result = subprocess.run([sys.executable, '-c', script], cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+                                env=env, capture_output=True, text=True, check=True)
+        assert result.stdout.split('\n')[-3:] == ['[]', 'True', '']
+
+
+class TestSerializers:
+    def test_projections_and_both_encoders(self, client, monkeypatch):
+        import serializers
+        from app import ITEM_DETAIL
+        seed_items(1, images_per_item=1)
+        item = Item.query.first()
+        
+        data = ITEM_DETAIL.dump(item)
+        assert data['username'] == 'owner0'
+        assert data['contact']['phone'] == '1234567890'
+        assert data['additional_images'] == ['/api/uploads/0-0.jpg']
+        
+        payload = {'created_at': datetime(2024, 5, 1, 12, 30, 15, 250), 'items': [data]}
+        fast = app.json.encode(payload)
+        monkeypatch.setattr(serializers, 'orjson', None)
+        assert json.loads(app.json.encode(payload)) == json.loads(fast)
+        assert json.loads(fast)['created_at'] == '2024-05-01T12:30:15.000250'
+    
+    def test_routes_encode_datetimes_as_iso(self, client):
+        seed_items(1, images_per_item=0)
+        item = json.loads(client.get('/api/items').data)['items'][0]
+        assert datetime.fromisoformat(item['created_at']) == Item.query.first().created_at
+
+
+class TestImagePipeline:
+    @pytest.fixture
+    def upload_folder(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        return tmp_path
+    
+    def image_file(self, size=(2000, 1500), name='photo.png', color=(200, 30, 30)):
+        import io
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, format='PNG')
+        buffer.seek(0)
+        return buffer, name
+    
+    def create_item(self, client, auth_headers, **image):
+        return client.post('/api/items',
+            data={
+                'name': 'Photo car',
+                'category': 'car',
+                'transaction_type': 'lend',
+                'image': self.image_file(**image)
+            },
+            headers=auth_headers,
+            content_type='multipart/form-data'
+        )
+    
+    def test_create_returns_pending_url_and_job_produces_renditions(self, client, auth_headers, upload_folder, monkeypatch):
+        from PIL import Image
+        import app as app_module
+        jobs = []
+        monkeypatch.setattr(app_module.image_pipeline, 'submit', lambda fn, *args: jobs.append((fn, args)) or True)
+        
+        response = self.create_item(client, auth_headers)
+        data = json.loads(response.data)
+        assert data['image_status'] == 'pending'
+        assert data['image_url'].startswith('/api/uploads/')
+        assert len(jobs) == 1
+        # The queued job reads the upload back from storage
+        assert [f.name.startswith('source_') for f in upload_folder.iterdir()] == [True]
+        
+        fn, args = jobs[0]
+        fn(*args)
+        assert len(list(upload_folder.iterdir())) == 3
+        with app.app_context():
+            assert app_module.ImageJob.query.count() == 0
+        
+        item = json.loads(client.get(f"/api/items/{data['item_id']}").data)
+        assert item['image_status'] == 'ready'
+        assert item['image_url'] == data['image_url']
+        
+        listed = json.loads(client.get('/api/items').data)['items'][0]
+        assert listed['thumbnail_url'].endswith('_thumb.jpg')
+        widths = {
+            url: Image.open(upload_folder / url.rsplit('/', 1)[1]).width
+            for url in (item['image_url'], listed['thumbnail_url'])
+        }
+        assert sorted(widths.values()) == [320, 1200]
+    
+    def test_replacing_image_removes_old_renditions(self, client, auth_headers, upload_folder, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module.image_pipeline, 'workers', 0)
+        
+        item_id = json.loads(self.create_item(client, auth_headers).data)['item_id']
+        old_files = set(upload_folder.iterdir())
+        assert len(old_files) == 3
+        
+        client.put(f'/api/items/{item_id}',
+            data={'name': 'Photo car', 'transaction_type': 'lend', 'image': self.image_file(name='new.jpg', color=(30, 30, 200))},
+            headers=auth_headers,
+            content_type='multipart/form-data'
+        )
+        
+        new_files = set(upload_folder.iterdir())
+        assert len(new_files) == 3
+        assert not old_files & new_files
+    
+    def test_additional_images_processed_concurrently_with_per_image_results(self, client, auth_headers, upload_folder, monkeypatch):
+        import io
+        import app as app_module
+        monkeypatch.setattr(app_module.image_pipeline, 'workers', 0)
+        
+        response = client.post('/api/items',
+            data={
+                'name': 'Gallery car',
+                'category': 'car',
+                'transaction_type': 'lend',
+                'image': self.image_file(name='main.png'),
+                'additional_images': [
+                    self.image_file(name='side.png'),
+                    self.image_file(name='back.png'),
+                    (io.BytesIO(b'not an image'), 'broken.jpg'),
+                    (io.BytesIO(b'hello'), 'notes.txt')
+                ]
+            },
+            headers=auth_headers,
+            content_type='multipart/form-data'
+        )
+        data = json.loads(response.data)
+        
+        assert response.status_code == 201
+        assert data['image_status'] == 'ready'
+        assert {r['name']: r['status'] for r in data['images']} == {
+            'main.png': 'ready', 'side.png': 'ready', 'back.png': 'ready',
+            'broken.jpg': 'failed', 'notes.txt': 'rejected'
+        }
+        
+        item = json.loads(client.get(f"/api/items/{data['item_id']}").data)
+        assert len(item['additional_images']) == 2
+        for url in item['additional_images']:
+            assert (upload_folder / url.rsplit('/', 1)[1]).exists()
+    
+    def test_identical_uploads_share_stored_files(self, client, auth_headers, upload_folder, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module.image_pipeline, 'workers', 0)
+        
+        first = json.loads(self.create_item(client, auth_headers).data)
+        files = set(upload_folder.iterdir())
+        rendered = []
+        with monkeypatch.context() as patch:
+            patch.setattr(app_module, 'render_renditions', lambda *args: rendered.append(args))
+            second = json.loads(self.create_item(client, auth_headers, name='again.png').data)
+        
+        assert second['image_status'] == 'ready'
+        assert second['image_url'] == first['image_url']
+        assert rendered == []
+        assert set(upload_folder.iterdir()) == files
+        with app.app_context():
+            assert {blob.ref_count for blob in app_module.StoredBlob.query} == {2}
+        
+        # Replacing one copy keeps the shared files; replacing the other frees them
+        for item in (first, second):
+            client.put(f"/api/items/{item['item_id']}",
+                data={'name': 'Photo car', 'transaction_type': 'lend', 'image': self.image_file(color=(30, 200, 30))},
+                headers=auth_headers,
+                content_type='multipart/form-data'
+            )
+            assert (files <= set(upload_folder.iterdir())) == (item is first)
+        assert len(list(upload_folder.iterdir())) == 3
+
+    def test_attachments_and_renditions_of_one_photo_stay_apart(self, client, auth_headers, upload_folder, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module.image_pipeline, 'workers', 0)
+        other, other_headers = create_user_headers(client, 'buyer')
+        conversation_id = TestConversationInbox().start_conversation(client, other_headers, 1)
+
+        photo, _ = self.image_file()
+        original = photo.getvalue()
+        message_id = json.loads(client.post(f'/api/conversations/{conversation_id}/messages',
+            data={'message_type': 'image', 'file': (photo, 'photo.jpg')},
+            headers=other_headers,
+            content_type='multipart/form-data'
+        ).data)['message_id']
+        attachment = upload_folder / json.loads(client.get(
+            f'/api/conversations/{conversation_id}/messages', headers=other_headers
+        ).data)[0]['file_url']
+
+        item = json.loads(self.create_item(client, auth_headers, name='photo.jpg').data)
+        assert attachment.read_bytes() == original
+        assert (upload_folder / item['image_url'].rsplit('/', 1)[1]).read_bytes() != original
+
+        # Deleting the message releases the attachment, the item's renditions stay
+        client.delete(f'/api/messages/{message_id}', headers=other_headers)
+        assert not attachment.exists()
+        assert len(list(upload_folder.iterdir())) == 3
+
+    def test_full_queue_processes_in_the_request(self, client, auth_headers, upload_folder, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module.image_pipeline, 'submit', lambda fn, *args: None)
+        
+        data = json.loads(self.create_item(client, auth_headers).data)
+        
+        assert data['image_status'] == 'ready'
+        assert len(list(upload_folder.iterdir())) == 3
+        with app.app_context():
+            assert app_module.ImageJob.query.count() == 0
+    
+    def test_requeue_retries_lost_jobs_and_fails_unrecoverable_ones(self, client, auth_headers, upload_folder, monkeypatch):
+        import app as app_module
+        ImageJob = app_module.ImageJob
+        # A queued job lost to a restart, and one whose request died while processing it
+        monkeypatch.setattr(app_module.image_pipeline, 'submit', lambda fn, *args: True)
+        lost = json.loads(self.create_item(client, auth_headers).data)
+        with monkeypatch.context() as patch:
+            patch.setattr(app_module.image_pipeline, 'workers', 0)
+            patch.setattr(app_module, 'process_image_jobs', lambda jobs: [{'status': 'pending'} for _ in jobs])
+            crashed = json.loads(self.create_item(client, auth_headers, color=(30, 30, 200)).data)
+        
+        result = app.test_cli_runner().invoke(args=['requeue-images'])
+        assert 'Retried 0 image jobs, marked 0 failed' in result.output
+        
+        with app.app_context():
+            ImageJob.query.update({ImageJob.queued_at: datetime.utcnow() - timedelta(hours=1)})
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=['requeue-images'])
+        
+        assert 'Retried 1 image jobs, marked 1 failed' in result.output
+        statuses = {
+            item_id: json.loads(client.get(f'/api/items/{item_id}').data)['image_status']
+            for item_id in (lost['item_id'], crashed['item_id'])
+        }
+        assert statuses == {lost['item_id']: 'ready', crashed['item_id']: 'failed'}
+        assert not [f for f in upload_folder.iterdir() if f.name.startswith('source_')]
+        with app.app_context():
+            assert ImageJob.query.count() == 0
+    
+    def test_pipeline_bounds_its_queue_and_logs_failed_jobs(self, caplog):
+        import concurrent.futures
+        import threading
+        import time
+        from images import ImagePipeline
+        
+        pipeline = ImagePipeline(workers=1, max_pending=1)
+        release = threading.Event()
+        
+        def fail():
+            release.wait(5)
+            raise ValueError('corrupt image')
+        
+        future = pipeline.submit(fail)
+        assert pipeline.submit(fail) is None
+        release.set()
+        concurrent.futures.wait([future])
+        
+        for _ in range(50):
+            if caplog.records:
+                break
+            time.sleep(0.01)
+        assert caplog.records[0].message == 'Image job failed'
+        assert caplog.records[0].exc_info[1].args == ('corrupt image',)
+        assert pipeline.submit(lambda: None) is not None
+    
+    def test_run_concurrently_overlaps_calls(self):
+        import time
+        from images import ImagePipeline
+        
+        started = time.perf_counter()
+        outcomes = ImagePipeline(workers=0, inline_concurrency=4).run_concurrently(time.sleep, [(0.2,)] * 4)
+        
+        assert time.perf_counter() - started < 0.6
+        assert outcomes == [(None, None)] * 4
+
+class TestUploadServing:
+    hashed_name = 'ab' * 32 + '_thumb.jpg'
+    
+    @pytest.fixture
+    def upload_folder(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+        (tmp_path / self.hashed_name).write_bytes(bytes(range(256)) * 4)
+        (tmp_path / 'legacy-upload.jpg').write_bytes(b'legacy')
+        return tmp_path
+    
+    def test_hashed_names_are_immutable_with_content_etag(self, client, upload_folder):
+        response = client.get(f'/api/uploads/{self.hashed_name}')
+        
+        assert response.status_code == 200
+        assert response.headers['ETag'] == f'"{self.hashed_name[:-4]}"'
+        assert response.cache_control.immutable
+        assert response.cache_control.max_age == 31536000
+        
+        legacy = client.get('/api/uploads/legacy-upload.jpg')
+        assert not legacy.cache_control.immutable
+        assert legacy.cache_control.max_age == 86400
+    
+    def test_conditional_requests_return_304(self, client, upload_folder):
+        first = client.get(f'/api/uploads/{self.hashed_name}')
+        
+        by_etag = client.get(f'/api/uploads/{self.hashed_name}', headers={'If-None-Match': first.headers['ETag']})
+        by_date = client.get(f'/api/uploads/{self.hashed_name}', headers={'If-Modified-Since': first.headers['Last-Modified']})
+        
+        assert by_etag.status_code == 304
+        assert by_date.status_code == 304
+        assert by_etag.data == b''
+    
+    def test_byte_ranges(self, client, upload_folder):
+        response = client.get(f'/api/uploads/{self.hashed_name}', headers={'Range': 'bytes=10-19'})
+        
+        assert response.status_code == 206
+        assert response.data == bytes(range(10, 20))
+        assert response.headers['Content-Range'] == 'bytes 10-19/1024'
+    
+    def test_accel_redirect_hands_file_to_nginx(self, client, upload_folder, monkeypatch):
+        monkeypatch.setitem(app.config, 'UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+        
+        response = client.get(f'/api/uploads/{self.hashed_name}')
+        assert response.headers['X-Accel-Redirect'] == f'/protected-uploads/{self.hashed_name}'
+        assert response.data == b''
+        assert response.cache_control.immutable
+        
+        cached = client.get(f'/api/uploads/{self.hashed_name}', headers={'If-None-Match': response.headers['ETag']})
+        assert cached.status_code == 304
+        assert 'X-Accel-Redirect' not in cached.headers
+        
+        assert client.get('/api/uploads/missing.jpg').status_code == 404
+
+class TestMigrations:
+    def test_upgrade_adds_missing_columns_and_indexes_then_stamps(self, client):
+        import sqlalchemy as sa
+        from app import MIGRATIONS
+        from migrations import upgrade
+        
+        engine = sa.create_engine('sqlite://')
+        with engine.begin() as connection:
+            # A rating table from before created_at and the index set existed
+            connection.exec_driver_sql(
+                'CREATE TABLE rating (id INTEGER PRIMARY KEY, rater_id INTEGER, rated_user_id INTEGER, '
+                'item_id INTEGER, rating INTEGER, comment TEXT)'
+            )
+        
+        assert [version for version, _ in upgrade(engine, db.metadata, MIGRATIONS)] == [version for version, _, _ in MIGRATIONS]
+        inspector = sa.inspect(engine)
+        assert 'created_at' in {column['name'] for column in inspector.get_columns('rating')}
+        assert 'ix_rating_rated_user_created' in {index['name'] for index in inspector.get_indexes('rating')}
+        assert 'ix_message_conversation_id' in {index['name'] for index in inspector.get_indexes('message')}
+
+        assert upgrade(engine, db.metadata, MIGRATIONS) == []
+
+    def test_shipped_migrations_keep_their_index_set(self, client):
+        import sqlalchemy as sa
+        from app import MIGRATIONS
+        from migrations import upgrade
+
+        def message_indexes(engine):
+            return {index['name'] for index in sa.inspect(engine).get_indexes('message')}
+
+        # A database upgraded when version 2 was the latest got the index set it shipped with...
+        engine = sa.create_engine('sqlite://')
+        upgrade(engine, db.metadata, MIGRATIONS[:2])
+        assert 'ix_message_unread' in message_indexes(engine)
+        # ...and later migrations replace it
+        upgrade(engine, db.metadata, MIGRATIONS)
+        assert 'ix_message_unread' not in message_indexes(engine)
+        assert 'ix_message_conversation_id' in message_indexes(engine)
+
+    def test_upgrade_backfills_data_of_a_baseline_database(self, client, monkeypatch):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+        from app import MIGRATIONS
+        from migrations import upgrade
+
+        # Tables as the first release created them, with some data
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        with engine.begin() as connection:
+            for statement in (
+                'CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) UNIQUE NOT NULL, email VARCHAR(120) UNIQUE NOT NULL, '
+                'password_hash VARCHAR(128) NOT NULL, phone VARCHAR(20) NOT NULL, phone_verified BOOLEAN, email_verified BOOLEAN, '
+                'zalo_id VARCHAR(50), address VARCHAR(255) NOT NULL, created_at DATETIME)',
+                'CREATE TABLE item (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, description TEXT, category VARCHAR(20) NOT NULL, '
+                'transaction_type VARCHAR(20) NOT NULL, price_per_hour FLOAT, quantity INTEGER, available_quantity INTEGER, '
+                'status VARCHAR(20), image_filename VARCHAR(255), image_url VARCHAR(500), user_id INTEGER NOT NULL, created_at DATETIME)',
+                'CREATE TABLE conversation (id INTEGER PRIMARY KEY, user1_id INTEGER NOT NULL, user2_id INTEGER NOT NULL, '
+                'item_id INTEGER, created_at DATETIME, updated_at DATETIME)',
+                'CREATE TABLE message (id INTEGER PRIMARY KEY, conversation_id INTEGER NOT NULL, sender_id INTEGER NOT NULL, '
+                'message_type VARCHAR(20), content TEXT, file_url VARCHAR(255), location_lat FLOAT, location_lng FLOAT, '
+                'location_name VARCHAR(255), reply_to_id INTEGER, is_edited BOOLEAN, is_deleted BOOLEAN, is_read BOOLEAN, '
+                'created_at DATETIME, edited_at DATETIME)',
+                'CREATE TABLE rating (id INTEGER PRIMARY KEY, rater_id INTEGER NOT NULL, rated_user_id INTEGER NOT NULL, '
+                'item_id INTEGER NOT NULL, rating INTEGER NOT NULL, comment TEXT, created_at DATETIME)',
+                "INSERT INTO user (id, username, email, password_hash, phone, address, created_at) VALUES "
+                "(1, 'alice', 'alice@example.com', 'x', '1', 'a', '2024-01-01'), (2, 'bob', 'bob@example.com', 'x', '2', 'b', '2024-01-01')",
+                "INSERT INTO item (id, name, description, category, transaction_type, quantity, available_quantity, status, user_id, created_at) "
+                "VALUES (1, 'Red Vespa', 'Vintage scooter', 'motorbike', 'lend', 1, 1, 'available', 1, '2024-01-02')",
+                "INSERT INTO rating (rater_id, rated_user_id, item_id, rating, created_at) VALUES "
+                "(2, 1, 1, 5, '2024-01-03'), (2, 1, 1, 3, '2024-01-04')",
+                "INSERT INTO conversation (id, user1_id, user2_id, item_id, created_at, updated_at) VALUES "
+                "(1, 1, 2, 1, '2024-01-02', '2024-01-02')",
+                "INSERT INTO message (conversation_id, sender_id, content, is_deleted, is_read, created_at) VALUES "
+                "(1, 1, 'Hi', 0, 1, '2024-01-02 10:00'), (1, 2, 'Is it free?', 0, 0, '2024-01-02 11:00')",
+            ):
+                connection.exec_driver_sql(statement)
+
+        upgrade(engine, db.metadata, MIGRATIONS)
+        db.session.remove()
+        monkeypatch.setitem(db.engines, None, engine)
+        alice = {'Authorization': f"Bearer {create_access_token(identity='1')}"}
+
+        found = json.loads(client.get('/api/items?search=vespa').data)['items']
+        assert [item['id'] for item in found] == [1]
+        profile = json.loads(client.get('/api/users/1').data)
+        assert (profile['total_ratings'], profile['average_rating'], profile['rating_histogram']['5']) == (2, 4.0, 1)
+        inbox = json.loads(client.get('/api/conversations', headers=alice).data)
+        assert (inbox[0]['last_message']['content'], inbox[0]['unread_count']) == ('Is it free?', 1)
+        assert json.loads(client.get('/api/messages/count', headers=alice).data)['unread_count'] == 1
+        db.session.remove()
+
+class TestQueryPlans:
+    # Tables that grow with usage; reading any of them in full is a regression
+    watched_tables = {'item', 'item_image', 'message', 'conversation', 'transaction_request', 'appointment', 'rating'}
+    
+    @contextmanager
+    def capture_selects(self):
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+        
+        db.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    def seed(self, client, auth_headers):
+        from app import Appointment, Rating, TransactionRequest
+        owner, owner_headers = create_user_headers(client, 'planowner')
+        me = User.query.filter_by(username='testuser').first()
+        seed_items(3)
+        item = Item(name='Plan car', category='car', transaction_type='lend', user=owner)
+        db.session.add(item)
+        db.session.commit()
+        
+        conversation_id = json.loads(client.post('/api/conversations',
+            data=json.dumps({'user_id': owner.id}),
+            headers=auth_headers, content_type='application/json'
+        ).data)['conversation_id']
+        for content in ('hi', 'still there?'):
+            client.post(f'/api/conversations/{conversation_id}/messages',
+                data=json.dumps({'content': content}),
+                headers=owner_headers, content_type='application/json'
+            )
+        db.session.add_all([
+            TransactionRequest(item_id=item.id, requester_id=me.id, owner_id=owner.id, hours=2),
+            Appointment(item_id=item.id, requester_id=me.id, owner_id=owner.id, status='confirmed',
+                        appointment_time=datetime.utcnow() + timedelta(minutes=10), location='Here'),
+            Rating(rater_id=me.id, rated_user_id=owner.id, item_id=item.id, rating=5)
+        ])
+        db.session.commit()
+        return owner, owner_headers, conversation_id
+    
+    def test_hot_queries_use_indexes(self, client, auth_headers):
+        from migrations import explain, full_scans
+        owner, owner_headers, conversation_id = self.seed(client, auth_headers)
+        
+        routes = [
+            ('/api/items', None),
+            ('/api/items?transaction_type=lend', None),
+            ('/api/items?cursor=', None),
+            (f'/api/users/{owner.id}', None),
+            (f'/api/users/{owner.id}/ratings', None),
+            ('/api/conversations', auth_headers),
+            (f'/api/conversations/{conversation_id}/messages', auth_headers),
+            ('/api/messages/count', auth_headers),
+            ('/api/requests', owner_headers),
+            ('/api/requests/count', owner_headers),
+            ('/api/appointments', auth_headers),
+            ('/api/appointments/reminders', auth_headers),
+        ]
+        counter_cache.clear()
+        scans = {}
+        for path, headers in routes:
+            with self.capture_selects() as statements:
+                assert client.get(path, headers=headers).status_code == 200
+            assert statements, path
+            with db.engine.connect() as connection:
+                for statement, parameters in statements:
+                    scanned = full_scans(explain(connection, statement, parameters)) & self.watched_tables
+                    if scanned:
+                        scans.setdefault(path, []).append((sorted(scanned), statement))
+        
+        assert scans == {}
+    
+    def test_full_scans_parses_sqlite_and_postgres_plans(self):
+        from migrations import full_scans
+        
+        assert full_scans(['SCAN message', 'SEARCH user USING INTEGER PRIMARY KEY (rowid=?)']) == {'message'}
+        assert full_scans(['SCAN item_search VIRTUAL TABLE INDEX 0:M3']) == set()
+        assert full_scans(['Hash Join', '  ->  Seq Scan on item  (cost=0.00..1.01 rows=1 width=4)']) == {'item'}
+        assert full_scans(['Index Scan using ix_item_user_created on item']) == set()
+
+class TestReminderScheduler:
+    @pytest.fixture
+    def sent(self, monkeypatch):
+        import app as app_module
+        from mailer import StubMailer
+        monkeypatch.setattr(app_module, 'mailer', StubMailer(verbose=False, keep_sent=True))
+        return app_module.mailer.sent
+    
+    def appointment(self, client, minutes_from_now, status='confirmed'):
+        from app import Appointment
+        requester, _ = create_user_headers(client, f'requester{minutes_from_now}{status}')
+        owner, _ = create_user_headers(client, f'owner{minutes_from_now}{status}')
+        item = Item(name='Reminder car', category='car', transaction_type='lend', user=owner)
+        appointment = Appointment(item=item, requester_id=requester.id, owner_id=owner.id, status=status,
+                                  appointment_time=datetime.utcnow() + timedelta(minutes=minutes_from_now), location='Here')
+        db.session.add(appointment)
+        db.session.commit()
+        return appointment
+    
+    def tick(self):
+        from app import reminder_scheduler, deliver_pending_emails
+        reminder_scheduler.wake()
+        sleep = reminder_scheduler.tick()
+        deliver_pending_emails()  # as the deliver-emails cron would
+        return sleep
+    
+    def test_notify_wakes_the_lease_holder_in_another_process(self):
+        import threading
+        from contextlib import nullcontext
+        from pubsub import InMemoryBroker
+        from scheduler import Scheduler
+        broker = InMemoryBroker()
+        loads = threading.Semaphore(0)
+
+        def load():
+            loads.release()
+            return []
+
+        # The lease holder, and a worker without the lease that queued new work
+        holder = Scheduler(load, lambda keys: None, lambda ttl: True, nullcontext, refresh_interval=3600,
+                           broker=broker, channel='scheduler:test')
+        other = Scheduler(lambda: [], lambda keys: None, lambda ttl: False, nullcontext, broker=broker, channel='scheduler:test')
+        holder.start()
+        try:
+            assert loads.acquire(timeout=5)
+            while not broker._subscribers.get('scheduler:test'):
+                threading.Event().wait(0.01)
+            other.notify()
+            assert loads.acquire(timeout=5)  # reloaded long before the next refresh
+        finally:
+            holder.stop()
+
+    def test_due_queue_pops_earliest_and_reschedules(self):
+        from scheduler import DueQueue
+        now = datetime(2024, 1, 1, 12, 0)
+        queue = DueQueue()
+        queue.push('a', now + timedelta(minutes=5))
+        queue.push('b', now - timedelta(minutes=1))
+        queue.push('c', now - timedelta(minutes=2))
+        queue.push('a', now - timedelta(minutes=3))  # rescheduled earlier
+        
+        assert queue.next_due() == now - timedelta(minutes=3)
+        assert queue.pop_due(now, limit=2) == ['a', 'c']
+        assert queue.pop_due(now, limit=10) == ['b']
+        assert queue.next_due() is None and len(queue) == 0
+    
+    def test_due_reminders_sent_once_in_a_batch(self, client, sent):
+        due = self.appointment(client, 10)
+        later = self.appointment(client, 45)
+        pending = self.appointment(client, 10, status='pending')
+        
+        sleep = self.tick()
+        
+        assert sorted(email[0] for email in sent) == sorted([due.requester.email, due.owner.email])
+        assert 0 < sleep <= 30
+        self.tick()
+        assert len(sent) == 2
+        db.session.expire_all()
+        assert (due.reminder_sent, later.reminder_sent, pending.reminder_sent) == (True, False, False)
+    
+    def test_only_the_lease_holder_sends(self, client, sent):
+        from app import SchedulerLease
+        self.appointment(client, 10)
+        lease = SchedulerLease(name='appointment-reminders', holder='other-worker',
+                               expires_at=datetime.utcnow() + timedelta(seconds=60))
+        db.session.add(lease)
+        db.session.commit()
+        
+        self.tick()
+        assert sent == []
+        
+        lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.tick()
+        assert len(sent) == 2
+    
+    def test_reminders_endpoint_is_read_only(self, client, auth_headers, sent):
+        from app import Appointment
+        me = User.query.filter_by(username='testuser').first()
+        appointment = self.appointment(client, 10)
+        appointment.requester_id = me.id
+        db.session.commit()
+        
+        reminders = json.loads(client.get('/api/appointments/reminders', headers=auth_headers).data)
+        
+        assert [reminder['id'] for reminder in reminders] == [appointment.id]
+        db.session.expire_all()
+        assert Appointment.query.get(appointment.id).reminder_sent is False
+
+class TestEmailOutbox:
+    @pytest.fixture
+    def mailer(self, monkeypatch):
+        import app as app_module
+        from mailer import StubMailer
+        monkeypatch.setattr(app_module, 'mailer', StubMailer(verbose=False, keep_sent=True))
+        return app_module.mailer
+    
+    def outbox(self):
+        from app import EmailOutbox
+        db.session.expire_all()
+        return EmailOutbox.query.order_by(EmailOutbox.id).all()
+    
+    def test_routes_enqueue_and_worker_delivers(self, client, auth_headers, mailer, monkeypatch):
+        import app as app_module
+        monkeypatch.setitem(app.config, 'EMAIL_WORKER', True)
+        wakes = []
+        monkeypatch.setattr(app_module.email_worker, 'start', lambda: None)
+        monkeypatch.setattr(app_module.email_worker, 'wake', lambda: wakes.append(True))
+        
+        response = client.post('/api/forgot-password',
+            data=json.dumps({'email': 'test@example.com'}),
+            content_type='application/json'
+        )
+        
+        assert response.status_code == 200
+        assert (mailer.sent, wakes) == ([], [True])
+        [email] = self.outbox()
+        assert (email.status, email.subject) == ('pending', 'Password Reset Code')
+        
+        assert app_module.deliver_pending_emails() == 1
+        assert mailer.sent[0][0] == 'test@example.com'
+        email = self.outbox()[0]
+        assert (email.status, email.attempts) == ('sent', 1)
+        assert app_module.deliver_pending_emails() == 0
+    
+    def test_without_worker_requests_only_enqueue(self, client, auth_headers, mailer, monkeypatch):
+        import app as app_module
+        monkeypatch.setitem(app.config, 'EMAIL_WORKER', False)
+        monkeypatch.setattr(app_module.email_worker, 'notify', lambda: pytest.fail('no worker to wake'))
+        app_module.queue_email('backlog@example.com', 'Hello', 'Body')
+        db.session.commit()
+        
+        client.post('/api/send-email-verification', headers=auth_headers)
+        client.post('/api/forgot-password',
+            data=json.dumps({'email': 'test@example.com'}),
+            content_type='application/json'
+        )
+        assert mailer.sent == []
+        assert [email.status for email in self.outbox()] == ['pending'] * 3
+        
+        result = app.test_cli_runner().invoke(args=['deliver-emails'])
+        assert 'Delivered 3 emails' in result.output
+        assert [to for to, _, _ in mailer.sent] == ['backlog@example.com', 'test@example.com', 'test@example.com']
+    
+    def test_stub_mailer_logs_subjects_only(self, capsys):
+        from mailer import StubMailer
+        
+        stub = StubMailer()
+        stub.send('someone@example.com', 'Password Reset Code', 'Your password reset code is: 123456')
+        
+        assert stub.sent == []
+        assert capsys.readouterr().out.strip() == 'Email (not sent, no SES configured): Password Reset Code'
+    
+    def test_failures_back_off_then_give_up(self, client, mailer, monkeypatch):
+        import app as app_module
+        monkeypatch.setitem(app.config, 'EMAIL_MAX_ATTEMPTS', 2)
+        mailer.failures = [RuntimeError('Throttling'), RuntimeError('Throttling')]
+        app_module.queue_email('someone@example.com', 'Hello', 'Body')
+        db.session.commit()
+        
+        app_module.deliver_pending_emails()
+        email = self.outbox()[0]
+        assert (email.status, email.attempts, email.last_error) == ('pending', 1, 'Throttling')
+        assert email.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+        assert app_module.deliver_pending_emails() == 0  # not due yet
+        
+        email.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        app_module.deliver_pending_emails()
+        assert (self.outbox()[0].status, mailer.sent) == ('failed', [])
+    
+    def test_ses_mailer_reuses_one_client(self, monkeypatch):
+        import boto3
+        from mailer import SESMailer
+        clients = []
+        
+        class FakeSES:
+            def __init__(self):
+                self.calls = []
+            
+            def send_email(self, **kwargs):
+                self.calls.append(kwargs)
+        
+        monkeypatch.setattr(boto3, 'client', lambda *args, **kwargs: clients.append(FakeSES()) or clients[-1])
+        ses = SESMailer(source='noreply@example.com', region='us-east-1')
+        for i in range(3):
+            ses.send(f'user{i}@example.com', 'Hi', 'Body')
+        
+        assert len(clients) == 1
+        assert [call['Destination']['ToAddresses'] for call in clients[0].calls] == [[f'user{i}@example.com'] for i in range(3)]
@@ -37,15 +37,19 @@ const Appointments = () => {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       
+      // The endpoint lists every appointment starting soon; notify once per appointment
+      const notified = JSON.parse(localStorage.getItem('notifiedReminders') || '[]');
       response.data.forEach(reminder => {
         const currentUser = JSON.parse(localStorage.getItem('user'));
-        if (reminder.requester_id === currentUser.id || reminder.owner_id === currentUser.id) {
+        if ((reminder.requester_id === currentUser.id || reminder.owner_id === currentUser.id) && !notified.includes(reminder.id)) {
+          notified.push(reminder.id);
           new Notification(`Appointment Reminder`, {
             body: `Your appointment for "${reminder.item_name}" is in 30 minutes at ${reminder.location}`,
             icon: '/favicon.ico'
           });
         }
       });
+      localStorage.setItem('notifiedReminders', JSON.stringify(notified.slice(-100)));
     } catch (error) {
       console.error('Error checking reminders:', error);
     }
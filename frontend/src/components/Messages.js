@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
+import { subscribeToEvents } from '../eventStream';
 
 const Messages = () => {
   const [conversations, setConversations] = useState([]);
@@ -20,12 +21,22 @@ const Messages = () => {
   useEffect(() => {
     fetchConversations();
     
-    // Auto-refresh conversations list every 2 seconds
-    const conversationInterval = setInterval(() => {
-      fetchConversations();
-    }, 2000);
+    // Refresh the conversations list on pushed events; poll every 2 seconds only without the event stream
+    let conversationInterval = null;
+    const unsubscribe = subscribeToEvents((type) => {
+      if (type === 'message' || type === 'read' || type === 'open') {
+        fetchConversations();
+      } else if (type === 'unavailable' && !conversationInterval) {
+        conversationInterval = setInterval(() => {
+          fetchConversations();
+        }, 2000);
+      }
+    });
     
-    return () => clearInterval(conversationInterval);
+    return () => {
+      unsubscribe();
+      if (conversationInterval) clearInterval(conversationInterval);
+    };
   }, []);
   
   // Real-time user search effect
@@ -43,20 +54,37 @@ const Messages = () => {
       markMessagesAsRead(selectedConversation.id);
       fetchConversationAppointments(selectedConversation.id);
       
-      // Much faster refresh for messages (every 1 second)
-      const messageInterval = setInterval(() => {
-        fetchMessages(selectedConversation.id);
-        markMessagesAsRead(selectedConversation.id);
-      }, 1000);
-      
-      // Slower refresh for appointments (every 5 seconds)
-      const appointmentInterval = setInterval(() => {
-        fetchConversationAppointments(selectedConversation.id);
-      }, 5000);
+      // New, edited and deleted messages, read receipts and appointment changes are pushed;
+      // without the event stream fall back to polling (messages every second, appointments every 5)
+      let messageInterval = null;
+      let appointmentInterval = null;
+      const unsubscribe = subscribeToEvents((type, data) => {
+        if (type === 'open') {
+          fetchMessages(selectedConversation.id);
+          markMessagesAsRead(selectedConversation.id);
+          fetchConversationAppointments(selectedConversation.id);
+        } else if (type === 'message' && data.conversation_id === selectedConversation.id) {
+          fetchMessages(selectedConversation.id);
+          markMessagesAsRead(selectedConversation.id);
+        } else if (type === 'read' && data.conversation_id === selectedConversation.id) {
+          fetchMessages(selectedConversation.id);
+        } else if (type === 'appointment' || type === 'appointment_reminder') {
+          fetchConversationAppointments(selectedConversation.id);
+        } else if (type === 'unavailable' && !messageInterval) {
+          messageInterval = setInterval(() => {
+            fetchMessages(selectedConversation.id);
+            markMessagesAsRead(selectedConversation.id);
+          }, 1000);
+          appointmentInterval = setInterval(() => {
+            fetchConversationAppointments(selectedConversation.id);
+          }, 5000);
+        }
+      });
       
       return () => {
-        clearInterval(messageInterval);
-        clearInterval(appointmentInterval);
+        unsubscribe();
+        if (messageInterval) clearInterval(messageInterval);
+        if (appointmentInterval) clearInterval(appointmentInterval);
       };
     }
   }, [selectedConversation]);
@@ -339,7 +367,7 @@ const Messages = () => {
 
           {message.message_type === 'image' && message.file_url && (
             <img 
-              src={`/api/uploads/${message.file_url}`}
+              src={message.file_url.startsWith('http') ? message.file_url : `/api/uploads/${message.file_url}`}
               alt="Shared image"
               style={{ maxWidth: '200px', borderRadius: '8px', marginBottom: '0.5rem' }}
             />
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
+import { subscribeToEvents } from '../eventStream';
 
 const Navbar = ({ user, logout }) => {
   const [requestCount, setRequestCount] = useState(0);
@@ -11,13 +12,24 @@ const Navbar = ({ user, logout }) => {
       fetchRequestCount();
       fetchUnreadMessageCount();
       
-      // Set up auto-refresh every 10 seconds
-      const interval = setInterval(() => {
-        fetchRequestCount();
-        fetchUnreadMessageCount();
-      }, 10000);
+      // Counters are pushed over the event stream; poll every 10 seconds only if it is unavailable
+      let interval = null;
+      const unsubscribe = subscribeToEvents((type, data) => {
+        if (type === 'counters') {
+          setRequestCount(data.pending_received);
+          setUnreadMessageCount(data.unread_count);
+        } else if (type === 'unavailable' && !interval) {
+          interval = setInterval(() => {
+            fetchRequestCount();
+            fetchUnreadMessageCount();
+          }, 10000);
+        }
+      });
       
-      return () => clearInterval(interval);
+      return () => {
+        unsubscribe();
+        if (interval) clearInterval(interval);
+      };
     }
   }, [user]);
 
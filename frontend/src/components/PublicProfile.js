@@ -188,7 +188,7 @@ const PublicProfile = () => {
                 >
                   {item.image_url && (
                     <img
-                      src={item.image_url}
+                      src={item.thumbnail_url || item.image_url}
                       alt={item.name}
                       style={{ width: '100%', height: '220px', objectFit: 'cover', flexShrink: 0 }}
                     />
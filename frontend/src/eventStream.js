@@ -0,0 +1,54 @@
+// One /api/events connection per tab, shared by every component that listens.
+// Listeners are called with (type, data). Besides the server's events they get
+// 'open' whenever the stream (re)connects, so they can catch up on anything
+// missed, and 'unavailable' when the server refuses the stream (disabled, or too
+// many open streams), so they can fall back to polling.
+
+const EVENT_TYPES = ['counters', 'message', 'read', 'request', 'appointment', 'appointment_reminder'];
+
+const listeners = new Set();
+let source = null;
+let unavailable = false;
+
+const notify = (type, data) => {
+  listeners.forEach((listener) => listener(type, data));
+};
+
+const connect = () => {
+  const token = localStorage.getItem('token');
+  const stream = new EventSource(`/api/events?jwt=${encodeURIComponent(token)}`);
+  stream.onopen = () => notify('open');
+  stream.onerror = () => {
+    // EventSource reconnects by itself after network errors; CLOSED means it was refused
+    if (stream.readyState === EventSource.CLOSED && source === stream) {
+      source = null;
+      unavailable = true;
+      notify('unavailable');
+    }
+  };
+  EVENT_TYPES.forEach((type) => {
+    stream.addEventListener(type, (event) => notify(type, JSON.parse(event.data)));
+  });
+  source = stream;
+};
+
+export const subscribeToEvents = (listener) => {
+  listeners.add(listener);
+  if (unavailable || typeof EventSource === 'undefined') {
+    setTimeout(() => listeners.has(listener) && listener('unavailable'), 0);
+  } else if (!source) {
+    connect();
+  }
+
+  return () => {
+    listeners.delete(listener);
+    if (!listeners.size) {
+      // e.g. on logout; the next subscriber connects again with the current token
+      if (source) {
+        source.close();
+        source = null;
+      }
+      unavailable = false;
+    }
+  };
+};